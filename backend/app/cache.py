@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Hashable, Callable, Awaitable
+
+from pydantic import BaseModel
+
+from .singleflight import SingleFlight
+from .sql_utils import normalize_sql
+
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Entries younger than this are served as is
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "60"))
+# After that, entries are served stale for this much longer while a refresh runs in the background
+QUERY_CACHE_STALE_SECONDS = float(os.getenv("QUERY_CACHE_STALE_SECONDS", "300"))
+
+def _estimate_size(value: Any) -> int:
+    """Rough in-memory footprint of a cached value, by its serialized length"""
+    if isinstance(value, BaseModel):
+        return len(value.model_dump_json())
+    return len(json.dumps(value, default=str))
+
+class _Entry:
+    def __init__(self, value: Any, watermark: Hashable, size: int):
+        self.value = value
+        self.watermark = watermark
+        self.size = size
+        self.stored_at = time.monotonic()
+
+class QueryCache:
+    """Query results shared across endpoints, keyed by dataset, normalized SQL and parameters.
+
+    Each entry remembers the freshness watermark it was computed at (for
+    example the rollup generation). An entry is fresh while the watermark
+    is unchanged and it is younger than the TTL; past that it is served
+    stale for a grace period while one background task recomputes it. Once
+    the watermark moves on, the entry is a miss.
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES,
+                 ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+                 stale_seconds: float = QUERY_CACHE_STALE_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        # Ordered least recently used first
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self._revalidating = set()
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    async def get(self, dataset_id: Any, sql: str, params: Tuple, watermark: Hashable,
+                  compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached result for a query, computing it on a miss"""
+        key = (str(dataset_id) if dataset_id else None, normalize_sql(sql), tuple(params))
+        entry = self._entries.get(key)
+        # An entry from before the data last changed is never served, not even stale
+        if entry is not None and entry.watermark == watermark:
+            age = time.monotonic() - entry.stored_at
+            if age < self.ttl_seconds:
+                self.counters["hits"] += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.counters["stale_hits"] += 1
+                self._entries.move_to_end(key)
+                self._revalidate(key, watermark, compute)
+                return entry.value
+
+        self.counters["misses"] += 1
+        return await self._flight.do(key, lambda: self._compute(key, watermark, compute))
+
+    def invalidate(self, sql: str, dataset_id: Any = None) -> int:
+        """Drop every entry for a query, across parameters; returns the number dropped"""
+        normalized = normalize_sql(sql)
+        dataset = str(dataset_id) if dataset_id else None
+        keys = [k for k in self._entries if k[1] == normalized and k[0] == dataset]
+        for key in keys:
+            self._remove(key)
+        self.counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round((self.counters["hits"] + self.counters["stale_hits"]) / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    async def _compute(self, key: Tuple, watermark: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await compute()
+        self._store(key, _Entry(value, watermark, _estimate_size(value)))
+        return value
+
+    def _revalidate(self, key: Tuple, watermark: Hashable, compute: Callable[[], Awaitable[Any]]):
+        task = asyncio.ensure_future(self._flight.do(key, lambda: self._compute(key, watermark, compute)))
+        self._revalidating.add(task)
+        task.add_done_callback(self._revalidated)
+
+    def _revalidated(self, task: asyncio.Task):
+        self._revalidating.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Query cache refresh failed: {task.exception()}")
+
+    def _store(self, key: Tuple, entry: _Entry):
+        # Results too large for the budget are returned but not kept
+        if entry.size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+# Global query result cache
+query_cache = QueryCache()
+
+async def cached_fetch(pool, sql: str, *args, watermark: Hashable = None):
+    """conn.fetch on the built-in database through the shared cache; a pool connection is only taken on a miss"""
+    async def compute():
+        async with pool.acquire() as conn:
+            return await conn.fetch(sql, *args)
+    return await query_cache.get(None, sql, args, watermark, compute)
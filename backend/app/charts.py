@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from .rollups import order_rollups
+from .cache import cached_fetch
+from .payloads import Frame
+
+# Supported bucket sizes, mapped to the Postgres interval used to step through them
+GRANULARITIES = {
+    "hour": "1 hour",
+    "day": "1 day",
+    "week": "1 week",
+    "month": "1 month",
+}
+
+LABEL_FORMATS = {
+    "hour": "%m/%d %H:00",
+    "day": "%m/%d",
+    "week": "%m/%d",
+    "month": "%Y-%m",
+}
+
+# Upper bound on points per series so hourly views over long ranges stay bounded
+MAX_BUCKETS = 10000
+
+REVENUE_TREND_SQL = """
+    SELECT b.bucket, COALESCE(r.revenue, 0) AS revenue
+    FROM generate_series($2::timestamp, $3::timestamp - ($4::text)::interval, ($4::text)::interval) AS b(bucket)
+    LEFT JOIN (
+        SELECT date_trunc($1, created_at) AS bucket, SUM(total_amount) AS revenue
+        FROM orders
+        WHERE status = 'completed' AND created_at >= $2 AND created_at < $3
+        GROUP BY 1
+    ) r USING (bucket)
+    ORDER BY b.bucket
+"""
+
+ORDERS_BY_STATUS_SQL = """
+    SELECT status, COUNT(*) as count
+    FROM orders
+    WHERE created_at >= $1
+    GROUP BY status
+"""
+
+TOP_PRODUCTS_SQL = """
+    SELECT p.name, SUM(oi.quantity) as sales
+    FROM products p
+    JOIN order_items oi ON p.id = oi.product_id
+    JOIN orders o ON oi.order_id = o.id
+    WHERE o.created_at >= $1
+    GROUP BY p.id, p.name
+    ORDER BY sales DESC
+    LIMIT 5
+"""
+
+# Running distinct users: each user is counted once, in the bucket of their first order,
+# and the series is a cumulative sum on top of everyone seen before the window.
+USER_GROWTH_SQL = """
+    WITH first_seen AS (
+        SELECT MIN(created_at) AS first_at
+        FROM orders
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ), new_users AS (
+        SELECT date_trunc($1, first_at) AS bucket, COUNT(*) AS users
+        FROM first_seen
+        WHERE first_at >= $2 AND first_at < $3
+        GROUP BY 1
+    )
+    SELECT b.bucket,
+           (SELECT COUNT(*) FROM first_seen WHERE first_at < $2)
+           + SUM(COALESCE(n.users, 0)) OVER (ORDER BY b.bucket) AS users
+    FROM generate_series($2::timestamp, $3::timestamp - ($4::text)::interval, ($4::text)::interval) AS b(bucket)
+    LEFT JOIN new_users n USING (bucket)
+    ORDER BY b.bucket
+"""
+
+# Rollup-backed versions of the series above. The daily rollups serve any
+# granularity of a day or coarser; user growth reads first orders per user.
+ROLLUP_REVENUE_TREND_SQL = """
+    SELECT b.bucket, COALESCE(r.revenue, 0) AS revenue
+    FROM generate_series($2::timestamp, $3::timestamp - ($4::text)::interval, ($4::text)::interval) AS b(bucket)
+    LEFT JOIN (
+        SELECT date_trunc($1, day::timestamp) AS bucket, SUM(revenue) AS revenue
+        FROM orders_daily
+        WHERE status = 'completed' AND day >= $2 AND day < $3
+        GROUP BY 1
+    ) r USING (bucket)
+    ORDER BY b.bucket
+"""
+
+ROLLUP_ORDERS_BY_STATUS_SQL = """
+    SELECT status, SUM(order_count)::bigint AS count
+    FROM orders_daily
+    WHERE day >= $1
+    GROUP BY status
+"""
+
+ROLLUP_TOP_PRODUCTS_SQL = """
+    SELECT p.name, s.sales
+    FROM (
+        SELECT product_id, SUM(quantity)::bigint AS sales
+        FROM product_sales_daily
+        WHERE day >= $1
+        GROUP BY product_id
+        ORDER BY sales DESC
+        LIMIT 5
+    ) s
+    JOIN products p ON p.id = s.product_id
+    ORDER BY s.sales DESC
+"""
+
+ROLLUP_USER_GROWTH_SQL = """
+    WITH new_users AS (
+        SELECT date_trunc($1, first_at) AS bucket, COUNT(*) AS users
+        FROM user_first_orders
+        WHERE first_at >= $2 AND first_at < $3
+        GROUP BY 1
+    )
+    SELECT b.bucket,
+           (SELECT COUNT(*) FROM user_first_orders WHERE first_at < $2)
+           + SUM(COALESCE(n.users, 0)) OVER (ORDER BY b.bucket) AS users
+    FROM generate_series($2::timestamp, $3::timestamp - ($4::text)::interval, ($4::text)::interval) AS b(bucket)
+    LEFT JOIN new_users n USING (bucket)
+    ORDER BY b.bucket
+"""
+
+def truncate(ts: datetime, granularity: str) -> datetime:
+    """Truncate a timestamp the same way Postgres date_trunc does"""
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+def bucket_bounds(days: int, granularity: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Return the [start, end) window covering the last `days` of complete buckets"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    if days < 1:
+        raise ValueError("days must be at least 1")
+    end = truncate(now or datetime.now(), granularity)
+    start = truncate(end - timedelta(days=days), granularity)
+    if granularity == "hour" and days * 24 > MAX_BUCKETS:
+        raise ValueError(f"Range too large for hourly buckets (max {MAX_BUCKETS} points)")
+    return start, end
+
+# Column types of each series, for typed (columnar and Arrow) payloads
+SERIES_COLUMNS = {
+    "revenue_trend": [{"name": "date", "type": "timestamp"}, {"name": "revenue", "type": "float8"}],
+    "orders_by_status": [{"name": "name", "type": "text"}, {"name": "value", "type": "int8"}],
+    "top_products": [{"name": "name", "type": "text"}, {"name": "sales", "type": "int8"}],
+    "user_growth": [{"name": "date", "type": "timestamp"}, {"name": "users", "type": "int8"}],
+}
+
+async def build_chart_frames(pool, days: int = 30, granularity: str = "day") -> Dict[str, Frame]:
+    """Fetch all dashboard chart series as typed frames, with one set-based query each.
+
+    The queries run one after another so a request holds at most one pool
+    connection; running them concurrently would take four on a cold cache
+    and let a handful of dashboard loads drain the pool.
+    """
+    start, end = bucket_bounds(days, granularity)
+    step = GRANULARITIES[granularity]
+
+    if order_rollups.ready:
+        daily = granularity != "hour"
+        queries = [
+            (ROLLUP_REVENUE_TREND_SQL if daily else REVENUE_TREND_SQL, granularity, start, end, step),
+            (ROLLUP_ORDERS_BY_STATUS_SQL if daily else ORDERS_BY_STATUS_SQL, start),
+            (ROLLUP_TOP_PRODUCTS_SQL if daily else TOP_PRODUCTS_SQL, start),
+            (ROLLUP_USER_GROWTH_SQL, granularity, start, end, step),
+        ]
+    else:
+        queries = [
+            (REVENUE_TREND_SQL, granularity, start, end, step),
+            (ORDERS_BY_STATUS_SQL, start),
+            (TOP_PRODUCTS_SQL, start),
+            (USER_GROWTH_SQL, granularity, start, end, step),
+        ]
+    revenue_rows, status_rows, product_rows, growth_rows = [
+        await cached_fetch(pool, *query, watermark=order_rollups.watermark) for query in queries
+    ]
+
+    rows = {
+        "revenue_trend": [(row['bucket'], float(row['revenue'])) for row in revenue_rows],
+        "orders_by_status": [(row['status'].title(), row['count']) for row in status_rows],
+        "top_products": [(row['name'], row['sales']) for row in product_rows],
+        "user_growth": [(row['bucket'], int(row['users'])) for row in growth_rows],
+    }
+    return {name: Frame(SERIES_COLUMNS[name], rows[name]) for name in SERIES_COLUMNS}
+
+async def build_chart_data(pool, days: int = 30, granularity: str = "day") -> Dict[str, List[Dict[str, Any]]]:
+    """Dashboard chart series in the row-oriented shape, with dates as display labels"""
+    frames = await build_chart_frames(pool, days, granularity)
+    label = LABEL_FORMATS[granularity]
+
+    return {
+        "revenue_trend": [
+            {"date": bucket.strftime(label), "revenue": revenue}
+            for bucket, revenue in frames["revenue_trend"].rows
+        ],
+        "orders_by_status": [
+            {"name": name, "value": count}
+            for name, count in frames["orders_by_status"].rows
+        ],
+        "top_products": [
+            {"name": name[:15] + "..." if len(name) > 15 else name, "sales": sales}
+            for name, sales in frames["top_products"].rows
+        ],
+        "user_growth": [
+            {"date": bucket.strftime(label), "users": users}
+            for bucket, users in frames["user_growth"].rows
+        ],
+    }
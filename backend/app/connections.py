@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import asyncpg
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+DATASET_POOL_MAX_SIZE = int(os.getenv("DATASET_POOL_MAX_SIZE", "5"))
+DATASET_CONNECTION_BUDGET = int(os.getenv("DATASET_CONNECTION_BUDGET", "50"))
+DATASET_POOL_IDLE_SECONDS = float(os.getenv("DATASET_POOL_IDLE_SECONDS", "300"))
+DATASET_CONNECT_TIMEOUT = float(os.getenv("DATASET_CONNECT_TIMEOUT", "10"))
+
+# How long an evicted pool may wait for checked-out connections before being terminated
+POOL_CLOSE_TIMEOUT = 60
+
+class DatasetConnectionError(Exception):
+    """Raised when a dataset pool cannot be opened"""
+
+class _PoolEntry:
+    def __init__(self, pool: asyncpg.Pool, fingerprint: Tuple, max_size: int):
+        self.pool = pool
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.last_used = time.monotonic()
+
+def _fingerprint(dataset: Dict[str, Any]) -> Tuple:
+    """Connection settings that, when changed, require a new pool"""
+    return (dataset['host'], dataset['port'], dataset['database_name'],
+            dataset['username'], dataset['password_encrypted'])
+
+class DatasetPoolRegistry:
+    """Lazily opened asyncpg pools, one per dataset, kept under a global connection budget"""
+
+    def __init__(self, pool_max_size: int = DATASET_POOL_MAX_SIZE,
+                 connection_budget: int = DATASET_CONNECTION_BUDGET,
+                 idle_seconds: float = DATASET_POOL_IDLE_SECONDS):
+        self.pool_max_size = min(pool_max_size, connection_budget)
+        self.connection_budget = connection_budget
+        self.idle_seconds = idle_seconds
+        # Ordered least recently used first
+        self._entries: "OrderedDict[Any, _PoolEntry]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+        self._opening: Dict[Any, asyncio.Lock] = {}
+        self._closing = set()
+
+    async def get_pool(self, dataset: Dict[str, Any]) -> asyncpg.Pool:
+        """Return the pool for a dataset, opening it on first use"""
+        key = dataset['id']
+        fingerprint = _fingerprint(dataset)
+        entry = self._entries.get(key)
+        if entry and entry.fingerprint == fingerprint:
+            self._touch(key, entry)
+            return entry.pool
+
+        # Per-dataset lock so a slow warehouse doesn't hold up opening pools for others
+        opening = self._opening.setdefault(key, asyncio.Lock())
+        stale = []
+        try:
+            async with opening:
+                entry = self._entries.get(key)
+                if entry and entry.fingerprint == fingerprint:
+                    self._touch(key, entry)
+                    return entry.pool
+                if dataset['type'] != 'postgresql':
+                    raise DatasetConnectionError(f"Unsupported dataset type: {dataset['type']}")
+                try:
+                    pool = await asyncpg.create_pool(
+                        host=dataset['host'], port=dataset['port'],
+                        database=dataset['database_name'], user=dataset['username'],
+                        password=dataset['password_encrypted'],
+                        min_size=1, max_size=self.pool_max_size,
+                        timeout=DATASET_CONNECT_TIMEOUT,
+                    )
+                except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+                    raise DatasetConnectionError(str(e) or type(e).__name__)
+                entry = _PoolEntry(pool, fingerprint, self.pool_max_size)
+                async with self._lock:
+                    # Replaces a pool opened with outdated credentials, if any
+                    if key in self._entries:
+                        stale.append(self._entries.pop(key))
+                    stale.extend(self._make_room(entry.max_size))
+                    self._entries[key] = entry
+                return pool
+        finally:
+            # Evicted pools drain in the background so this request isn't held up
+            self._close_later(stale)
+
+    async def health_check(self, dataset: Dict[str, Any]) -> Dict[str, Any]:
+        """Probe a dataset with a round trip through its pool and report latency"""
+        started = time.perf_counter()
+        try:
+            pool = await self.get_pool(dataset)
+            async with pool.acquire(timeout=DATASET_CONNECT_TIMEOUT) as conn:
+                probe_started = time.perf_counter()
+                probe = await conn.fetchrow("""
+                    SELECT current_setting('server_version') AS server_version,
+                           (SELECT COUNT(*) FROM information_schema.tables
+                            WHERE table_schema NOT IN ('pg_catalog', 'information_schema')) AS tables_count
+                """)
+                probe_ms = (time.perf_counter() - probe_started) * 1000
+        except (DatasetConnectionError, OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            await self.discard(dataset['id'])
+            return {
+                "status": "error",
+                "message": f"Connection failed: {e}",
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+        return {
+            "status": "connected",
+            "message": "Connection successful",
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+            "query_latency_ms": round(probe_ms, 2),
+            "server_version": probe['server_version'],
+            "tables_count": probe['tables_count'],
+        }
+
+    async def discard(self, dataset_id: Any):
+        """Close and forget the pool for a dataset, e.g. after it is deleted"""
+        async with self._lock:
+            entry = self._entries.pop(dataset_id, None)
+            self._opening.pop(dataset_id, None)
+        if entry:
+            await self._close_all([entry])
+
+    async def evict_idle(self):
+        """Close pools that have not been used within the idle window"""
+        cutoff = time.monotonic() - self.idle_seconds
+        async with self._lock:
+            idle_keys = [k for k, e in self._entries.items() if e.last_used < cutoff]
+            idle = [self._entries.pop(k) for k in idle_keys]
+        await self._close_all(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current pool usage across datasets"""
+        return {
+            "pools": len(self._entries),
+            "reserved_connections": sum(e.max_size for e in self._entries.values()),
+            "open_connections": sum(e.pool.get_size() for e in self._entries.values()),
+            "idle_connections": sum(e.pool.get_idle_size() for e in self._entries.values()),
+            "connection_budget": self.connection_budget,
+        }
+
+    def start(self):
+        """Start the background idle-pool reaper"""
+        if self._reaper is None:
+            self._reaper = asyncio.ensure_future(self._reap_forever())
+
+    async def close(self):
+        """Stop the reaper and close every pool"""
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        await self._close_all(entries)
+
+    def _touch(self, key: Any, entry: _PoolEntry):
+        entry.last_used = time.monotonic()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def _make_room(self, needed: int):
+        """Pop least recently used pools until `needed` connections fit in the budget"""
+        evicted = []
+        reserved = sum(e.max_size for e in self._entries.values())
+        while self._entries and reserved + needed > self.connection_budget:
+            _, entry = self._entries.popitem(last=False)
+            reserved -= entry.max_size
+            evicted.append(entry)
+        return evicted
+
+    def _close_later(self, entries):
+        if not entries:
+            return
+        task = asyncio.ensure_future(self._close_all(entries))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_all(self, entries):
+        for entry in entries:
+            try:
+                # Waits for checked-out connections to be released
+                await asyncio.wait_for(entry.pool.close(), timeout=POOL_CLOSE_TIMEOUT)
+            except (asyncio.TimeoutError, OSError, asyncpg.PostgresError):
+                entry.pool.terminate()
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 2, 1))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Dataset pool eviction failed: {e}")
+
+# Global dataset pool registry
+dataset_pools = DatasetPoolRegistry()
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import asyncpg
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from pydantic import BaseModel
+
+from .database import DATABASE_URL
+from .migrations import METRIC_DB_ROLE
+from .connections import dataset_pools, DatasetConnectionError
+from .instrumentation import instrumentation, InstrumentedPool
+from .workloads import AdmissionController
+
+METRIC_STATEMENT_TIMEOUT_MS = int(os.getenv("METRIC_STATEMENT_TIMEOUT_MS", "30000"))
+METRIC_ROW_LIMIT = int(os.getenv("METRIC_ROW_LIMIT", "10000"))
+METRIC_MAX_CONCURRENCY = int(os.getenv("METRIC_MAX_CONCURRENCY", "4"))
+
+class MetricExecutionError(Exception):
+    """Raised when a metric query cannot be executed"""
+
+class MetricRunResult(BaseModel):
+    type: str  # scalar, table
+    value: Optional[Any] = None
+    columns: List[Dict[str, str]] = []
+    rows: List[List[Any]] = []
+    row_count: int
+    truncated: bool = False
+    execution_time_ms: int
+
+def to_json_value(value: Any) -> Any:
+    """Convert a Postgres value into something JSON can carry"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    return value
+
+class MetricExecutor:
+    """Runs metric SQL on pools that are separate from the API's DatabaseManager.pool"""
+
+    def __init__(self, max_concurrency: int = METRIC_MAX_CONCURRENCY,
+                 statement_timeout_ms: int = METRIC_STATEMENT_TIMEOUT_MS,
+                 row_limit: int = METRIC_ROW_LIMIT, pool_name: str = "metrics"):
+        self.pool_name = pool_name
+        self.max_concurrency = max_concurrency
+        self.statement_timeout_ms = statement_timeout_ms
+        self.row_limit = row_limit
+        # Concurrency limit per workload class, shared by the built-in database and dataset pools
+        self.admission = AdmissionController(max_concurrency, pool_name)
+        instrumentation.register_admission(pool_name, self.admission)
+        self._default_pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self, dataset: Optional[Dict[str, Any]]) -> asyncpg.Pool:
+        """Get the pool for a dataset (None means the built-in database)"""
+        if dataset is not None:
+            return await dataset_pools.get_pool(dataset)
+        if self._default_pool is None:
+            async with self._pool_lock:
+                if self._default_pool is None:
+                    self._default_pool = InstrumentedPool(await asyncpg.create_pool(
+                        DATABASE_URL, min_size=0, max_size=self.max_concurrency
+                    ), self.pool_name)
+        return self._default_pool
+
+    async def _begin(self, conn, dataset: Optional[Dict[str, Any]], timeout_ms: int):
+        """Set up a read-only transaction: the statement timeout, and on the built-in database the metric role.
+
+        The role can only read the analytics tables, so metric, chat and
+        export SQL can't reach the app's own tables such as datasets.
+        """
+        if dataset is None:
+            try:
+                await conn.execute('SET LOCAL ROLE "{}"'.format(METRIC_DB_ROLE.replace('"', '""')))
+            except asyncpg.PostgresError as e:
+                raise MetricExecutionError(
+                    f"SQL on the built-in database runs as role {METRIC_DB_ROLE}, which can't be assumed: {e}"
+                )
+        await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+    async def _connect(self, dataset: Optional[Dict[str, Any]]) -> asyncpg.Pool:
+        try:
+            return await self._get_pool(dataset)
+        except (DatasetConnectionError, OSError, asyncpg.PostgresError) as e:
+            raise MetricExecutionError(f"Could not connect to dataset: {e}")
+
+    async def execute(self, sql: str, dataset: Optional[Dict[str, Any]] = None,
+                      row_limit: Optional[int] = None, timeout_ms: Optional[int] = None) -> MetricRunResult:
+        """Execute metric SQL read-only with a statement timeout and row cap (executor defaults unless given)"""
+        row_limit = row_limit or self.row_limit
+        timeout_ms = timeout_ms or self.statement_timeout_ms
+        async with self.admission.admit():
+            pool = await self._connect(dataset)
+            pool_label = self.pool_name if dataset is None else "datasets"
+            async with pool.acquire() as conn:
+                started = time.perf_counter()
+                try:
+                    async with conn.transaction(readonly=True):
+                        await self._begin(conn, dataset, timeout_ms)
+                        started = time.perf_counter()
+                        stmt = await conn.prepare(sql)
+                        cursor = await stmt.cursor()
+                        # Fetch one extra row to know whether the cap truncated the result
+                        rows = await cursor.fetch(row_limit + 1)
+                        elapsed = time.perf_counter() - started
+                        columns = [{"name": a.name, "type": a.type.name} for a in stmt.get_attributes()]
+                except asyncpg.QueryCanceledError:
+                    instrumentation.observe_query(pool_label, sql, time.perf_counter() - started, failed=True)
+                    raise MetricExecutionError(
+                        f"Query exceeded statement timeout of {timeout_ms} ms"
+                    )
+                except asyncpg.PostgresError as e:
+                    instrumentation.observe_query(pool_label, sql, time.perf_counter() - started, failed=True)
+                    raise MetricExecutionError(str(e))
+            instrumentation.observe_query(pool_label, sql, elapsed)
+            elapsed_ms = int(elapsed * 1000)
+
+        truncated = len(rows) > row_limit
+        rows = rows[:row_limit]
+
+        if len(columns) == 1 and len(rows) == 1:
+            return MetricRunResult(
+                type="scalar",
+                value=to_json_value(rows[0][0]),
+                columns=columns,
+                row_count=1,
+                execution_time_ms=elapsed_ms,
+            )
+        return MetricRunResult(
+            type="table",
+            columns=columns,
+            rows=[[to_json_value(v) for v in row] for row in rows],
+            row_count=len(rows),
+            truncated=truncated,
+            execution_time_ms=elapsed_ms,
+        )
+
+    async def stream(self, sql: str, dataset: Optional[Dict[str, Any]] = None,
+                     batch_size: int = 500, max_rows: Optional[int] = None,
+                     timeout_ms: Optional[int] = None
+                     ) -> AsyncIterator[Tuple[List[Dict[str, str]], List[asyncpg.Record]]]:
+        """Execute SQL read-only and yield (columns, rows) batches from a server-side cursor.
+
+        The first batch is yielded as soon as the cursor produces it, so the
+        caller can start responding before the query finishes; a query with
+        no rows yields one empty batch. The connection and concurrency slot
+        are held until the iterator is exhausted or closed. Raw records are
+        yielded; use to_json_value to serialize them.
+        """
+        timeout_ms = timeout_ms or self.statement_timeout_ms
+        async with self.admission.admit():
+            pool = await self._connect(dataset)
+            pool_label = self.pool_name if dataset is None else "datasets"
+            async with pool.acquire() as conn:
+                started = None
+                try:
+                    async with conn.transaction(readonly=True):
+                        # The timeout applies to each FETCH, so a slow consumer doesn't trip it
+                        await self._begin(conn, dataset, timeout_ms)
+                        started = time.perf_counter()
+                        stmt = await conn.prepare(sql)
+                        columns = [{"name": a.name, "type": a.type.name} for a in stmt.get_attributes()]
+                        cursor = await stmt.cursor()
+                        fetched = 0
+                        while True:
+                            wanted = batch_size if max_rows is None else min(batch_size, max_rows - fetched)
+                            rows = await cursor.fetch(wanted) if wanted > 0 else []
+                            fetched += len(rows)
+                            if started is not None:
+                                # Time to first batch; the rest depends on how fast the consumer reads
+                                instrumentation.observe_query(pool_label, sql, time.perf_counter() - started)
+                                started = None
+                            if rows or fetched == 0:
+                                yield columns, rows
+                            if len(rows) < wanted or wanted == 0:
+                                break
+                except asyncpg.QueryCanceledError:
+                    instrumentation.query_errors.inc(pool_label, instrumentation.query_key(sql))
+                    raise MetricExecutionError(f"Query exceeded statement timeout of {timeout_ms} ms")
+                except asyncpg.PostgresError as e:
+                    instrumentation.query_errors.inc(pool_label, instrumentation.query_key(sql))
+                    raise MetricExecutionError(str(e))
+
+    async def explain(self, sql: str, dataset: Optional[Dict[str, Any]] = None,
+                      timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+        """Run SQL again under EXPLAIN (ANALYZE, BUFFERS) and return the JSON plan.
+
+        Read-only with the same statement timeout as a run, so this costs
+        about as much as executing the query once more.
+        """
+        timeout_ms = timeout_ms or self.statement_timeout_ms
+        async with self.admission.admit():
+            pool = await self._connect(dataset)
+            async with pool.acquire() as conn:
+                try:
+                    async with conn.transaction(readonly=True):
+                        await self._begin(conn, dataset, timeout_ms)
+                        plan = await conn.fetchval(
+                            "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql.strip().rstrip(";")
+                        )
+                except asyncpg.QueryCanceledError:
+                    raise MetricExecutionError(f"EXPLAIN exceeded statement timeout of {timeout_ms} ms")
+                except asyncpg.PostgresError as e:
+                    raise MetricExecutionError(str(e))
+        # json columns arrive as text on pools without the API's codecs
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
+
+    async def close(self):
+        """Close the built-in database pool; dataset pools belong to the registry"""
+        if self._default_pool:
+            await self._default_pool.close()
+            self._default_pool = None
+
+# Global metric executor instance
+metric_executor = MetricExecutor()
@@ -0,0 +1,171 @@
+import io
+import os
+import csv
+import json
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple, Callable
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .executor import MetricExecutor, to_json_value
+from .serialization import dumps
+
+# Exports run on their own executor so long extracts don't take metric run slots
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "2"))
+# Applies to each cursor fetch, not the whole export
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "300000"))
+# Rows held in memory at a time; each Parquet row group is one batch
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+Batches = AsyncIterator[Tuple[List[Dict[str, str]], List[Any]]]
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(to_json_value(value))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return value
+
+async def _csv_chunks(batches: Batches) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = False
+    async for columns, rows in batches:
+        if not header:
+            writer.writerow([c["name"] for c in columns])
+            header = True
+        writer.writerows([_csv_value(v) for v in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+async def _ndjson_chunks(batches: Batches) -> AsyncIterator[bytes]:
+    async for columns, rows in batches:
+        names = [c["name"] for c in columns]
+        if rows:
+            yield b"".join(dumps(dict(zip(names, row))) + b"\n" for row in rows)
+
+def _to_text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(to_json_value(value))
+    return str(to_json_value(value))
+
+def _to_date(value: Any) -> date:
+    # Values already serialized for JSON come back as ISO 8601 strings
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def _to_datetime(value: Any) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _arrow_type(pg_type: str) -> Tuple[Any, Callable[[Any], Any]]:
+    """Arrow type for a Postgres type, with the conversion its values need"""
+    same = lambda v: v
+    types = {
+        "bool": (pa.bool_(), same),
+        "int2": (pa.int16(), same),
+        "int4": (pa.int32(), same),
+        "int8": (pa.int64(), same),
+        "float4": (pa.float32(), same),
+        "float8": (pa.float64(), same),
+        # Arbitrary-precision numerics don't fit a fixed decimal type; same as the JSON payloads
+        "numeric": (pa.float64(), float),
+        "date": (pa.date32(), _to_date),
+        "timestamp": (pa.timestamp("us"), _to_datetime),
+        "timestamptz": (pa.timestamp("us", tz="UTC"), _to_datetime),
+        "interval": (pa.duration("us"), same),
+        "bytea": (pa.binary(), bytes),
+    }
+    return types.get(pg_type, (pa.string(), _to_text))
+
+def arrow_schema(columns: List[Dict[str, str]]) -> Tuple[Any, List[Callable[[Any], Any]]]:
+    """Arrow schema for executor columns, plus one value converter per column"""
+    fields, converters = [], []
+    for column in columns:
+        arrow_type, convert = _arrow_type(column["type"])
+        fields.append(pa.field(column["name"], arrow_type))
+        converters.append(convert)
+    return pa.schema(fields), converters
+
+def arrow_batch(schema: Any, converters: List[Callable[[Any], Any]], rows: List[Any]) -> Any:
+    """Rows as an Arrow record batch, built column by column"""
+    arrays = [
+        pa.array([None if row[i] is None else convert(row[i]) for row in rows], type=field.type)
+        for i, (field, convert) in enumerate(zip(schema, converters))
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class _Sink(io.RawIOBase):
+    """Write target that hands over whatever has been written since the last drain"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def _parquet_chunks(batches: Batches) -> AsyncIterator[bytes]:
+    sink = _Sink()
+    writer = None
+    async for columns, rows in batches:
+        if writer is None:
+            schema, converters = arrow_schema(columns)
+            writer = pq.ParquetWriter(sink, schema)
+        if rows:
+            writer.write_batch(arrow_batch(schema, converters, rows))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+async def encode(format: str, batches: Batches) -> AsyncIterator[bytes]:
+    """Serialize cursor batches in an export format, one chunk per batch"""
+    encoders = {"csv": _csv_chunks, "ndjson": _ndjson_chunks, "parquet": _parquet_chunks}
+    async for chunk in encoders[format](batches):
+        if chunk:
+            yield chunk
+
+async def open_export(sql: str, dataset: Optional[Dict[str, Any]], format: str) -> AsyncIterator[bytes]:
+    """Start an export and return its byte stream.
+
+    The first batch is fetched before returning, so bad SQL or an
+    unreachable dataset raise MetricExecutionError here, before any
+    response has been sent, rather than cutting off a started download.
+    """
+    batches = export_executor.stream(sql, dataset, batch_size=EXPORT_BATCH_ROWS)
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def replay() -> Batches:
+        if first is not None:
+            yield first
+            async for batch in batches:
+                yield batch
+
+    return encode(format, replay())
+
+# Global export executor
+export_executor = MetricExecutor(
+    max_concurrency=EXPORT_MAX_CONCURRENCY,
+    statement_timeout_ms=EXPORT_STATEMENT_TIMEOUT_MS,
+    pool_name="exports",
+)
@@ -0,0 +1,228 @@
+import os
+import math
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+from .workloads import current_workload
+
+# Raw points live in monthly partitions that are dropped whole once past retention
+METRIC_RAW_RETENTION_DAYS = int(os.getenv("METRIC_RAW_RETENTION_DAYS", "35"))
+METRIC_HOURLY_RETENTION_DAYS = int(os.getenv("METRIC_HOURLY_RETENTION_DAYS", "400"))
+# 0 keeps daily rollups forever
+METRIC_DAILY_RETENTION_DAYS = int(os.getenv("METRIC_DAILY_RETENTION_DAYS", "0"))
+HISTORY_MAINTENANCE_SECONDS = float(os.getenv("HISTORY_MAINTENANCE_SECONDS", "3600"))
+
+DEFAULT_POINT_BUDGET = 500
+
+# Rollup resolutions, finest first
+RESOLUTIONS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Folds a batch of points into one resolution; a batch holds at most one point per metric
+RECORD_ROLLUP_SQL = """
+    INSERT INTO metric_rollups AS r
+        (metric_id, resolution, bucket, min_value, max_value, sum_value, count, last_value, last_ts)
+    SELECT p.metric_id, $2::text, date_trunc($2::text, p.ts), p.value, p.value, p.value, 1, p.value, p.ts
+    FROM unnest($1::uuid[], $3::timestamp[], $4::float8[]) AS p(metric_id, ts, value)
+    ON CONFLICT (metric_id, resolution, bucket) DO UPDATE SET
+        min_value = LEAST(r.min_value, EXCLUDED.min_value),
+        max_value = GREATEST(r.max_value, EXCLUDED.max_value),
+        sum_value = r.sum_value + EXCLUDED.sum_value,
+        count = r.count + 1,
+        last_value = CASE WHEN EXCLUDED.last_ts >= r.last_ts THEN EXCLUDED.last_value ELSE r.last_value END,
+        last_ts = GREATEST(r.last_ts, EXCLUDED.last_ts)
+"""
+
+RAW_HISTORY_SQL = """
+    SELECT date_bin($2::interval, ts, TIMESTAMP '2000-01-01') AS bucket,
+           MIN(value) AS min, MAX(value) AS max, AVG(value) AS avg,
+           (array_agg(value ORDER BY ts DESC))[1] AS last, COUNT(*) AS count
+    FROM metric_points
+    WHERE metric_id = $1 AND ts >= $3 AND ts < $4
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+ROLLUP_HISTORY_SQL = """
+    SELECT date_bin($2::interval, bucket, TIMESTAMP '2000-01-01') AS bucket,
+           MIN(min_value) AS min, MAX(max_value) AS max, SUM(sum_value) / SUM(count) AS avg,
+           (array_agg(last_value ORDER BY last_ts DESC))[1] AS last, SUM(count) AS count
+    FROM metric_rollups
+    WHERE metric_id = $1 AND resolution = $5 AND bucket >= $3 AND bucket < $4
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+def _month_start(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _next_month(ts: datetime) -> datetime:
+    return (_month_start(ts) + timedelta(days=32)).replace(day=1)
+
+def _partition_name(month: datetime) -> str:
+    return f"metric_points_y{month.year}m{month.month:02d}"
+
+def choose_resolution(start: datetime, end: datetime, points: int,
+                      now: Optional[datetime] = None) -> Tuple[str, timedelta]:
+    """Pick the coarsest-needed source and bucket width for a range and point budget"""
+    now = now or datetime.utcnow()
+    span = end - start
+    # Bucket width that keeps the response within the point budget, at least one second
+    width = max(span / max(points, 1), timedelta(seconds=1))
+    raw_available = start >= now - timedelta(days=METRIC_RAW_RETENTION_DAYS)
+    if width < RESOLUTIONS["hour"] and raw_available:
+        return "raw", timedelta(seconds=math.ceil(width.total_seconds()))
+    hourly_available = start >= now - timedelta(days=METRIC_HOURLY_RETENTION_DAYS)
+    if width < RESOLUTIONS["day"] and hourly_available:
+        return "hour", timedelta(hours=math.ceil(width / RESOLUTIONS["hour"]))
+    return "day", timedelta(days=math.ceil(width / RESOLUTIONS["day"]))
+
+class MetricHistory:
+    """Numeric metric history with partitioned raw points and hourly/daily rollups"""
+
+    def __init__(self):
+        self._partitions: Set[datetime] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_partitions(self, conn, now: Optional[datetime] = None):
+        """Create monthly partitions covering the retention window and the next month"""
+        now = now or datetime.utcnow()
+        month = _month_start(now - timedelta(days=METRIC_RAW_RETENTION_DAYS))
+        last = _next_month(now)
+        while month <= last:
+            await self._ensure_partition(conn, month)
+            month = _next_month(month)
+
+    async def _ensure_partition(self, conn, month: datetime):
+        if month in self._partitions:
+            return
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {_partition_name(month)}
+            PARTITION OF metric_points
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+        """)
+        self._partitions.add(month)
+
+    async def record(self, conn, metric_id, ts: datetime, value: float):
+        """Store a raw point and fold it into every rollup"""
+        await self.record_many(conn, [(metric_id, ts, value)])
+
+    async def record_many(self, conn, points: List[Tuple[Any, datetime, float]]):
+        """Store points for distinct metrics with one statement per table"""
+        if not points:
+            return
+        for month in {_month_start(ts) for _, ts, _ in points}:
+            await self._ensure_partition(conn, month)
+        metric_ids, timestamps, values = (list(column) for column in zip(*points))
+        await conn.execute("""
+            INSERT INTO metric_points (metric_id, ts, value)
+            SELECT * FROM unnest($1::uuid[], $2::timestamp[], $3::float8[])
+        """, metric_ids, timestamps, values)
+        for resolution in RESOLUTIONS:
+            await conn.execute(RECORD_ROLLUP_SQL, metric_ids, resolution, timestamps, values)
+
+    async def query(self, conn, metric_id, start: datetime, end: datetime,
+                    points: int = DEFAULT_POINT_BUDGET) -> Dict[str, Any]:
+        """Read history for a range, downsampled to at most `points` buckets"""
+        resolution, width = choose_resolution(start, end, points)
+        if resolution == "raw":
+            rows = await conn.fetch(RAW_HISTORY_SQL, metric_id, width, start, end)
+        else:
+            rows = await conn.fetch(ROLLUP_HISTORY_SQL, metric_id, width, start, end, resolution)
+        return {
+            "metric_id": str(metric_id),
+            "resolution": resolution,
+            "bucket_seconds": int(width.total_seconds()),
+            "start": start,
+            "end": end,
+            "points": [
+                {
+                    "ts": row['bucket'],
+                    "min": row['min'],
+                    "max": row['max'],
+                    "avg": row['avg'],
+                    "last": row['last'],
+                    "count": row['count'],
+                }
+                for row in rows
+            ],
+        }
+
+    async def apply_retention(self, conn, now: Optional[datetime] = None) -> List[str]:
+        """Drop expired raw partitions and delete expired rollups"""
+        now = now or datetime.utcnow()
+        raw_cutoff = now - timedelta(days=METRIC_RAW_RETENTION_DAYS)
+        partitions = await conn.fetch("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'metric_points'::regclass
+        """)
+        dropped = []
+        for row in partitions:
+            name = row['relname']
+            try:
+                month = datetime(int(name[-7:-3]), int(name[-2:]), 1)
+            except ValueError:
+                continue
+            # A partition expires once its newest possible point is past the cutoff
+            if _next_month(month) <= raw_cutoff:
+                await conn.execute(f"DROP TABLE IF EXISTS {name}")
+                self._partitions.discard(month)
+                dropped.append(name)
+
+        await conn.execute(
+            "DELETE FROM metric_rollups WHERE resolution = 'hour' AND bucket < $1",
+            now - timedelta(days=METRIC_HOURLY_RETENTION_DAYS)
+        )
+        if METRIC_DAILY_RETENTION_DAYS:
+            await conn.execute(
+                "DELETE FROM metric_rollups WHERE resolution = 'day' AND bucket < $1",
+                now - timedelta(days=METRIC_DAILY_RETENTION_DAYS)
+            )
+        return dropped
+
+    async def maintain(self, pool):
+        """One maintenance pass: upcoming partitions plus retention"""
+        async with pool.acquire() as conn:
+            await self.ensure_partitions(conn)
+            await self.apply_retention(conn)
+
+    def start(self, pool):
+        """Run maintenance in the background"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._maintain_forever(pool))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            # Wait for the cancelled pass to release its connection before the pool closes
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _maintain_forever(self, pool):
+        current_workload.set("batch")
+        while True:
+            try:
+                await self.maintain(pool)
+            except Exception as e:
+                print(f"Metric history maintenance failed: {e}")
+            await asyncio.sleep(HISTORY_MAINTENANCE_SECONDS)
+
+# Global metric history store
+metric_history = MetricHistory()
+
+def numeric_value(result: Dict[str, Any]) -> Optional[float]:
+    """The numeric value of a scalar metric result, if it has one"""
+    value = result.get("value")
+    if result.get("type") != "scalar" or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
@@ -0,0 +1,430 @@
+"""Index advisor for the built-in database.
+
+Collects the SQL the app runs there: active metrics without a dataset, the
+dashboard KPI and chart queries, and the chat intents, each in its raw and
+rollup form. Every query is EXPLAINed. A column becomes a candidate when a
+sequential scan filters or joins on it and no valid index leads with it.
+
+Each candidate is then built inside a transaction that is rolled back, and
+the affected queries are EXPLAINed again to read the planner's estimate
+with the index in place. Candidates that make at least one query
+INDEX_ADVISOR_MIN_SPEEDUP times cheaper are recommended, ranked by the
+time they are estimated to save at the queries' observed runtimes.
+
+With --apply, recommendations are created with CREATE INDEX CONCURRENTLY,
+which can't run inside a transaction and so can't be a migration. The
+affected queries are timed with EXPLAIN ANALYZE before and after each
+index, so measured speedups are reported next to the estimates.
+
+Usage (from the backend directory):
+
+    python -m app.index_advisor                 # recommend, with planner estimates
+    python -m app.index_advisor --apply         # also create them and measure
+    python -m app.index_advisor --no-estimate   # skip trial builds, candidates only
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Set, Callable
+
+import asyncpg
+
+from .kpis import DASHBOARD_KPIS_SQL, ROLLUP_DASHBOARD_KPIS_SQL
+from .charts import (
+    REVENUE_TREND_SQL, ORDERS_BY_STATUS_SQL, TOP_PRODUCTS_SQL, USER_GROWTH_SQL,
+    ROLLUP_REVENUE_TREND_SQL, ROLLUP_ORDERS_BY_STATUS_SQL, ROLLUP_TOP_PRODUCTS_SQL, ROLLUP_USER_GROWTH_SQL,
+    GRANULARITIES, bucket_bounds,
+)
+from .intents import CHAT_INTENTS, FALLBACK_INTENT
+from .executor import METRIC_STATEMENT_TIMEOUT_MS
+from .sql_utils import normalize_sql
+
+# Recommend an index only if the planner expects at least one affected query to get this much faster
+INDEX_ADVISOR_MIN_SPEEDUP = float(os.getenv("INDEX_ADVISOR_MIN_SPEEDUP", "1.2"))
+# Trial builds block writes to the table while they run, so larger tables aren't estimated
+INDEX_ADVISOR_TRIAL_MAX_MB = int(os.getenv("INDEX_ADVISOR_TRIAL_MAX_MB", "512"))
+# EXPLAIN ANALYZE runs per query when measuring; the median is reported
+INDEX_ADVISOR_TIMING_RUNS = int(os.getenv("INDEX_ADVISOR_TIMING_RUNS", "3"))
+
+# Stored runs per metric used for its observed runtime
+OBSERVED_RUNS = 20
+
+METRIC_QUERIES_SQL = """
+    SELECT m.name, m.sql_query,
+           (SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY r.execution_time_ms)
+            FROM (SELECT execution_time_ms FROM metric_results r
+                  WHERE r.metric_id = m.id AND r.status = 'success' AND NOT r.cached
+                  ORDER BY r.created_at DESC LIMIT $1) r) AS observed_ms
+    FROM metrics m
+    WHERE m.status = 'active' AND m.dataset_id IS NULL
+    ORDER BY m.name
+"""
+
+LEADING_INDEX_COLUMNS_SQL = """
+    SELECT t.relname AS table_name, a.attname AS column_name
+    FROM pg_index i
+    JOIN pg_class t ON t.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+    WHERE n.nspname = current_schema() AND i.indisvalid
+"""
+
+TABLE_COLUMNS_SQL = """
+    SELECT c.relname AS table_name, a.attname AS column_name, pg_relation_size(c.oid) AS table_bytes
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+"""
+
+# Plan fields holding conditions, and which of them are join conditions
+CONDITION_FIELDS = ("Filter", "Hash Cond", "Merge Cond", "Join Filter")
+JOIN_FIELDS = ("Hash Cond", "Merge Cond", "Join Filter")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COLUMN_REF = re.compile(r'(?:\b([a-z_][a-z0-9_$]*)\.)?\b([a-z_][a-z0-9_$]*)\b', re.IGNORECASE)
+
+class AdvisedQuery:
+    """A query the advisor plans, with sample arguments and how long it usually takes"""
+
+    def __init__(self, label: str, sql: str, args: Tuple = (), observed_ms: Optional[float] = None):
+        self.label = label
+        self.sql = sql
+        self.args = args
+        self.observed_ms = observed_ms
+        self.cost: Optional[float] = None
+
+class Candidate:
+    """An unindexed column that sequential scans filter or join on"""
+
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self.reasons: Set[str] = set()
+        self.queries: List[AdvisedQuery] = []
+        # Query label -> planner cost with the index in place
+        self.estimated_costs: Dict[str, float] = {}
+
+    @property
+    def index_name(self) -> str:
+        return f"idx_{self.table}_{self.column}"[:63]
+
+    def create_sql(self, concurrently: bool = False) -> str:
+        return (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+                f"{_ident(self.index_name)} ON {_ident(self.table)} ({_ident(self.column)})")
+
+    def query_speedup(self, query: AdvisedQuery) -> float:
+        """Planner cost of a query without the index over with it"""
+        after = self.estimated_costs[query.label]
+        return query.cost / after if after else 1.0
+
+    @property
+    def estimated_speedup(self) -> Optional[float]:
+        """Speedup of the affected queries together, each weighted by its observed runtime.
+
+        Stored runtimes are whole milliseconds, so fast queries often have
+        none to weight by; then the planner costs are compared instead.
+        """
+        estimated = [q for q in self.queries if q.label in self.estimated_costs]
+        if not estimated:
+            return None
+        before = sum(q.observed_ms or 0 for q in estimated)
+        if before > 0:
+            after = sum((q.observed_ms or 0) / self.query_speedup(q) for q in estimated)
+        else:
+            before = sum(q.cost or 0 for q in estimated)
+            after = sum(self.estimated_costs[q.label] for q in estimated)
+        return before / after if after else None
+
+    @property
+    def estimated_saving_ms(self) -> Optional[float]:
+        """Runtime saved per execution of every affected query, at their observed runtimes"""
+        if not self.estimated_costs:
+            return None
+        return sum((q.observed_ms or 0) * (1 - 1 / self.query_speedup(q))
+                   for q in self.queries if q.label in self.estimated_costs)
+
+    @property
+    def recommended(self) -> bool:
+        """Whether the planner expects at least one affected query to get enough faster"""
+        return any(self.query_speedup(q) >= INDEX_ADVISOR_MIN_SPEEDUP
+                   for q in self.queries if q.label in self.estimated_costs)
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _times(speedup: Optional[float]) -> str:
+    return f"{speedup:.2f}x" if speedup is not None else "unknown"
+
+def _round(value: Optional[float], digits: int = 2) -> Optional[float]:
+    return round(value, digits) if value is not None else None
+
+def builtin_queries(now: Optional[datetime] = None) -> List[AdvisedQuery]:
+    """Dashboard KPI and chart queries and chat intents, raw and rollup forms, with the dashboard's default arguments"""
+    start, end = bucket_bounds(30, "day", now)
+    series = ("day", start, end, GRANULARITIES["day"])
+    queries = [
+        AdvisedQuery("dashboard:kpis", DASHBOARD_KPIS_SQL),
+        AdvisedQuery("dashboard:kpis (rollup)", ROLLUP_DASHBOARD_KPIS_SQL),
+        AdvisedQuery("chart:revenue_trend", REVENUE_TREND_SQL, series),
+        AdvisedQuery("chart:revenue_trend (rollup)", ROLLUP_REVENUE_TREND_SQL, series),
+        AdvisedQuery("chart:orders_by_status", ORDERS_BY_STATUS_SQL, (start,)),
+        AdvisedQuery("chart:orders_by_status (rollup)", ROLLUP_ORDERS_BY_STATUS_SQL, (start,)),
+        AdvisedQuery("chart:top_products", TOP_PRODUCTS_SQL, (start,)),
+        AdvisedQuery("chart:top_products (rollup)", ROLLUP_TOP_PRODUCTS_SQL, (start,)),
+        AdvisedQuery("chart:user_growth", USER_GROWTH_SQL, series),
+        AdvisedQuery("chart:user_growth (rollup)", ROLLUP_USER_GROWTH_SQL, series),
+    ]
+    for intent in CHAT_INTENTS + [FALLBACK_INTENT]:
+        if intent.sql:
+            queries.append(AdvisedQuery(f"chat:{intent.name}", intent.sql))
+        if intent.rollup_sql and intent.rollup_sql != intent.sql:
+            queries.append(AdvisedQuery(f"chat:{intent.name} (rollup)", intent.rollup_sql))
+    return queries
+
+async def metric_queries(conn) -> List[AdvisedQuery]:
+    """Active metrics on the built-in database, with the median runtime of their recent runs"""
+    rows = await conn.fetch(METRIC_QUERIES_SQL, OBSERVED_RUNS)
+    return [AdvisedQuery(f"metric:{row['name']}", row['sql_query'], (), row['observed_ms']) for row in rows]
+
+def _plan(value: Any) -> Dict[str, Any]:
+    # json columns arrive as text on connections without the API's codecs
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value[0]
+
+async def explain(conn, sql: str, args: Tuple = ()) -> Dict[str, Any]:
+    """The planner's plan, without running the query"""
+    return _plan(await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";"), *args))
+
+async def timed(conn, sql: str, args: Tuple = (), runs: int = INDEX_ADVISOR_TIMING_RUNS,
+                timeout_ms: int = METRIC_STATEMENT_TIMEOUT_MS) -> float:
+    """Median execution time in ms over `runs` EXPLAIN ANALYZE runs, read-only with a statement timeout"""
+    times = []
+    for _ in range(runs):
+        async with conn.transaction(readonly=True):
+            await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+            plan = _plan(await conn.fetchval("EXPLAIN (ANALYZE, FORMAT JSON) " + sql.strip().rstrip(";"), *args))
+        times.append(plan["Execution Time"])
+    return statistics.median(times)
+
+def _nodes(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _nodes(child)
+
+def _column_refs(condition: str) -> List[Tuple[Optional[str], str]]:
+    """(qualifier, name) of each identifier in a plan condition, ignoring string literals"""
+    return _COLUMN_REF.findall(_STRING_LITERAL.sub("''", condition))
+
+def scanned_columns(plan: Dict[str, Any], columns: Dict[str, Set[str]]) -> Set[Tuple[str, str, str]]:
+    """(table, column, "filter" or "join") for columns that sequential scans in the plan filter or join on"""
+    # Alias -> table, for the relations read by a sequential scan
+    seq_scanned: Dict[str, str] = {}
+    for node in _nodes(plan):
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in columns:
+            seq_scanned[node.get("Alias", node["Relation Name"])] = node["Relation Name"]
+
+    found = set()
+    for node in _nodes(plan):
+        for field in CONDITION_FIELDS:
+            condition = node.get(field)
+            if not condition:
+                continue
+            if field in JOIN_FIELDS:
+                reason, default_alias = "join", None
+            elif node.get("Node Type") == "Seq Scan":
+                reason, default_alias = "filter", node.get("Alias", node.get("Relation Name"))
+            else:
+                continue
+            for qualifier, name in _column_refs(condition):
+                table = seq_scanned.get(qualifier or default_alias)
+                if table and name in columns[table]:
+                    found.add((table, name, reason))
+    return found
+
+async def _trial_costs(conn, candidate: Candidate) -> Dict[str, float]:
+    """Planner costs of the candidate's queries with the index built, then rolled back"""
+    costs = {}
+
+    class Rollback(Exception):
+        pass
+
+    try:
+        async with conn.transaction():
+            # Don't queue behind writers; the build itself holds off writes until rollback
+            await conn.execute("SET LOCAL lock_timeout = '2s'")
+            await conn.execute(candidate.create_sql())
+            for query in candidate.queries:
+                costs[query.label] = (await explain(conn, query.sql, query.args))["Plan"]["Total Cost"]
+            raise Rollback()
+    except Rollback:
+        pass
+    return costs
+
+async def advise(conn, estimate: bool = True, log: Optional[Callable[[str], None]] = print) -> Dict[str, Any]:
+    """Find unindexed predicate columns and, with `estimate`, which indexes the planner would use"""
+    tables: Dict[str, Set[str]] = {}
+    table_bytes: Dict[str, int] = {}
+    for row in await conn.fetch(TABLE_COLUMNS_SQL):
+        tables.setdefault(row['table_name'], set()).add(row['column_name'])
+        table_bytes[row['table_name']] = row['table_bytes']
+    indexed = {(row['table_name'], row['column_name']) for row in await conn.fetch(LEADING_INDEX_COLUMNS_SQL)}
+
+    # Metrics sharing SQL (or matching a built-in query) are planned once
+    queries: Dict[str, AdvisedQuery] = {}
+    for query in builtin_queries() + await metric_queries(conn):
+        queries.setdefault(normalize_sql(query.sql), query)
+
+    candidates: Dict[Tuple[str, str], Candidate] = {}
+    skipped = []
+    for query in queries.values():
+        try:
+            plan = await explain(conn, query.sql, query.args)
+            if query.observed_ms is None:
+                query.observed_ms = await timed(conn, query.sql, query.args, runs=1)
+        except asyncpg.PostgresError as e:
+            # e.g. rollup tables or sample tables missing, or a broken metric
+            skipped.append({"query": query.label, "error": str(e)})
+            continue
+        query.cost = plan["Plan"]["Total Cost"]
+        for table, column, reason in scanned_columns(plan["Plan"], tables):
+            if (table, column) in indexed:
+                continue
+            candidate = candidates.setdefault((table, column), Candidate(table, column))
+            candidate.reasons.add(reason)
+            if query not in candidate.queries:
+                candidate.queries.append(query)
+
+    if estimate:
+        for candidate in candidates.values():
+            if table_bytes[candidate.table] > INDEX_ADVISOR_TRIAL_MAX_MB * 1024 * 1024:
+                if log:
+                    log(f"Not estimating {candidate.index_name}: {candidate.table} is over {INDEX_ADVISOR_TRIAL_MAX_MB} MB")
+                continue
+            try:
+                candidate.estimated_costs = await _trial_costs(conn, candidate)
+            except asyncpg.PostgresError as e:
+                if log:
+                    log(f"Could not estimate {candidate.index_name}: {e}")
+
+    ranked = sorted(candidates.values(), key=lambda c: -(c.estimated_saving_ms or 0))
+    return {
+        "queries": len(queries),
+        "skipped": skipped,
+        "candidates": [_describe(c) for c in ranked],
+        "recommendations": [c for c in ranked if c.recommended],
+    }
+
+def _describe(candidate: Candidate) -> Dict[str, Any]:
+    speedup = candidate.estimated_speedup
+    saving = candidate.estimated_saving_ms
+    return {
+        "index": candidate.index_name,
+        "table": candidate.table,
+        "column": candidate.column,
+        "reasons": sorted(candidate.reasons),
+        "create_sql": candidate.create_sql(concurrently=True),
+        "estimated_speedup": _round(speedup),
+        "estimated_saving_ms": _round(saving),
+        "recommended": candidate.recommended,
+        "queries": [
+            {
+                "query": q.label,
+                "observed_ms": round(q.observed_ms, 2) if q.observed_ms is not None else None,
+                "cost": q.cost,
+                "estimated_cost": candidate.estimated_costs.get(q.label),
+                "estimated_speedup": (round(candidate.query_speedup(q), 2)
+                                      if q.label in candidate.estimated_costs else None),
+            }
+            for q in candidate.queries
+        ],
+    }
+
+async def apply(conn, recommendations: List[Candidate],
+                log: Optional[Callable[[str], None]] = print) -> List[Dict[str, Any]]:
+    """Create each recommended index concurrently, timing its queries before and after.
+
+    Must run outside a transaction. A build that fails leaves an invalid
+    index behind, which is dropped again.
+    """
+    applied = []
+    for candidate in recommendations:
+        before = {q.label: await timed(conn, q.sql, q.args) for q in candidate.queries}
+        try:
+            await conn.execute(candidate.create_sql(concurrently=True))
+        except asyncpg.PostgresError as e:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_ident(candidate.index_name)}")
+            if log:
+                log(f"Creating {candidate.index_name} failed: {e}")
+            applied.append({"index": candidate.index_name, "error": str(e)})
+            continue
+        after = {q.label: await timed(conn, q.sql, q.args) for q in candidate.queries}
+
+        measured = sum(before.values()) / max(sum(after.values()), 0.001)
+        estimated = candidate.estimated_speedup
+        if log:
+            log(f"Created {candidate.index_name}: estimated {_times(estimated)}, measured {_times(measured)}")
+        applied.append({
+            "index": candidate.index_name,
+            "estimated_speedup": _round(estimated),
+            "measured_speedup": round(measured, 2),
+            "queries": [
+                {
+                    "query": q.label,
+                    "before_ms": round(before[q.label], 3),
+                    "after_ms": round(after[q.label], 3),
+                    "estimated_speedup": (_round(candidate.query_speedup(q))
+                                          if q.label in candidate.estimated_costs else None),
+                    "measured_speedup": round(before[q.label] / max(after[q.label], 0.001), 2),
+                }
+                for q in candidate.queries
+            ],
+        })
+    return applied
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recommend and optionally create indexes for the SQL AnalyticsOS runs")
+    parser.add_argument("--apply", action="store_true", help="create recommended indexes concurrently and measure")
+    parser.add_argument("--no-estimate", action="store_true", help="list candidates without trial index builds")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    args = parser.parse_args(argv)
+    if args.apply and args.no_estimate:
+        parser.error("--apply needs the estimates to pick indexes")
+
+    from .database import DATABASE_URL
+
+    log = lambda message: print(message, file=sys.stderr)
+    conn = await asyncpg.connect(args.dsn or DATABASE_URL)
+    try:
+        advice = await advise(conn, estimate=not args.no_estimate, log=log)
+        recommendations = advice.pop("recommendations")
+        log(f"Planned {advice['queries']} queries: {len(advice['candidates'])} unindexed predicate columns, "
+            f"{len(recommendations)} recommended")
+        for candidate in recommendations:
+            # Recommended candidates have an estimate for at least one query
+            best = max((q for q in candidate.queries if q.label in candidate.estimated_costs),
+                       key=candidate.query_speedup)
+            log(f"  {candidate.create_sql(concurrently=True)}  -- estimated {_times(candidate.estimated_speedup)} "
+                f"on {len(candidate.queries)} queries, {candidate.query_speedup(best):.1f}x on {best.label}")
+        if args.apply:
+            advice["applied"] = await apply(conn, recommendations, log=log)
+    finally:
+        await conn.close()
+
+    output = json.dumps(advice, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,322 @@
+import os
+import time
+import hashlib
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterable
+
+from .sql_utils import fingerprint_sql
+
+# Distinct SQL fingerprints tracked individually; the rest are reported as "other"
+MAX_QUERY_FINGERPRINTS = int(os.getenv("MAX_QUERY_FINGERPRINTS", "500"))
+
+# Seconds; fine-grained at the low end where most API queries land
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Histogram:
+    """Prometheus histogram with cumulative buckets per label set"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            total = cumulative + series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {total}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+                     for values, value in self._values.items())
+        return lines
+
+class Collected:
+    """Gauge or counter whose samples are read from live state at scrape time"""
+
+    def __init__(self, name: str, help: str, type: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+                     for values, value in self.collect() if value is not None)
+        return lines
+
+class Instrumentation:
+    """Request, query, pool and cache measurements, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            "analyticsos_http_request_duration_seconds",
+            "Time from request start until the response body is fully sent, per route template",
+            ("method", "route", "status"),
+        )
+        self.query_latency = Histogram(
+            "analyticsos_db_query_duration_seconds",
+            "Query execution time per SQL fingerprint (see analyticsos_db_query_info); time to first batch for streamed queries",
+            ("pool", "query"),
+        )
+        self.query_errors = Counter(
+            "analyticsos_db_query_errors_total", "Failed queries per SQL fingerprint", ("pool", "query"),
+        )
+        self.acquire_wait = Histogram(
+            "analyticsos_db_pool_acquire_wait_seconds", "Time spent waiting for a pool connection", ("pool",),
+        )
+        self._fingerprints: Dict[str, str] = {}
+        # Raw SQL -> fingerprint key, so hot queries skip re-tokenizing
+        self._keys_by_sql: Dict[str, str] = {}
+        self._pools: Dict[str, Any] = {}
+        self._caches: Dict[str, Any] = {}
+        self._admissions: Dict[str, Any] = {}
+        self._metrics = [
+            self.request_latency,
+            self.query_latency,
+            self.query_errors,
+            Collected("analyticsos_db_query_info", "SQL text of each query fingerprint", "gauge",
+                      ("query", "sql"), lambda: [((key, sql), 1) for sql, key in self._fingerprints.items()]),
+            self.acquire_wait,
+            Collected("analyticsos_db_pool_connections", "Open pool connections by state", "gauge",
+                      ("pool", "state"), self._collect_connections),
+            Collected("analyticsos_db_pool_max_connections", "Configured pool max_size", "gauge",
+                      ("pool",), lambda: [((name,), pool.get_max_size()) for name, pool in self._pools.items()]),
+            Collected("analyticsos_workload_slots_in_use", "Admission slots held per workload class", "gauge",
+                      ("pool", "workload"), lambda: self._collect_admissions(lambda a, w: a.in_use[w])),
+            Collected("analyticsos_workload_slot_limit", "Slots each workload class may hold at once", "gauge",
+                      ("pool", "workload"), lambda: self._collect_admissions(lambda a, w: a.limits[w])),
+            Collected("analyticsos_workload_queued", "Requests waiting for an admission slot", "gauge",
+                      ("pool", "workload"), lambda: self._collect_admissions(lambda a, w: a.queued(w))),
+            Collected("analyticsos_workload_rejected_total", "Requests rejected with 503 because their class was saturated",
+                      "counter", ("pool", "workload", "reason"), self._collect_rejections),
+            Collected("analyticsos_cache_requests_total", "Cache lookups by outcome", "counter",
+                      ("cache", "result"), self._collect_cache_requests),
+            Collected("analyticsos_cache_hit_ratio", "Share of cache lookups served from cache, fresh or stale",
+                      "gauge", ("cache",),
+                      lambda: [((name,), cache.stats()["hit_rate"]) for name, cache in self._caches.items()]),
+            Collected("analyticsos_cache_bytes", "Estimated bytes held by each cache", "gauge",
+                      ("cache",), lambda: [((name,), cache.stats()["bytes"]) for name, cache in self._caches.items()]),
+        ]
+
+    def query_key(self, sql: str) -> str:
+        """Short stable label for a query's fingerprint"""
+        key = self._keys_by_sql.get(sql)
+        if key is None:
+            if len(self._keys_by_sql) >= 4 * MAX_QUERY_FINGERPRINTS:
+                self._keys_by_sql.clear()
+            key = self._keys_by_sql[sql] = self._fingerprint_key(sql)
+        return key
+
+    def _fingerprint_key(self, sql: str) -> str:
+        fingerprint = fingerprint_sql(sql)
+        key = self._fingerprints.get(fingerprint)
+        if key is None:
+            if len(self._fingerprints) >= MAX_QUERY_FINGERPRINTS:
+                return "other"
+            key = self._fingerprints[fingerprint] = hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+        return key
+
+    def observe_query(self, pool: str, sql: str, seconds: float, failed: bool = False):
+        key = self.query_key(sql)
+        self.query_latency.observe(seconds, pool, key)
+        if failed:
+            self.query_errors.inc(pool, key)
+
+    def register_pool(self, name: str, pool):
+        self._pools[name] = pool
+
+    def register_admission(self, name: str, admission):
+        """An AdmissionController guarding the named pool or executor"""
+        self._admissions[name] = admission
+
+    def register_cache(self, name: str, cache):
+        """Any object with QueryCache-style stats() and counters"""
+        self._caches[name] = cache
+
+    def _collect_connections(self):
+        for name, pool in self._pools.items():
+            idle = pool.get_idle_size()
+            yield (name, "in_use"), pool.get_size() - idle
+            yield (name, "idle"), idle
+
+    def _collect_admissions(self, value: Callable[[Any, str], float]):
+        for name, admission in self._admissions.items():
+            for workload in admission.classes:
+                yield (name, workload), value(admission, workload)
+
+    def _collect_rejections(self):
+        for name, admission in self._admissions.items():
+            for (workload, reason), count in admission.rejected.items():
+                yield (name, workload, reason), count
+
+    def _collect_cache_requests(self):
+        for name, cache in self._caches.items():
+            for result in ("hits", "stale_hits", "misses"):
+                yield (name, result), cache.counters[result]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Global instrumentation
+instrumentation = Instrumentation()
+
+def query_logger(pool_name: str) -> Callable:
+    """asyncpg query logger recording each statement's latency under its fingerprint"""
+    def log(record):
+        instrumentation.observe_query(pool_name, record.query, record.elapsed, record.exception is not None)
+    return log
+
+class InstrumentedPool:
+    """asyncpg pool wrapper that times acquire waits and every query run on its connections.
+
+    Pass `instrumented_init(name)` as the pool's init so new connections get
+    the query logger. With an admission controller, each acquire first takes
+    a slot for the current workload class, which is freed on release.
+    Everything other than acquire and release passes through.
+    """
+
+    def __init__(self, pool, name: str, admission=None):
+        self._pool = pool
+        self.name = name
+        self.admission = admission
+        # Connection -> admission slot it was acquired under
+        self._admitted: Dict[Any, Any] = {}
+        instrumentation.register_pool(name, pool)
+        if admission is not None:
+            instrumentation.register_admission(name, admission)
+
+    def acquire(self, *, timeout: Optional[float] = None):
+        return _InstrumentedAcquire(self, timeout)
+
+    async def release(self, conn):
+        try:
+            await self._pool.release(conn)
+        finally:
+            token = self._admitted.pop(conn, None)
+            if token is not None:
+                self.admission.release(token)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+class _InstrumentedAcquire:
+    def __init__(self, pool: InstrumentedPool, timeout: Optional[float]):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        admission = self.pool.admission
+        token = await admission.acquire() if admission is not None else None
+        try:
+            conn = await self.pool._pool.acquire(timeout=self.timeout)
+        except BaseException:
+            if token is not None:
+                admission.release(token)
+            raise
+        if token is not None:
+            self.pool._admitted[conn] = token
+        instrumentation.acquire_wait.observe(time.perf_counter() - started, self.pool.name)
+        return conn
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self._acquire()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        await self.pool.release(self.conn)
+
+def instrumented_init(name: str, init: Optional[Callable] = None) -> Callable:
+    """Pool init callback adding the query logger, after any other init"""
+    async def setup(conn):
+        if init is not None:
+            await init(conn)
+        conn.add_query_logger(query_logger(name))
+    return setup
+
+class InstrumentationMiddleware:
+    """ASGI middleware timing each request per method, route template and status class"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Set by the router on match; unmatched paths are grouped so they can't blow up cardinality
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            instrumentation.request_latency.observe(
+                time.perf_counter() - started, scope["method"], template, f"{status // 100}xx"
+            )
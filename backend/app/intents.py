@@ -0,0 +1,227 @@
+import re
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    # Words are kept as written: "orders" and "order" are different phrases ("order value" is AOV)
+    return _WORD.findall(text.lower())
+
+def normalize_question(text: str) -> str:
+    """Canonical form of a question for caching: lower-cased words, punctuation ignored"""
+    return " ".join(tokenize(text))
+
+class Intent:
+    """A question the copilot can answer with one query.
+
+    Columns in `sql` (raw tables) and `rollup_sql` (daily rollups, used on the
+    built-in database once they are built) are named after the chart_data
+    keys, so each row becomes one chart point as is.
+    """
+
+    def __init__(self, name: str, phrases: List[str], response: str,
+                 sql: Optional[str] = None, rollup_sql: Optional[str] = None,
+                 chart_type: Optional[str] = None,
+                 summary: Optional[Callable[[List[Dict[str, Any]]], str]] = None):
+        self.name = name
+        self.phrases = phrases
+        self.response = response
+        self.sql = sql
+        self.rollup_sql = rollup_sql or sql
+        self.chart_type = chart_type
+        self.summary = summary
+
+class IntentIndex:
+    """Phrase matcher compiled once into an inverted index on each phrase's first word.
+
+    Matching costs one dict lookup per word of the question plus a check of
+    the few phrases starting with that word, however many intents exist.
+    The intent with the longest matching phrase wins, so the more specific
+    "order value" beats "orders"; then the one matching the most distinct
+    phrases, then the one declared first.
+    """
+
+    def __init__(self, intents: List[Intent]):
+        self.intents = intents
+        self._by_first_word: Dict[str, List[Tuple[int, Tuple[str, ...]]]] = {}
+        for position, intent in enumerate(intents):
+            for phrase in intent.phrases:
+                words = tuple(tokenize(phrase))
+                if words:
+                    self._by_first_word.setdefault(words[0], []).append((position, words))
+
+    def match(self, text: str) -> Optional[Intent]:
+        words = tokenize(text)
+        matched: Dict[int, set] = {}
+        for i, word in enumerate(words):
+            for position, phrase in self._by_first_word.get(word, ()):
+                if tuple(words[i:i + len(phrase)]) == phrase:
+                    matched.setdefault(position, set()).add(phrase)
+        if not matched:
+            return None
+        best = min(matched, key=lambda position: (
+            -max(len(phrase) for phrase in matched[position]), -len(matched[position]), position
+        ))
+        return self.intents[best]
+
+def _total(column: str) -> Callable[[List[Dict[str, Any]]], float]:
+    return lambda rows: sum(float(row[column] or 0) for row in rows)
+
+CHAT_INTENTS = [
+    Intent(
+        "revenue",
+        ["revenue", "sales", "money", "income"],
+        "Based on your data, here's the revenue analysis for the last 30 days.",
+        sql="""
+            SELECT created_at::date AS date, SUM(total_amount) AS value
+            FROM orders
+            WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'
+            GROUP BY 1 ORDER BY 1
+        """,
+        rollup_sql="""
+            SELECT day AS date, SUM(revenue) AS value
+            FROM orders_daily
+            WHERE status = 'completed' AND day >= CURRENT_DATE - INTERVAL '30 days'
+            GROUP BY 1 ORDER BY 1
+        """,
+        chart_type="line",
+        summary=lambda rows: f"Completed orders brought in ${_total('value')(rows):,.2f} over {len(rows)} days.",
+    ),
+    Intent(
+        "orders",
+        ["orders", "purchases", "transactions", "order status"],
+        "Here's your order status distribution for the last 30 days.",
+        sql="""
+            SELECT initcap(status) AS name, COUNT(*) AS value
+            FROM orders
+            WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
+            GROUP BY status ORDER BY value DESC
+        """,
+        rollup_sql="""
+            SELECT initcap(status) AS name, SUM(order_count)::bigint AS value
+            FROM orders_daily
+            WHERE day >= CURRENT_DATE - INTERVAL '30 days'
+            GROUP BY status ORDER BY value DESC
+        """,
+        chart_type="pie",
+        summary=lambda rows: f"{int(_total('value')(rows)):,} orders were placed.",
+    ),
+    Intent(
+        "customers",
+        ["customers", "users", "people"],
+        "Here's how your customers break down over the last 30 days.",
+        sql="""
+            WITH first_orders AS (
+                SELECT user_id, MIN(created_at) AS first_at
+                FROM orders WHERE user_id IS NOT NULL GROUP BY user_id
+            ), active AS (
+                SELECT DISTINCT user_id FROM orders
+                WHERE created_at >= CURRENT_DATE - INTERVAL '30 days' AND user_id IS NOT NULL
+            ), counts AS (
+                SELECT
+                    (SELECT COUNT(*) FROM first_orders WHERE first_at >= CURRENT_DATE - INTERVAL '30 days') AS new_users,
+                    (SELECT COUNT(*) FROM first_orders WHERE first_at < CURRENT_DATE - INTERVAL '30 days') AS earlier_users,
+                    (SELECT COUNT(*) FROM active) AS active_users
+            )
+            SELECT v.category, v.value FROM counts, LATERAL (VALUES
+                ('New Users', new_users),
+                ('Returning Users', active_users - new_users),
+                ('Active Users', active_users),
+                ('Churned Users', earlier_users - (active_users - new_users))
+            ) AS v(category, value)
+        """,
+        rollup_sql="""
+            WITH counts AS (
+                SELECT
+                    (SELECT COUNT(*) FROM user_first_orders WHERE first_at >= CURRENT_DATE - INTERVAL '30 days') AS new_users,
+                    (SELECT COUNT(*) FROM user_first_orders WHERE first_at < CURRENT_DATE - INTERVAL '30 days') AS earlier_users,
+                    (SELECT kmv_distinct(user_sketch) FROM orders_daily WHERE day >= CURRENT_DATE - INTERVAL '30 days') AS active_users
+            )
+            SELECT v.category, v.value FROM counts, LATERAL (VALUES
+                ('New Users', new_users),
+                ('Returning Users', GREATEST(active_users - new_users, 0)),
+                ('Active Users', active_users),
+                ('Churned Users', GREATEST(earlier_users - (active_users - new_users), 0))
+            ) AS v(category, value)
+        """,
+        chart_type="bar",
+        summary=lambda rows: next((f"{int(row['value']):,} customers ordered in the last 30 days."
+                                   for row in rows if row['category'] == 'Active Users'), ""),
+    ),
+    Intent(
+        "products",
+        ["products", "items", "inventory"],
+        "Here are your top-selling products.",
+        sql="""
+            SELECT p.name, SUM(oi.quantity) AS sales
+            FROM products p JOIN order_items oi ON p.id = oi.product_id
+            GROUP BY p.id, p.name ORDER BY sales DESC LIMIT 5
+        """,
+        rollup_sql="""
+            SELECT p.name, SUM(s.quantity) AS sales
+            FROM products p JOIN product_sales_daily s ON p.id = s.product_id
+            GROUP BY p.id, p.name ORDER BY sales DESC LIMIT 5
+        """,
+        chart_type="bar",
+        summary=lambda rows: f"{rows[0]['name']} leads with {int(rows[0]['sales']):,} units sold." if rows else "",
+    ),
+    Intent(
+        "aov",
+        ["aov", "average order value", "order value"],
+        "Here's your Average Order Value (AOV) by week.",
+        sql="""
+            SELECT to_char(date_trunc('week', created_at), 'YYYY-MM-DD') AS period,
+                   ROUND(AVG(total_amount), 2) AS aov
+            FROM orders
+            WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '28 days'
+            GROUP BY 1 ORDER BY 1
+        """,
+        rollup_sql="""
+            SELECT to_char(date_trunc('week', day::timestamp), 'YYYY-MM-DD') AS period,
+                   ROUND(SUM(revenue) / NULLIF(SUM(order_count), 0), 2) AS aov
+            FROM orders_daily
+            WHERE status = 'completed' AND day >= CURRENT_DATE - INTERVAL '28 days'
+            GROUP BY 1 ORDER BY 1
+        """,
+        chart_type="line",
+        summary=lambda rows: f"The latest week's AOV is ${float(rows[-1]['aov'] or 0):,.2f}." if rows else "",
+    ),
+    Intent(
+        "help",
+        ["help", "what can you do", "capabilities"],
+        """I'm your AI analytics copilot! I can help you with:
+
+📊 **Data Analysis**: Ask about revenue, orders, customers, or products
+🔍 **SQL Queries**: I'll generate SQL queries for your questions
+📈 **Visualizations**: Create charts and graphs from your data
+📋 **Metrics**: Calculate KPIs like AOV, LTV, conversion rates
+🎯 **Insights**: Provide business insights and recommendations
+
+Try asking me things like:
+- "Show me revenue trends"
+- "What are my top products?"
+- "How many active customers do I have?"
+- "Calculate average order value"
+- "Show me order status breakdown"
+            """,
+    ),
+]
+
+# Used when no intent matches
+FALLBACK_RESPONSES = [
+    "I can help you analyze that data. Could you be more specific about what metrics you'd like to see?",
+    "Let me look into your data for that information. What specific time period are you interested in?",
+    "That's an interesting question! I can generate insights about your business data. What would you like to focus on?",
+    "I'd be happy to help with that analysis. Could you clarify which data points you're most interested in?"
+]
+
+FALLBACK_INTENT = Intent(
+    "total",
+    [],
+    "",
+    sql="SELECT COUNT(*) as total_records FROM orders",
+    rollup_sql="SELECT SUM(order_count) as total_records FROM orders_daily",
+    summary=lambda rows: f"For reference, there are {int(rows[0]['total_records'] or 0):,} orders on record." if rows else "",
+)
+
+intent_index = IntentIndex(CHAT_INTENTS)
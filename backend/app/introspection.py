@@ -0,0 +1,197 @@
+import os
+import time
+import hashlib
+from typing import Optional, Dict, Any, List
+
+from .connections import dataset_pools
+from .singleflight import SingleFlight
+
+# How long a snapshot is served without re-checking the dataset's catalog
+SCHEMA_CHECK_INTERVAL_SECONDS = float(os.getenv("SCHEMA_CHECK_INTERVAL_SECONDS", "60"))
+
+USER_RELATIONS = """
+    c.relkind IN ('r', 'p', 'v', 'm', 'f')
+    AND NOT c.relispartition
+    AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+    AND n.nspname NOT LIKE 'pg\\_toast%'
+    AND n.nspname NOT LIKE 'pg\\_temp%'
+"""
+
+# One row per relation with a token that changes whenever its columns or keys change.
+# Any DDL rewrites the affected pg_class/pg_attribute/pg_constraint rows, giving them a new xmin.
+TABLE_VERSIONS_SQL = f"""
+    SELECT c.oid, md5(
+        c.xmin::text
+        || '|' || COALESCE((SELECT string_agg(a.xmin::text, ',' ORDER BY a.attnum)
+                            FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0), '')
+        || '|' || COALESCE((SELECT string_agg(k.xmin::text, ',' ORDER BY k.oid)
+                            FROM pg_constraint k WHERE k.conrelid = c.oid AND k.contype IN ('p', 'f')), '')
+    ) AS version
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE {USER_RELATIONS}
+"""
+
+COLUMNS_SQL = """
+    SELECT c.oid, n.nspname AS schema, c.relname AS table_name, c.relkind::text AS relkind,
+           a.attnum, a.attname AS column_name,
+           format_type(a.atttypid, a.atttypmod) AS data_type,
+           NOT a.attnotnull AS nullable
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.oid = ANY($1::oid[])
+    ORDER BY c.oid, a.attnum
+"""
+
+KEYS_SQL = """
+    SELECT conrelid AS oid, contype::text AS contype, conkey, confrelid, confkey
+    FROM pg_constraint
+    WHERE conrelid = ANY($1::oid[]) AND contype IN ('p', 'f')
+    ORDER BY conrelid, oid
+"""
+
+class SchemaSnapshot:
+    """Versioned, immutable view of a dataset's catalog"""
+
+    def __init__(self, tables: Dict[int, Dict[str, Any]], versions: Dict[int, str]):
+        self.tables = tables
+        self.versions = versions
+        digest = hashlib.md5(
+            ",".join(f"{oid}:{versions[oid]}" for oid in sorted(versions)).encode()
+        ).hexdigest()
+        self.etag = f'"{digest}"'
+        self.checked_at = time.monotonic()
+        self.payload = self._render()
+
+    def _render(self) -> Dict[str, Any]:
+        """Build the API response shape once per snapshot"""
+        def display_name(table):
+            return table['name'] if table['schema'] == 'public' else f"{table['schema']}.{table['name']}"
+
+        def column_name(oid, attnum):
+            table = self.tables.get(oid)
+            if not table:
+                return None
+            return table['attnames'].get(attnum)
+
+        rendered = {}
+        for oid, table in self.tables.items():
+            fk_columns = {attnum for fk in table['foreign_keys'] for attnum in fk['columns']}
+            rendered[oid] = {
+                "name": display_name(table),
+                "schema": table['schema'],
+                "columns": [
+                    {
+                        "name": col['name'],
+                        "type": col['type'],
+                        "nullable": col['nullable'],
+                        "primary_key": col['attnum'] in table['primary_key'],
+                        "foreign_key": col['attnum'] in fk_columns,
+                    }
+                    for col in table['columns']
+                ],
+                "relationships": [],
+            }
+
+        # Each foreign key shows up on both ends of the relationship
+        for oid, table in self.tables.items():
+            for fk in table['foreign_keys']:
+                target = rendered.get(fk['ref_oid'])
+                if not target:
+                    continue
+                for attnum, ref_attnum in zip(fk['columns'], fk['ref_columns']):
+                    from_column = column_name(oid, attnum)
+                    to_column = column_name(fk['ref_oid'], ref_attnum)
+                    rendered[oid]['relationships'].append({
+                        "from_table": rendered[oid]['name'], "from_column": from_column,
+                        "to_table": target['name'], "to_column": to_column, "type": "many-to-one",
+                    })
+                    target['relationships'].append({
+                        "from_table": target['name'], "from_column": to_column,
+                        "to_table": rendered[oid]['name'], "to_column": from_column, "type": "one-to-many",
+                    })
+
+        return {"tables": sorted(rendered.values(), key=lambda t: (t['schema'] != 'public', t['name']))}
+
+async def _load_tables(conn, oids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Fetch columns and keys for a set of relations in two bulk queries"""
+    tables: Dict[int, Dict[str, Any]] = {}
+    for row in await conn.fetch(COLUMNS_SQL, oids):
+        table = tables.get(row['oid'])
+        if table is None:
+            table = tables[row['oid']] = {
+                "schema": row['schema'],
+                "name": row['table_name'],
+                "kind": row['relkind'],
+                "columns": [],
+                "attnames": {},
+                "primary_key": set(),
+                "foreign_keys": [],
+            }
+        if row['attnum'] is not None:
+            table['columns'].append({
+                "attnum": row['attnum'],
+                "name": row['column_name'],
+                "type": row['data_type'],
+                "nullable": row['nullable'],
+            })
+            table['attnames'][row['attnum']] = row['column_name']
+
+    for row in await conn.fetch(KEYS_SQL, oids):
+        table = tables.get(row['oid'])
+        if table is None:
+            continue
+        if row['contype'] == 'p':
+            table['primary_key'].update(row['conkey'])
+        else:
+            table['foreign_keys'].append({
+                "columns": list(row['conkey']),
+                "ref_oid": row['confrelid'],
+                "ref_columns": list(row['confkey']),
+            })
+    return tables
+
+class SchemaCatalog:
+    """Per-dataset schema snapshots, refreshed incrementally when the catalog changes"""
+
+    def __init__(self, check_interval: float = SCHEMA_CHECK_INTERVAL_SECONDS):
+        self.check_interval = check_interval
+        self._snapshots: Dict[Any, SchemaSnapshot] = {}
+        self._refreshes = SingleFlight()
+
+    async def get(self, dataset: Dict[str, Any], force: bool = False) -> SchemaSnapshot:
+        """Return the current snapshot, re-checking the catalog once the interval has passed"""
+        snapshot = self._snapshots.get(dataset['id'])
+        if snapshot and not force and time.monotonic() - snapshot.checked_at < self.check_interval:
+            return snapshot
+        return await self._refreshes.do(dataset['id'], lambda: self._refresh(dataset))
+
+    def invalidate(self, dataset_id: Any):
+        """Drop the cached snapshot for a dataset"""
+        self._snapshots.pop(dataset_id, None)
+
+    async def _refresh(self, dataset: Dict[str, Any]) -> SchemaSnapshot:
+        previous = self._snapshots.get(dataset['id'])
+        pool = await dataset_pools.get_pool(dataset)
+        async with pool.acquire() as conn:
+            versions = {row['oid']: row['version'] for row in await conn.fetch(TABLE_VERSIONS_SQL)}
+
+            if previous and previous.versions == versions:
+                previous.checked_at = time.monotonic()
+                return previous
+
+            # Only relations that are new or whose version changed are re-read
+            known = previous.versions if previous else {}
+            changed = [oid for oid, version in versions.items() if known.get(oid) != version]
+            tables = {oid: t for oid, t in (previous.tables if previous else {}).items()
+                      if oid in versions and oid not in changed}
+            if changed:
+                tables.update(await _load_tables(conn, changed))
+
+        snapshot = SchemaSnapshot(tables, {oid: versions[oid] for oid in tables})
+        self._snapshots[dataset['id']] = snapshot
+        return snapshot
+
+# Global schema catalog cache
+schema_catalog = SchemaCatalog()
@@ -0,0 +1,40 @@
+from typing import Dict
+
+from .rollups import order_rollups
+from .cache import cached_fetch
+
+# All dashboard KPIs in a single pass over the 30-day window
+DASHBOARD_KPIS_SQL = """
+    SELECT
+        COALESCE(SUM(total_amount) FILTER (WHERE status = 'completed'), 0) AS total_revenue,
+        COUNT(*) AS total_orders,
+        COUNT(DISTINCT user_id) AS active_users,
+        COALESCE(AVG(total_amount) FILTER (WHERE status = 'completed'), 0) AS avg_order_value
+    FROM orders
+    WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
+"""
+
+# Same KPIs from the daily rollup. The window is whole days, so revenue, order
+# count and average order value match the raw query exactly; active users is a
+# KMV estimate, exact up to KMV_SKETCH_SIZE (1,024) users and approximate beyond
+ROLLUP_DASHBOARD_KPIS_SQL = """
+    SELECT
+        COALESCE(SUM(revenue) FILTER (WHERE status = 'completed'), 0) AS total_revenue,
+        COALESCE(SUM(order_count), 0) AS total_orders,
+        kmv_distinct(user_sketch) AS active_users,
+        COALESCE(SUM(revenue) FILTER (WHERE status = 'completed')
+                 / NULLIF(SUM(order_count) FILTER (WHERE status = 'completed'), 0), 0) AS avg_order_value
+    FROM orders_daily
+    WHERE day >= CURRENT_DATE - INTERVAL '30 days'
+"""
+
+async def compute_dashboard_kpis(pool) -> Dict[str, str]:
+    """Compute and format the dashboard KPI cards"""
+    sql = ROLLUP_DASHBOARD_KPIS_SQL if order_rollups.ready else DASHBOARD_KPIS_SQL
+    row = (await cached_fetch(pool, sql, watermark=order_rollups.watermark))[0]
+    return {
+        "total_revenue": f"${row['total_revenue']:,.2f}",
+        "total_orders": f"{row['total_orders']:,}",
+        "active_users": f"{row['active_users']:,}",
+        "avg_order_value": f"${row['avg_order_value']:.2f}"
+    }
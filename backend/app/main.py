@@ -1,18 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
 import uvicorn
 import os
+import time
 from datetime import datetime, timedelta
 import random
 
-from .routers import datasets, metrics, chat
-from .database import init_db
+from .routers import datasets, metrics, chat, exports
+from .database import init_db, db_manager
+from .executor import metric_executor
+from .exports import export_executor
+from .connections import dataset_pools
+from .history import metric_history
+from .slow_queries import slow_query_log
+from .scheduler import start_scheduler, stop_scheduler
+from .rollups import order_rollups
+from .serialization import FastJSONResponse
+from .cache import query_cache
+from .instrumentation import instrumentation, InstrumentationMiddleware
+from .serve import DRAIN_TIMEOUT_SECONDS
+from .workloads import WorkloadSaturated
 
 app = FastAPI(
     title="AnalyticsOS API",
     description="AI-powered analytics platform API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
 # CORS middleware
@@ -22,25 +36,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Catalog pagination and load shedding headers
+    expose_headers=["X-Next-Cursor", "Link", "Retry-After"],
 )
+app.add_middleware(InstrumentationMiddleware)
+
+instrumentation.register_cache("query", query_cache)
+instrumentation.register_cache("chat_answers", chat.answer_cache)
 
 # Include routers
 app.include_router(datasets.router, prefix="/api/datasets", tags=["datasets"])
 app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
+app.include_router(exports.router, prefix="/api/exports", tags=["exports"])
+
+@app.exception_handler(WorkloadSaturated)
+async def workload_saturated_handler(request: Request, exc: WorkloadSaturated):
+    """Shed load fast instead of queueing: the client retries after the estimated wait"""
+    return FastJSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "workload": exc.workload, "pool": exc.pool},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Filled in once startup completes; reported by /health
+startup_stats = {}
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
-    await init_db()
+    started = time.perf_counter()
+    startup_stats.update(await init_db())
+    dataset_pools.start()
+    metric_history.start(db_manager.pool)
+    order_rollups.start(db_manager.pool)
+    start_scheduler(db_manager.pool)
+    startup_stats["ready_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Startup complete in {startup_stats['ready_ms']} ms")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Finish batch runs, stop background tasks and close every pool"""
+    await metrics.drain_batch_runs(DRAIN_TIMEOUT_SECONDS)
+    await stop_scheduler()
+    await metric_history.stop()
+    await order_rollups.stop()
+    await slow_query_log.stop()
+    await metric_executor.close()
+    await export_executor.close()
+    await dataset_pools.close()
+    await db_manager.close()
 
 @app.get("/")
 async def root():
     return {"message": "AnalyticsOS API", "version": "1.0.0"}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Request, query, pool and cache measurements in the Prometheus text format"""
+    return PlainTextResponse(instrumentation.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    return {"status": "healthy", "timestamp": datetime.utcnow(), "startup": startup_stats}
 
 if __name__ == "__main__":
     uvicorn.run(
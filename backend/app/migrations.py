@@ -0,0 +1,409 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in
+schema_migrations. A started process reads the applied version with one
+query and only takes the migration lock when something is pending.
+
+Usage (from the backend directory):
+
+    python -m app.migrations           # apply pending migrations
+    python -m app.migrations --status  # show applied and latest versions
+
+Statements stay idempotent (IF NOT EXISTS) so databases created before
+migrations were tracked adopt them without errors. New schema changes are
+appended as a new Migration; applied ones are never edited.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import asyncpg
+from typing import List, Union, Callable, Awaitable, Optional
+
+from .rollups import KMV_FUNCTIONS_SQL, ORDER_CHANGE_TRIGGERS_SQL
+from .versions import backfill_versions
+
+# Concurrent starts wait on this while one process migrates
+MIGRATION_LOCK_KEY = 0x6D696772617465  # "migrate"
+
+# Role that metric, chat and export SQL assume on the built-in database. It
+# can read the analytics tables granted to it, never the app's own tables
+# (datasets holds connection passwords).
+METRIC_DB_ROLE = os.getenv("METRIC_DB_ROLE", "analyticsos_metrics")
+
+# Tables of the built-in database that metric SQL may read
+METRIC_READABLE_TABLES = [
+    "users", "products", "orders", "order_items",
+    "orders_daily", "product_sales_daily", "user_first_orders",
+]
+
+Step = Union[str, Callable[[asyncpg.Connection], Awaitable[None]]]
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: List[Step]):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+SEARCH_INDEXES = [
+    ("idx_metrics_name_trgm", "metrics USING gin (name gin_trgm_ops)"),
+    ("idx_metrics_description_trgm", "metrics USING gin (description gin_trgm_ops)"),
+    ("idx_datasets_name_trgm", "datasets USING gin (name gin_trgm_ops)"),
+    ("idx_datasets_database_name_trgm", "datasets USING gin (database_name gin_trgm_ops)"),
+]
+
+async def create_search_indexes(conn) -> bool:
+    """Trigram indexes for catalog substring search; returns False where pg_trgm can't be installed.
+
+    Search still works without them, by scanning. Safe to call again once
+    the extension becomes available, which ensure_search_indexes does.
+    """
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"):
+        print("pg_trgm is not available; catalog search will scan instead of using trigram indexes")
+        return False
+    try:
+        # Savepoint, so a missing privilege doesn't abort the migration
+        async with conn.transaction():
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except asyncpg.InsufficientPrivilegeError as e:
+        print(f"Could not install pg_trgm ({e}); catalog search will scan instead of using trigram indexes")
+        return False
+    for name, definition in SEARCH_INDEXES:
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    return True
+
+async def ensure_search_indexes(conn) -> bool:
+    """Create any trigram search index that is missing; returns whether they all exist.
+
+    Migration 8 is recorded as applied even where pg_trgm couldn't be
+    installed, so this runs on every start, outside the versioned steps, and
+    picks the indexes up once the extension becomes available. When they
+    already exist it costs one query.
+    """
+    missing = await conn.fetchval(
+        "SELECT COUNT(*) FROM unnest($1::text[]) AS i(name) WHERE to_regclass(i.name) IS NULL",
+        [name for name, _ in SEARCH_INDEXES]
+    )
+    if not missing:
+        return True
+    async with conn.transaction():
+        return await create_search_indexes(conn)
+
+async def create_metric_role(conn):
+    """Create METRIC_DB_ROLE, grant it read access to METRIC_READABLE_TABLES only, and let the app assume it"""
+    role = _ident(METRIC_DB_ROLE)
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = $1)", METRIC_DB_ROLE):
+        await conn.execute(f"CREATE ROLE {role} NOLOGIN")
+    await conn.execute(f"GRANT USAGE ON SCHEMA {_ident(await conn.fetchval('SELECT current_schema()'))} TO {role}")
+    for table in METRIC_READABLE_TABLES:
+        await conn.execute(f"GRANT SELECT ON {_ident(table)} TO {role}")
+    # Superusers can assume any role; everyone else needs membership
+    if not await conn.fetchval("SELECT rolsuper FROM pg_roles WHERE rolname = current_user"):
+        await conn.execute(f"GRANT {role} TO CURRENT_USER")
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+MIGRATIONS = [
+    Migration(1, "core tables", [
+        """
+        CREATE TABLE IF NOT EXISTS datasets (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            name VARCHAR(255) NOT NULL,
+            type VARCHAR(50) NOT NULL,
+            host VARCHAR(255) NOT NULL,
+            port INTEGER NOT NULL,
+            database_name VARCHAR(255) NOT NULL,
+            username VARCHAR(255) NOT NULL,
+            password_encrypted TEXT NOT NULL,
+            status VARCHAR(50) DEFAULT 'disconnected',
+            tables_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            sql_query TEXT NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            version INTEGER DEFAULT 1,
+            status VARCHAR(50) DEFAULT 'draft',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_run TIMESTAMP NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS metric_results (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            metric_id UUID REFERENCES metrics(id) ON DELETE CASCADE,
+            result_data JSONB,
+            execution_time_ms INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_metric_results_metric_created
+        ON metric_results (metric_id, created_at DESC)
+        """,
+    ]),
+    # Numeric metric history, partitioned by month on ts, with hourly and daily rollups
+    Migration(2, "metric history", [
+        """
+        CREATE TABLE IF NOT EXISTS metric_points (
+            metric_id UUID NOT NULL REFERENCES metrics(id) ON DELETE CASCADE,
+            ts TIMESTAMP NOT NULL,
+            value DOUBLE PRECISION NOT NULL
+        ) PARTITION BY RANGE (ts)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_metric_points_metric_ts ON metric_points (metric_id, ts)",
+        """
+        CREATE TABLE IF NOT EXISTS metric_rollups (
+            metric_id UUID NOT NULL REFERENCES metrics(id) ON DELETE CASCADE,
+            resolution VARCHAR(10) NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            min_value DOUBLE PRECISION NOT NULL,
+            max_value DOUBLE PRECISION NOT NULL,
+            sum_value DOUBLE PRECISION NOT NULL,
+            count BIGINT NOT NULL,
+            last_value DOUBLE PRECISION NOT NULL,
+            last_ts TIMESTAMP NOT NULL,
+            PRIMARY KEY (metric_id, resolution, bucket)
+        )
+        """,
+    ]),
+    Migration(3, "metric targets and run status", [
+        """
+        ALTER TABLE metrics
+        ADD COLUMN IF NOT EXISTS dataset_id UUID REFERENCES datasets(id) ON DELETE SET NULL,
+        ADD COLUMN IF NOT EXISTS refresh_interval_seconds INTEGER
+        """,
+        """
+        ALTER TABLE metric_results
+        ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'success',
+        ADD COLUMN IF NOT EXISTS error TEXT
+        """,
+    ]),
+    Migration(4, "sample ecommerce tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            email VARCHAR(255) UNIQUE NOT NULL,
+            first_name VARCHAR(100),
+            last_name VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP,
+            is_active BOOLEAN DEFAULT true
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            price DECIMAL(10,2) NOT NULL,
+            category VARCHAR(100),
+            stock_quantity INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT true
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            user_id UUID REFERENCES users(id),
+            total_amount DECIMAL(10,2) NOT NULL,
+            status VARCHAR(50) DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS order_items (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            order_id UUID REFERENCES orders(id) ON DELETE CASCADE,
+            product_id UUID REFERENCES products(id),
+            quantity INTEGER NOT NULL,
+            unit_price DECIMAL(10,2) NOT NULL,
+            total_price DECIMAL(10,2) NOT NULL
+        )
+        """,
+        # Dashboard charts filter orders by creation time ranges
+        "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)",
+        # Rollup refreshes find changed orders by updated_at and their items by order_id
+        "CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders (updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)",
+    ]),
+    # Daily rollups of orders and order items, maintained by app.rollups
+    Migration(5, "order rollups", [
+        KMV_FUNCTIONS_SQL,
+        """
+        CREATE TABLE IF NOT EXISTS orders_daily (
+            day DATE NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            revenue DECIMAL(16,2) NOT NULL,
+            order_count BIGINT NOT NULL,
+            item_quantity BIGINT NOT NULL,
+            user_sketch INTEGER[] NOT NULL DEFAULT '{}',
+            PRIMARY KEY (day, status)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS product_sales_daily (
+            day DATE NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            product_id UUID NOT NULL,
+            quantity BIGINT NOT NULL,
+            revenue DECIMAL(16,2) NOT NULL,
+            order_count BIGINT NOT NULL,
+            PRIMARY KEY (day, status, product_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_first_orders (
+            user_id UUID PRIMARY KEY,
+            first_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_first_orders_first_at ON user_first_orders (first_at)",
+        """
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(100) PRIMARY KEY,
+            high_water TIMESTAMP,
+            refreshed_at TIMESTAMP
+        )
+        """,
+    ]),
+    Migration(6, "slow query plans", [
+        """
+        ALTER TABLE metric_results
+        ADD COLUMN IF NOT EXISTS metric_version INTEGER,
+        ADD COLUMN IF NOT EXISTS query_plan JSONB,
+        ADD COLUMN IF NOT EXISTS plan_shape TEXT
+        """,
+        # Slow runs with a captured plan, newest first
+        """
+        CREATE INDEX IF NOT EXISTS idx_metric_results_planned
+        ON metric_results (created_at DESC) WHERE query_plan IS NOT NULL
+        """,
+    ]),
+    # Immutable history of metric definitions; results are keyed to (metric_id, metric_version)
+    Migration(7, "metric versions", [
+        "ALTER TABLE metric_results ADD COLUMN IF NOT EXISTS cached BOOLEAN NOT NULL DEFAULT false",
+        """
+        CREATE TABLE IF NOT EXISTS metric_versions (
+            metric_id UUID NOT NULL REFERENCES metrics(id) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            sql_query TEXT NOT NULL,
+            sql_hash CHAR(64) NOT NULL,
+            dataset_id UUID,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (metric_id, version)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_metric_versions_sql_hash ON metric_versions (sql_hash)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_metric_results_metric_version
+        ON metric_results (metric_id, metric_version, created_at DESC)
+        """,
+        backfill_versions,
+    ]),
+    Migration(8, "catalog pagination and search", [
+        # Keyset pages walk these backwards; filtered listings use the ones led by the filter
+        "CREATE INDEX IF NOT EXISTS idx_metrics_created_id ON metrics (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_metrics_category_created_id ON metrics (category, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_metrics_status_created_id ON metrics (status, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_datasets_created_id ON datasets (created_at, id)",
+        create_search_indexes,
+    ]),
+    # Lets the rollups see updates that don't set updated_at, and deletes
+    Migration(9, "order change tracking", [
+        ORDER_CHANGE_TRIGGERS_SQL,
+        "ALTER TABLE rollup_state ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0",
+    ]),
+    # Metric SQL on the built-in database runs as a role that can't read app tables
+    Migration(10, "metric sql role", [
+        create_metric_role,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+async def applied_version(conn) -> int:
+    """The schema version recorded in the database, in one query; 0 before the first migration"""
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def migrate(conn, log: Optional[Callable[[str], None]] = print) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied.
+
+    Up to date databases cost a single query. Otherwise the migration lock
+    is taken and the version re-read, so concurrent starts apply each
+    migration exactly once.
+    """
+    if await applied_version(conn) >= LATEST_VERSION:
+        return []
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INTEGER
+            )
+        """)
+        current = await applied_version(conn)
+        applied = []
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            started = time.perf_counter()
+            async with conn.transaction():
+                for step in migration.steps:
+                    if callable(step):
+                        await step(conn)
+                    else:
+                        await conn.execute(step)
+                duration_ms = int((time.perf_counter() - started) * 1000)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name, duration_ms) VALUES ($1, $2, $3)",
+                    migration.version, migration.name, duration_ms
+                )
+            if log:
+                log(f"Applied migration {migration.version} ({migration.name}) in {duration_ms} ms")
+            applied.append(migration.version)
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply AnalyticsOS schema migrations")
+    parser.add_argument("--status", action="store_true", help="show versions without migrating")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    from .database import DATABASE_URL
+
+    conn = await asyncpg.connect(args.dsn or DATABASE_URL)
+    try:
+        if args.status:
+            print(f"applied: {await applied_version(conn)}, latest: {LATEST_VERSION}")
+            return 0
+        applied = await migrate(conn)
+        await ensure_search_indexes(conn)
+        if not applied:
+            print(f"Schema is up to date at version {LATEST_VERSION}")
+        return 0
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
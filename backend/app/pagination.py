@@ -0,0 +1,60 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from .serialization import records_response
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(created_at: datetime, id: Any) -> str:
+    """Opaque cursor for the position just after a row in (created_at, id) DESC order"""
+    raw = json.dumps([created_at.isoformat(), str(id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Raises ValueError for anything encode_cursor didn't produce"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def search_pattern(q: str) -> str:
+    """ILIKE pattern matching q anywhere, with q's own wildcards taken literally"""
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def keyset_query(select: str, filters: List[str], params: List[Any],
+                 cursor: Optional[str], limit: int) -> Tuple[str, List[Any]]:
+    """Add the cursor and page limit to a catalog query that selects created_at and id.
+
+    Only the filters given become conditions, so each combination gets a
+    plan that can use its index rather than one generic plan for all.
+    One row past the limit is fetched to tell whether there is a next page.
+    """
+    conditions = list(filters)
+    params = list(params)
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        params.extend([created_at, id])
+        conditions.append(f"(created_at, id) < (${len(params) - 1}, ${len(params)})")
+    params.append(limit + 1)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{select} {where} ORDER BY created_at DESC, id DESC LIMIT ${len(params)}", params
+
+def page_response(rows: Sequence[Any], limit: int, request: Request) -> Response:
+    """The page as a JSON array; X-Next-Cursor and a Link rel="next" header point at the next page"""
+    response = records_response(rows[:limit])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        cursor = encode_cursor(last['created_at'], last['id'])
+        response.headers["X-Next-Cursor"] = cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
+    return response
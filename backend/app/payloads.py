@@ -0,0 +1,96 @@
+from typing import Optional, Dict, Any, List, Sequence
+
+from fastapi.responses import Response
+import pyarrow as pa
+
+from .executor import to_json_value
+from .exports import arrow_schema, arrow_batch
+from .serialization import FastJSONResponse
+
+# Media types a client can ask for in Accept; plain JSON stays the default
+COLUMNAR_JSON = "application/vnd.analyticsos.columnar+json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+class Frame:
+    """A typed result: executor-style columns ({"name", "type"} with Postgres type names) and row tuples"""
+
+    def __init__(self, columns: List[Dict[str, str]], rows: List[Sequence[Any]]):
+        self.columns = columns
+        self.rows = rows
+
+    def records(self) -> List[Dict[str, Any]]:
+        """The row-oriented shape, one dict per row"""
+        names = [c["name"] for c in self.columns]
+        return [dict(zip(names, row)) for row in self.rows]
+
+def negotiate(accept: Optional[str]) -> str:
+    """Payload format for an Accept header: "columnar", "arrow" or "json".
+
+    Media ranges are tried by descending q-value. Anything unrecognised
+    falls back to plain JSON so existing clients keep working.
+    """
+    ranges = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            ranges.append((-q, position, media_type.lower()))
+    for _, _, media_type in sorted(ranges):
+        if media_type == COLUMNAR_JSON:
+            return "columnar"
+        if media_type == ARROW_STREAM:
+            return "arrow"
+        if media_type in ("application/json", "application/*", "*/*"):
+            return "json"
+    return "json"
+
+def columnar(frame: Frame) -> Dict[str, Any]:
+    """Column arrays keyed by name, with the column types alongside.
+
+    Timestamps are ISO 8601 and numerics are numbers, whatever the row shape formats them as.
+    """
+    names = [c["name"] for c in frame.columns]
+    return {
+        "columns": frame.columns,
+        "data": {name: [to_json_value(row[i]) for row in frame.rows] for i, name in enumerate(names)},
+    }
+
+def arrow_ipc(frame: Frame, metadata: Optional[Dict[str, str]] = None) -> bytes:
+    """One frame as an Arrow IPC stream with a single record batch"""
+    schema, converters = arrow_schema(frame.columns)
+    if metadata:
+        schema = schema.with_metadata(metadata)
+    batch = arrow_batch(schema, converters, frame.rows)
+    return _ipc_bytes(batch)
+
+def arrow_ipc_frames(frames: Dict[str, Frame]) -> bytes:
+    """Several frames as one Arrow IPC stream: a single row whose columns are lists of structs, one per frame"""
+    columns, fields = [], []
+    for name, frame in frames.items():
+        schema, converters = arrow_schema(frame.columns)
+        batch = arrow_batch(schema, converters, frame.rows)
+        rows = pa.StructArray.from_arrays(batch.columns, fields=list(schema))
+        column = pa.ListArray.from_arrays(pa.array([0, len(rows)], type=pa.int32()), rows)
+        columns.append(column)
+        fields.append(pa.field(name, column.type))
+    return _ipc_bytes(pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields)))
+
+def _ipc_bytes(batch) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+def negotiated_response(format: str, content: Any) -> Response:
+    """Wrap an already-rendered payload for the negotiated format; responses vary by Accept"""
+    headers = {"Vary": "Accept"}
+    if format == "arrow":
+        return Response(content=content, media_type=ARROW_STREAM, headers=headers)
+    media_type = COLUMNAR_JSON if format == "columnar" else "application/json"
+    return FastJSONResponse(content=content, media_type=media_type, headers=headers)
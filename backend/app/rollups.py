@@ -0,0 +1,289 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+
+from .workloads import current_workload
+
+# How often the background refresher folds changed orders into the rollups
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "60"))
+# Orders updated this long before the high-water mark are re-read, so rows from
+# transactions that committed late (with an older updated_at) are not missed
+ROLLUP_OVERLAP_SECONDS = float(os.getenv("ROLLUP_OVERLAP_SECONDS", "300"))
+
+# Distinct users are kept as K-minimum-values sketches of hashtext(user_id).
+# Counts are exact up to this many users and within about 3% beyond it.
+# Changing it requires a rebuild.
+KMV_SKETCH_SIZE = 1024
+
+ROLLUP_LOCK_KEY = 0x726F6C6C7570  # "rollup"
+
+KMV_FUNCTIONS_SQL = f"""
+    CREATE OR REPLACE FUNCTION kmv_prune(sketch integer[]) RETURNS integer[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT COALESCE(array_agg(h ORDER BY h), '{{}}')
+        FROM (SELECT DISTINCT h FROM unnest(sketch) AS h ORDER BY h LIMIT {KMV_SKETCH_SIZE}) s
+    $$;
+
+    -- Aggregate state is concatenated and only pruned once it grows, which is far cheaper than pruning per row
+    CREATE OR REPLACE FUNCTION kmv_merge(state integer[], sketch integer[]) RETURNS integer[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT CASE WHEN cardinality(state) + cardinality(sketch) <= {8 * KMV_SKETCH_SIZE}
+                    THEN state || sketch
+                    ELSE kmv_prune(state || sketch) END
+    $$;
+
+    CREATE OR REPLACE FUNCTION kmv_estimate(sketch integer[]) RETURNS bigint
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT CASE
+            WHEN cardinality(s) < {KMV_SKETCH_SIZE} THEN cardinality(s)
+            ELSE round(({KMV_SKETCH_SIZE} - 1) * 4294967296.0 / (s[{KMV_SKETCH_SIZE}]::numeric + 2147483649))::bigint
+        END
+        FROM kmv_prune(sketch) AS s
+    $$;
+
+    CREATE OR REPLACE AGGREGATE kmv_distinct(integer[]) (
+        SFUNC = kmv_merge, STYPE = integer[], INITCOND = '{{}}', FINALFUNC = kmv_estimate
+    );
+"""
+
+# Any update to an order bumps its updated_at, so the high-water mark sees it.
+# The days and users that deleted or moved orders leave are queued in
+# rollup_changes, since those can't be found from orders afterwards.
+ORDER_CHANGE_TRIGGERS_SQL = """
+    CREATE TABLE IF NOT EXISTS rollup_changes (
+        day DATE,
+        user_id UUID
+    );
+
+    CREATE OR REPLACE FUNCTION orders_touch_updated_at() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at := CURRENT_TIMESTAMP;
+        RETURN NEW;
+    END
+    $$;
+
+    CREATE OR REPLACE FUNCTION orders_queue_deletes() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO rollup_changes (day, user_id)
+        SELECT DISTINCT created_at::date, user_id FROM old_orders;
+        RETURN NULL;
+    END
+    $$;
+
+    -- Only orders moved to another day or user; where they moved to is found by updated_at
+    CREATE OR REPLACE FUNCTION orders_queue_moves() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO rollup_changes (day, user_id)
+        SELECT DISTINCT o.created_at::date, o.user_id
+        FROM old_orders o
+        JOIN new_orders n ON n.id = o.id
+        WHERE n.created_at::date IS DISTINCT FROM o.created_at::date
+           OR n.user_id IS DISTINCT FROM o.user_id;
+        RETURN NULL;
+    END
+    $$;
+
+    DROP TRIGGER IF EXISTS orders_touch_updated_at ON orders;
+    CREATE TRIGGER orders_touch_updated_at BEFORE UPDATE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_touch_updated_at();
+
+    DROP TRIGGER IF EXISTS orders_queue_deletes ON orders;
+    CREATE TRIGGER orders_queue_deletes AFTER DELETE ON orders
+    REFERENCING OLD TABLE AS old_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_queue_deletes();
+
+    DROP TRIGGER IF EXISTS orders_queue_moves ON orders;
+    CREATE TRIGGER orders_queue_moves AFTER UPDATE ON orders
+    REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_queue_moves();
+"""
+
+# Taken inside the refresh transaction; changes queued by later commits wait for the next refresh
+TAKE_QUEUED_CHANGES_SQL = """
+    DELETE FROM rollup_changes RETURNING day, user_id
+"""
+
+CHANGED_DAYS_SQL = """
+    SELECT DISTINCT created_at::date AS day
+    FROM orders
+    WHERE updated_at > $1 AND created_at IS NOT NULL
+"""
+
+# Orders on the dirty days, and their items, are staged in temp tables so the
+# planner sees real row counts and both rollups share one pass over the items
+STAGE_ORDERS_SQL = """
+    CREATE TEMP TABLE rollup_orders ON COMMIT DROP AS
+    SELECT o.id, o.created_at::date AS day, COALESCE(o.status, 'unknown') AS status,
+           o.total_amount, o.user_id
+    FROM unnest($1::date[]) AS d(day)
+    JOIN orders o ON o.created_at >= d.day AND o.created_at < d.day + 1
+"""
+
+STAGE_ITEMS_SQL = """
+    CREATE TEMP TABLE rollup_items ON COMMIT DROP AS
+    SELECT r.day, r.status, oi.order_id, oi.product_id, oi.quantity, oi.total_price
+    FROM rollup_orders r
+    JOIN order_items oi ON oi.order_id = r.id
+"""
+
+ORDERS_DAILY_SQL = f"""
+    INSERT INTO orders_daily (day, status, revenue, order_count, item_quantity, user_sketch)
+    SELECT r.day, r.status, SUM(r.total_amount), COUNT(*), COALESCE(SUM(i.quantity), 0),
+           COALESCE((array_agg(DISTINCT hashtext(r.user_id::text))
+                     FILTER (WHERE r.user_id IS NOT NULL))[1:{KMV_SKETCH_SIZE}], '{{}}')
+    FROM rollup_orders r
+    LEFT JOIN (
+        SELECT order_id, SUM(quantity) AS quantity FROM rollup_items GROUP BY order_id
+    ) i ON i.order_id = r.id
+    GROUP BY r.day, r.status
+"""
+
+PRODUCT_SALES_DAILY_SQL = """
+    INSERT INTO product_sales_daily (day, status, product_id, quantity, revenue, order_count)
+    SELECT day, status, product_id, SUM(quantity), SUM(total_price), COUNT(DISTINCT order_id)
+    FROM rollup_items
+    WHERE product_id IS NOT NULL
+    GROUP BY day, status, product_id
+"""
+
+USER_FIRST_ORDERS_SQL = """
+    INSERT INTO user_first_orders AS f (user_id, first_at)
+    SELECT user_id, MIN(created_at)
+    FROM orders
+    WHERE updated_at > $1 AND user_id IS NOT NULL AND created_at IS NOT NULL
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET first_at = LEAST(f.first_at, EXCLUDED.first_at)
+"""
+
+# Users who lost an order may have lost their first one, so theirs are recomputed outright
+RECOMPUTE_USER_FIRST_ORDERS_SQL = """
+    WITH firsts AS (
+        SELECT u.user_id, MIN(o.created_at) AS first_at
+        FROM unnest($1::uuid[]) AS u(user_id)
+        LEFT JOIN orders o ON o.user_id = u.user_id AND o.created_at IS NOT NULL
+        GROUP BY u.user_id
+    ), removed AS (
+        DELETE FROM user_first_orders f
+        USING firsts
+        WHERE f.user_id = firsts.user_id AND firsts.first_at IS NULL
+    )
+    INSERT INTO user_first_orders AS f (user_id, first_at)
+    SELECT user_id, first_at FROM firsts WHERE first_at IS NOT NULL
+    ON CONFLICT (user_id) DO UPDATE SET first_at = EXCLUDED.first_at
+"""
+
+class OrderRollups:
+    """Daily order and product-sales aggregates, maintained from a high-water mark on orders.updated_at.
+
+    Any order updated since the last refresh marks its day dirty, and dirty
+    days are re-aggregated whole, so status changes move between rows
+    correctly. A trigger bumps updated_at on every update; the days and
+    users that deleted or moved orders leave are queued in rollup_changes
+    and re-aggregated too. Order items are assumed to be written together
+    with their order.
+    """
+
+    def __init__(self, refresh_seconds: float = ROLLUP_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        # Set once this process has seen the rollups brought up to date
+        self.ready = False
+        self.last_refresh: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self, conn, full: bool = False) -> Dict[str, Any]:
+        """Fold orders changed since the high-water mark into the rollups"""
+        started = time.perf_counter()
+        async with conn.transaction():
+            # Serializes refreshes across processes
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", ROLLUP_LOCK_KEY)
+            high_water = None if full else await conn.fetchval(
+                "SELECT high_water FROM rollup_state WHERE name = 'orders'"
+            )
+            new_high_water = await conn.fetchval("SELECT MAX(updated_at) FROM orders")
+
+            if high_water is None:
+                await conn.execute("TRUNCATE orders_daily, product_sales_daily, user_first_orders")
+                since = datetime.min
+            else:
+                since = high_water - timedelta(seconds=ROLLUP_OVERLAP_SECONDS)
+
+            queued = await conn.fetch(TAKE_QUEUED_CHANGES_SQL)
+            days = {row['day'] for row in await conn.fetch(CHANGED_DAYS_SQL, since)}
+            days.update(row['day'] for row in queued if row['day'] is not None)
+            days = sorted(days)
+            if days:
+                await conn.execute(STAGE_ORDERS_SQL, days)
+                await conn.execute("ANALYZE rollup_orders")
+                await conn.execute(STAGE_ITEMS_SQL)
+                await conn.execute("DELETE FROM orders_daily WHERE day = ANY($1::date[])", days)
+                await conn.execute("DELETE FROM product_sales_daily WHERE day = ANY($1::date[])", days)
+                await conn.execute(ORDERS_DAILY_SQL)
+                await conn.execute(PRODUCT_SALES_DAILY_SQL)
+                await conn.execute(USER_FIRST_ORDERS_SQL, since)
+            users = list({row['user_id'] for row in queued if row['user_id'] is not None})
+            if users and high_water is not None:
+                await conn.execute(RECOMPUTE_USER_FIRST_ORDERS_SQL, users)
+
+            # Deletes don't move the high-water mark, so readers key caches on a generation bumped by any change
+            changed = high_water is None or bool(queued) or new_high_water != high_water
+            generation = await conn.fetchval("""
+                INSERT INTO rollup_state (name, high_water, refreshed_at)
+                VALUES ('orders', $1, $2)
+                ON CONFLICT (name) DO UPDATE SET
+                    high_water = COALESCE(EXCLUDED.high_water, rollup_state.high_water),
+                    refreshed_at = EXCLUDED.refreshed_at,
+                    generation = rollup_state.generation + $3::int
+                RETURNING generation
+            """, new_high_water, datetime.utcnow(), int(changed))
+
+        self.ready = True
+        self.last_refresh = {
+            "full": high_water is None,
+            "days": len(days),
+            "high_water": new_high_water,
+            "generation": generation,
+            "elapsed_ms": int((time.perf_counter() - started) * 1000),
+        }
+        return self.last_refresh
+
+    @property
+    def watermark(self) -> Optional[int]:
+        """Rollup generation as of this process's last refresh, for cache keys"""
+        return self.last_refresh.get("generation")
+
+    async def rebuild(self, conn) -> Dict[str, Any]:
+        """Recompute every rollup from scratch, e.g. after a bulk load"""
+        return await self.refresh(conn, full=True)
+
+    def start(self, pool):
+        """Refresh in the background"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_forever(pool))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            # Wait for the cancelled pass to release its connection before the pool closes
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_forever(self, pool):
+        current_workload.set("batch")
+        while True:
+            try:
+                async with pool.acquire() as conn:
+                    await self.refresh(conn)
+            except Exception as e:
+                print(f"Order rollup refresh failed: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+# Global order rollups
+order_rollups = OrderRollups()
@@ -1,130 +1,195 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
-import random
+from typing import Optional, Dict, Any, List
+import os
 import json
+import random
+import uuid
+
+from ..database import get_db_pool
+from ..rollups import order_rollups
+from ..cache import query_cache, QueryCache
+from ..executor import metric_executor, MetricExecutionError, MetricRunResult, to_json_value
+from ..workloads import WorkloadSaturated
+from ..payloads import Frame, negotiate, negotiated_response, columnar, arrow_ipc
+from ..intents import Intent, intent_index, normalize_question, FALLBACK_INTENT, FALLBACK_RESPONSES
+
+# Chat queries answer interactively, so they get a tighter budget than metric runs
+CHAT_STATEMENT_TIMEOUT_MS = int(os.getenv("CHAT_STATEMENT_TIMEOUT_MS", "5000"))
+CHAT_ROW_LIMIT = int(os.getenv("CHAT_ROW_LIMIT", "1000"))
+# Rows per event on the streaming endpoint
+CHAT_STREAM_BATCH_ROWS = int(os.getenv("CHAT_STREAM_BATCH_ROWS", "200"))
 
 router = APIRouter()
 
+# Whole answers keyed by dataset and normalized question; a repeated question
+# skips intent matching and query execution alike
+answer_cache = QueryCache()
+
+def intent_sql(intent: Intent, dataset: Optional[Dict[str, Any]]) -> Optional[str]:
+    """SQL for an intent; the rollup form is used on the built-in database once the rollups are built"""
+    if dataset is None and order_rollups.ready:
+        return intent.rollup_sql
+    return intent.sql
+
+def result_frame(result: MetricRunResult) -> Frame:
+    rows = [[result.value]] if result.type == "scalar" else result.rows
+    return Frame(result.columns, rows)
+
 class ChatMessage(BaseModel):
     message: str
+    dataset_id: Optional[uuid.UUID] = None
 
 class ChatResponse(BaseModel):
     response: str
     sql_query: Optional[str] = None
     chart_data: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class ChatAnswer(BaseModel):
+    """An answer before it is rendered in the negotiated format; this is what gets cached"""
+    response: str
+    sql_query: Optional[str] = None
+    chart_type: Optional[str] = None
+    result: Optional[MetricRunResult] = None
+
+def render(answer: ChatAnswer, format: str) -> Response:
+    """ChatResponse with row (default) or columnar chart data, or the chart data alone as Arrow IPC"""
+    frame = result_frame(answer.result) if answer.result else None
+    if format == "arrow" and frame is not None:
+        metadata = {"response": answer.response, "sql_query": answer.sql_query or "",
+                    "chart_type": answer.chart_type or ""}
+        return negotiated_response(format, arrow_ipc(frame, metadata))
+    if format == "arrow":
+        # Nothing tabular to send, e.g. the help text
+        format = "json"
+
+    chart_data = None
+    if frame is not None and answer.chart_type:
+        data = columnar(frame) if format == "columnar" else {"data": frame.records()}
+        chart_data = {"type": answer.chart_type, **data}
+    body = ChatResponse(response=answer.response, sql_query=answer.sql_query, chart_data=chart_data)
+    return negotiated_response(format, body.model_dump())
+
+async def load_dataset(dataset_id: Optional[uuid.UUID]) -> Optional[Dict[str, Any]]:
+    """The dataset a question targets; None means the built-in database"""
+    if not dataset_id:
+        return None
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM datasets WHERE id = $1", dataset_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return dict(row)
 
 @router.post("/", response_model=ChatResponse)
-async def chat_with_ai(chat_message: ChatMessage):
-    """Process chat message and return AI response"""
-    message = chat_message.message.lower()
-    
-    # Simple keyword-based responses (in production, use OpenAI/Gemini API)
-    if any(word in message for word in ['revenue', 'sales', 'money', 'income']):
-        return ChatResponse(
-            response="Based on your data, here's the revenue analysis. The total revenue for the last 30 days shows a positive trend with some seasonal variations.",
-            sql_query="SELECT SUM(total_amount) as total_revenue FROM orders WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'",
-            chart_data={
-                "type": "line",
-                "data": [
-                    {"date": "2024-01-01", "value": 12500},
-                    {"date": "2024-01-02", "value": 13200},
-                    {"date": "2024-01-03", "value": 11800},
-                    {"date": "2024-01-04", "value": 14500},
-                    {"date": "2024-01-05", "value": 15200}
-                ]
-            }
-        )
-    
-    elif any(word in message for word in ['orders', 'purchases', 'transactions']):
-        return ChatResponse(
-            response="Here's your order analysis. I can see the order patterns and status distribution across different time periods.",
-            sql_query="SELECT status, COUNT(*) as count FROM orders WHERE created_at >= CURRENT_DATE - INTERVAL '30 days' GROUP BY status",
-            chart_data={
-                "type": "pie",
-                "data": [
-                    {"name": "Completed", "value": 45},
-                    {"name": "Pending", "value": 12},
-                    {"name": "Shipped", "value": 23},
-                    {"name": "Cancelled", "value": 8}
-                ]
-            }
-        )
-    
-    elif any(word in message for word in ['customers', 'users', 'people']):
-        return ChatResponse(
-            response="Your customer metrics show healthy growth patterns. Here's the user engagement and acquisition data.",
-            sql_query="SELECT COUNT(DISTINCT user_id) as active_users FROM orders WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'",
-            chart_data={
-                "type": "bar",
-                "data": [
-                    {"category": "New Users", "value": 156},
-                    {"category": "Returning Users", "value": 234},
-                    {"category": "Active Users", "value": 189},
-                    {"category": "Churned Users", "value": 23}
-                ]
-            }
-        )
-    
-    elif any(word in message for word in ['products', 'items', 'inventory']):
-        return ChatResponse(
-            response="Here's your product performance analysis. I can show you the top-selling products and inventory insights.",
-            sql_query="SELECT p.name, SUM(oi.quantity) as total_sold FROM products p JOIN order_items oi ON p.id = oi.product_id GROUP BY p.id, p.name ORDER BY total_sold DESC LIMIT 5",
-            chart_data={
-                "type": "bar",
-                "data": [
-                    {"name": "Laptop Pro", "sales": 45},
-                    {"name": "Wireless Headphones", "sales": 38},
-                    {"name": "Smartphone", "sales": 32},
-                    {"name": "Coffee Maker", "sales": 28},
-                    {"name": "Running Shoes", "sales": 25}
-                ]
-            }
+async def chat_with_ai(chat_message: ChatMessage, request: Request):
+    """Process chat message and return AI response; Accept selects row (default) or columnar chart data, or Arrow IPC"""
+    dataset = await load_dataset(chat_message.dataset_id)
+    format = negotiate(request.headers.get("accept"))
+
+    # Answers on the built-in database go stale when the rollups advance
+    watermark = order_rollups.watermark if dataset is None else None
+    try:
+        answer = await answer_cache.get(
+            chat_message.dataset_id, normalize_question(chat_message.message), (), watermark,
+            lambda: answer_question(chat_message.message, dataset, watermark),
         )
-    
-    elif any(word in message for word in ['aov', 'average order value', 'order value']):
+    except MetricExecutionError as e:
+        # Failed answers are not cached
+        intent = intent_index.match(chat_message.message) or FALLBACK_INTENT
         return ChatResponse(
-            response="The Average Order Value (AOV) analysis shows your customers' spending patterns. Here's the breakdown by time period.",
-            sql_query="SELECT AVG(total_amount) as avg_order_value FROM orders WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'",
-            chart_data={
-                "type": "line",
-                "data": [
-                    {"period": "Week 1", "aov": 125.50},
-                    {"period": "Week 2", "aov": 132.20},
-                    {"period": "Week 3", "aov": 118.80},
-                    {"period": "Week 4", "aov": 145.30}
-                ]
-            }
+            response=intent.response or random.choice(FALLBACK_RESPONSES),
+            sql_query=intent_sql(intent, dataset),
+            error=str(e),
         )
-    
-    elif any(word in message for word in ['help', 'what can you do', 'capabilities']):
-        return ChatResponse(
-            response="""I'm your AI analytics copilot! I can help you with:
-
-📊 **Data Analysis**: Ask about revenue, orders, customers, or products
-🔍 **SQL Queries**: I'll generate SQL queries for your questions  
-📈 **Visualizations**: Create charts and graphs from your data
-📋 **Metrics**: Calculate KPIs like AOV, LTV, conversion rates
-🎯 **Insights**: Provide business insights and recommendations
-
-Try asking me things like:
-- "Show me revenue trends"
-- "What are my top products?"
-- "How many active customers do I have?"
-- "Calculate average order value"
-- "Show me order status breakdown"
-            """)
-    
+    return render(answer, format)
+
+async def answer_question(message: str, dataset: Optional[Dict[str, Any]], watermark: Any) -> ChatAnswer:
+    """Match the question to an intent and run its SQL against the dataset"""
+    # Keyword index in place of a language model (in production, use OpenAI/Gemini API)
+    intent = intent_index.match(message)
+    if intent is None:
+        intent = FALLBACK_INTENT
+        response = random.choice(FALLBACK_RESPONSES)
     else:
-        # Generic response for unrecognized queries
-        sample_responses = [
-            "I can help you analyze that data. Could you be more specific about what metrics you'd like to see?",
-            "Let me look into your data for that information. What specific time period are you interested in?",
-            "That's an interesting question! I can generate insights about your business data. What would you like to focus on?",
-            "I'd be happy to help with that analysis. Could you clarify which data points you're most interested in?"
-        ]
-        
-        return ChatResponse(
-            response=random.choice(sample_responses),
-            sql_query="SELECT COUNT(*) as total_records FROM orders",
-        )
\ No newline at end of file
+        response = intent.response
+
+    sql = intent_sql(intent, dataset)
+    if sql is None:
+        return ChatAnswer(response=response)
+
+    # Same SQL from different questions shares one cached result
+    result = await query_cache.get(
+        dataset["id"] if dataset else None, sql, (), watermark,
+        lambda: metric_executor.execute(sql, dataset, row_limit=CHAT_ROW_LIMIT,
+                                        timeout_ms=CHAT_STATEMENT_TIMEOUT_MS),
+    )
+    records = result_frame(result).records()
+
+    if intent.summary and records:
+        response = f"{response} {intent.summary(records)}".strip()
+    if result.truncated:
+        response += f" Only the first {result.row_count:,} rows are shown."
+
+    return ChatAnswer(response=response, sql_query=sql, chart_type=intent.chart_type, result=result)
+
+@router.post("/stream")
+async def chat_stream(chat_message: ChatMessage):
+    """Answer a chat message as NDJSON events: the SQL first, then result rows
+    in batches as the cursor produces them, then the chart spec"""
+    dataset = await load_dataset(chat_message.dataset_id)
+    intent = intent_index.match(chat_message.message)
+    if intent is None:
+        intent = FALLBACK_INTENT
+        response = random.choice(FALLBACK_RESPONSES)
+    else:
+        response = intent.response
+    sql = intent_sql(intent, dataset)
+
+    async def stream():
+        nonlocal response
+        yield json.dumps({"event": "sql", "response": response, "sql_query": sql}) + "\n"
+        if sql is None:
+            yield json.dumps({"event": "completed", "response": response, "chart_data": None}) + "\n"
+            return
+
+        names: List[str] = []
+        records: List[Dict[str, Any]] = []
+        row_count, truncated = 0, False
+        try:
+            # One row past the cap tells whether the result was truncated
+            async for columns, rows in metric_executor.stream(
+                sql, dataset, batch_size=CHAT_STREAM_BATCH_ROWS, max_rows=CHAT_ROW_LIMIT + 1,
+                timeout_ms=CHAT_STATEMENT_TIMEOUT_MS,
+            ):
+                if not names:
+                    names = [column["name"] for column in columns]
+                    yield json.dumps({"event": "columns", "columns": columns}) + "\n"
+                if row_count + len(rows) > CHAT_ROW_LIMIT:
+                    rows, truncated = rows[:CHAT_ROW_LIMIT - row_count], True
+                if not rows:
+                    continue
+                batch = [[to_json_value(v) for v in row] for row in rows]
+                row_count += len(batch)
+                if intent.summary:
+                    records.extend(dict(zip(names, row)) for row in batch)
+                yield json.dumps({"event": "rows", "rows": batch}) + "\n"
+        except (MetricExecutionError, WorkloadSaturated) as e:
+            # Headers are already sent, so saturation can't become a 503 here
+            yield json.dumps({"event": "failed", "response": response, "error": str(e)}) + "\n"
+            return
+
+        if intent.summary and records:
+            response = f"{response} {intent.summary(records)}".strip()
+        if truncated:
+            response += f" Only the first {row_count:,} rows are shown."
+        # The chart spec names the columns; its data is the rows streamed above
+        chart_data = {"type": intent.chart_type, "columns": names} if intent.chart_type else None
+        yield json.dumps({
+            "event": "completed", "response": response, "chart_data": chart_data,
+            "row_count": row_count, "truncated": truncated,
+        }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
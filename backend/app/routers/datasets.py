@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import asyncpg
@@ -6,6 +6,10 @@ from datetime import datetime
 import uuid
 
 from ..database import get_db_pool
+from ..connections import dataset_pools, DatasetConnectionError
+from ..introspection import schema_catalog
+from ..pagination import keyset_query, page_response, search_pattern, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from ..serialization import FastJSONResponse
 
 router = APIRouter()
 
@@ -19,7 +23,7 @@ class DatasetCreate(BaseModel):
     password: str
 
 class DatasetResponse(BaseModel):
-    id: str
+    id: uuid.UUID
     name: str
     type: str
     host: str
@@ -30,18 +34,36 @@ class DatasetResponse(BaseModel):
     created_at: datetime
 
 @router.get("/", response_model=List[DatasetResponse])
-async def get_datasets():
-    """Get all datasets"""
+async def get_datasets(
+    request: Request,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Substring of the name or database name"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """List datasets, newest first, one page at a time; follow X-Next-Cursor for the next page"""
+    filters, params = [], []
+    for column, value in (("type", type), ("status", status)):
+        if value is not None:
+            params.append(value)
+            filters.append(f"{column} = ${len(params)}")
+    if q:
+        params.append(search_pattern(q))
+        filters.append(f"(name ILIKE ${len(params)} OR database_name ILIKE ${len(params)})")
+    try:
+        sql, params = keyset_query("""
+            SELECT id, name, type, host, port, database_name as database,
+                   status, tables_count, created_at
+            FROM datasets
+        """, filters, params, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, name, type, host, port, database_name as database, 
-                   status, tables_count, created_at
-            FROM datasets 
-            ORDER BY created_at DESC
-        """)
-        
-        return [dict(row) for row in rows]
+        rows = await conn.fetch(sql, *params)
+    return page_response(rows, limit, request)
 
 @router.post("/", response_model=DatasetResponse)
 async def create_dataset(dataset: DatasetCreate):
@@ -73,83 +95,44 @@ async def delete_dataset(dataset_id: str):
         result = await conn.execute("DELETE FROM datasets WHERE id = $1", uuid.UUID(dataset_id))
         if result == "DELETE 0":
             raise HTTPException(status_code=404, detail="Dataset not found")
-        return {"message": "Dataset deleted successfully"}
+    await dataset_pools.discard(uuid.UUID(dataset_id))
+    schema_catalog.invalidate(uuid.UUID(dataset_id))
+    return {"message": "Dataset deleted successfully"}
 
 @router.post("/{dataset_id}/test")
 async def test_connection(dataset_id: str):
     """Test dataset connection"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Update status to connected (simplified for demo)
+        dataset = await conn.fetchrow("SELECT * FROM datasets WHERE id = $1", uuid.UUID(dataset_id))
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    # Probe through the dataset's own pool, which later queries will reuse
+    result = await dataset_pools.health_check(dict(dataset))
+
+    async with pool.acquire() as conn:
         await conn.execute(
-            "UPDATE datasets SET status = $1, updated_at = $2 WHERE id = $3",
-            'connected', datetime.utcnow(), uuid.UUID(dataset_id)
+            "UPDATE datasets SET status = $1, tables_count = COALESCE($2, tables_count), updated_at = $3 WHERE id = $4",
+            result['status'], result.get('tables_count'), datetime.utcnow(), uuid.UUID(dataset_id)
         )
-        return {"status": "connected", "message": "Connection successful"}
+    return result
 
 @router.get("/{dataset_id}/schema")
-async def get_schema(dataset_id: str):
+async def get_schema(dataset_id: str, request: Request, refresh: bool = False):
     """Get database schema for a dataset"""
-    # This is a simplified schema response for demo purposes
-    # In production, you would connect to the actual database and introspect the schema
-    
-    sample_schema = {
-        "tables": [
-            {
-                "name": "users",
-                "columns": [
-                    {"name": "id", "type": "uuid", "nullable": False, "primary_key": True, "foreign_key": False},
-                    {"name": "email", "type": "varchar(255)", "nullable": False, "primary_key": False, "foreign_key": False},
-                    {"name": "first_name", "type": "varchar(100)", "nullable": True, "primary_key": False, "foreign_key": False},
-                    {"name": "last_name", "type": "varchar(100)", "nullable": True, "primary_key": False, "foreign_key": False},
-                    {"name": "created_at", "type": "timestamp", "nullable": True, "primary_key": False, "foreign_key": False},
-                ],
-                "relationships": [
-                    {"from_table": "users", "from_column": "id", "to_table": "orders", "to_column": "user_id", "type": "one-to-many"}
-                ]
-            },
-            {
-                "name": "products",
-                "columns": [
-                    {"name": "id", "type": "uuid", "nullable": False, "primary_key": True, "foreign_key": False},
-                    {"name": "name", "type": "varchar(255)", "nullable": False, "primary_key": False, "foreign_key": False},
-                    {"name": "description", "type": "text", "nullable": True, "primary_key": False, "foreign_key": False},
-                    {"name": "price", "type": "decimal(10,2)", "nullable": False, "primary_key": False, "foreign_key": False},
-                    {"name": "category", "type": "varchar(100)", "nullable": True, "primary_key": False, "foreign_key": False},
-                ],
-                "relationships": [
-                    {"from_table": "products", "from_column": "id", "to_table": "order_items", "to_column": "product_id", "type": "one-to-many"}
-                ]
-            },
-            {
-                "name": "orders",
-                "columns": [
-                    {"name": "id", "type": "uuid", "nullable": False, "primary_key": True, "foreign_key": False},
-                    {"name": "user_id", "type": "uuid", "nullable": True, "primary_key": False, "foreign_key": True},
-                    {"name": "total_amount", "type": "decimal(10,2)", "nullable": False, "primary_key": False, "foreign_key": False},
-                    {"name": "status", "type": "varchar(50)", "nullable": True, "primary_key": False, "foreign_key": False},
-                    {"name": "created_at", "type": "timestamp", "nullable": True, "primary_key": False, "foreign_key": False},
-                ],
-                "relationships": [
-                    {"from_table": "orders", "from_column": "user_id", "to_table": "users", "to_column": "id", "type": "many-to-one"},
-                    {"from_table": "orders", "from_column": "id", "to_table": "order_items", "to_column": "order_id", "type": "one-to-many"}
-                ]
-            },
-            {
-                "name": "order_items",
-                "columns": [
-                    {"name": "id", "type": "uuid", "nullable": False, "primary_key": True, "foreign_key": False},
-                    {"name": "order_id", "type": "uuid", "nullable": True, "primary_key": False, "foreign_key": True},
-                    {"name": "product_id", "type": "uuid", "nullable": True, "primary_key": False, "foreign_key": True},
-                    {"name": "quantity", "type": "integer", "nullable": False, "primary_key": False, "foreign_key": False},
-                    {"name": "unit_price", "type": "decimal(10,2)", "nullable": False, "primary_key": False, "foreign_key": False},
-                ],
-                "relationships": [
-                    {"from_table": "order_items", "from_column": "order_id", "to_table": "orders", "to_column": "id", "type": "many-to-one"},
-                    {"from_table": "order_items", "from_column": "product_id", "to_table": "products", "to_column": "id", "type": "many-to-one"}
-                ]
-            }
-        ]
-    }
-    
-    return sample_schema
\ No newline at end of file
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        dataset = await conn.fetchrow("SELECT * FROM datasets WHERE id = $1", uuid.UUID(dataset_id))
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    try:
+        snapshot = await schema_catalog.get(dict(dataset), force=refresh)
+    except DatasetConnectionError as e:
+        raise HTTPException(status_code=502, detail=f"Could not connect to dataset: {e}")
+
+    headers = {"ETag": snapshot.etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(content=snapshot.payload, headers=headers)
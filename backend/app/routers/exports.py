@@ -0,0 +1,55 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Optional, Dict, Any, Literal
+import uuid
+
+from ..database import get_db_pool
+from ..executor import MetricExecutionError
+from ..exports import open_export, EXPORT_MEDIA_TYPES
+from ..runs import load_metric
+
+router = APIRouter()
+
+ExportFormat = Literal["csv", "ndjson", "parquet"]
+
+class QueryExport(BaseModel):
+    sql: str
+    # Without one, the SQL runs on the built-in database as the metric role, which can't read app tables
+    dataset_id: Optional[uuid.UUID] = None
+    format: ExportFormat = "csv"
+
+async def export_response(sql: str, dataset: Optional[Dict[str, Any]], format: str,
+                          filename: str) -> StreamingResponse:
+    try:
+        body = await open_export(sql, dataset, format)
+    except MetricExecutionError as e:
+        raise HTTPException(status_code=400, detail=f"Export failed: {e}")
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+    )
+
+@router.get("/metrics/{metric_id}")
+async def export_metric(metric_id: str, format: ExportFormat = Query("csv")):
+    """Stream a metric's full result set as CSV, NDJSON or Parquet"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        metric, dataset = await load_metric(conn, uuid.UUID(metric_id))
+    if not metric:
+        raise HTTPException(status_code=404, detail="Metric not found")
+    return await export_response(metric['sql_query'], dataset, format, f"metric-{metric_id}")
+
+@router.post("/query")
+async def export_query(export: QueryExport):
+    """Stream an ad-hoc read-only query's result set as CSV, NDJSON or Parquet"""
+    dataset = None
+    if export.dataset_id:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM datasets WHERE id = $1", export.dataset_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        dataset = dict(row)
+    return await export_response(export.sql, dataset, export.format, "export")
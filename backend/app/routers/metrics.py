@@ -1,24 +1,56 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional, Dict, Any
 import asyncpg
 from datetime import datetime, timedelta
 import uuid
 import json
-import random
+import asyncio
 
 from ..database import get_db_pool
+from ..charts import build_chart_data, build_chart_frames
+from ..payloads import negotiate, negotiated_response, columnar, arrow_ipc_frames
+from ..kpis import compute_dashboard_kpis
+from ..cache import query_cache
+from ..executor import MetricExecutionError
+from ..history import metric_history, DEFAULT_POINT_BUDGET
+from ..runs import load_metric, load_metrics, execute_and_store, run_batch
+from ..slow_queries import slow_query_log, compare_versions, recent_slow_runs
+from ..versions import record_version, list_versions
+from ..workloads import workload
+from ..pagination import keyset_query, page_response, search_pattern, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter()
 
+# Batch runs outlive a disconnected client so their results are still stored
+_batch_runs = set()
+
+async def drain_batch_runs(timeout: float):
+    """Wait for batch runs still in progress, so shutdown doesn't drop their results"""
+    if _batch_runs:
+        await asyncio.wait(list(_batch_runs), timeout=timeout)
+
 class MetricCreate(BaseModel):
     name: str
     description: str
     sql_query: str
     category: str
+    dataset_id: Optional[uuid.UUID] = None
+    refresh_interval_seconds: Optional[int] = Field(None, ge=60)
+
+class MetricBatchRun(BaseModel):
+    metric_ids: Optional[List[uuid.UUID]] = None
+    category: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_selection(self):
+        if (self.metric_ids is None) == (self.category is None):
+            raise ValueError("Provide either metric_ids or category")
+        return self
 
 class MetricResponse(BaseModel):
-    id: str
+    id: uuid.UUID
     name: str
     description: str
     sql_query: str
@@ -27,34 +59,60 @@ class MetricResponse(BaseModel):
     status: str
     created_at: datetime
     last_run: Optional[datetime]
+    dataset_id: Optional[uuid.UUID] = None
+    refresh_interval_seconds: Optional[int] = None
 
 @router.get("/", response_model=List[MetricResponse])
-async def get_metrics():
-    """Get all metrics"""
+async def get_metrics(
+    request: Request,
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    dataset_id: Optional[uuid.UUID] = None,
+    q: Optional[str] = Query(None, min_length=1, description="Substring of the name or description"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """List metrics, newest first, one page at a time; follow X-Next-Cursor for the next page"""
+    filters, params = [], []
+    for column, value in (("category", category), ("status", status), ("dataset_id", dataset_id)):
+        if value is not None:
+            params.append(value)
+            filters.append(f"{column} = ${len(params)}")
+    if q:
+        params.append(search_pattern(q))
+        filters.append(f"(name ILIKE ${len(params)} OR description ILIKE ${len(params)})")
+    try:
+        sql, params = keyset_query("""
+            SELECT id, name, description, sql_query, category, version, status, created_at, last_run, dataset_id,
+                   refresh_interval_seconds
+            FROM metrics
+        """, filters, params, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, name, description, sql_query, category, version, status, created_at, last_run
-            FROM metrics 
-            ORDER BY created_at DESC
-        """)
-        
-        return [dict(row) for row in rows]
+        rows = await conn.fetch(sql, *params)
+    return page_response(rows, limit, request)
 
 @router.post("/", response_model=MetricResponse)
 async def create_metric(metric: MetricCreate):
     """Create a new metric"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        metric_id = await conn.fetchval("""
-            INSERT INTO metrics (name, description, sql_query, category, status)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING id
-        """, metric.name, metric.description, metric.sql_query, metric.category, 'active')
+        async with conn.transaction():
+            metric_id, version = await conn.fetchrow("""
+                INSERT INTO metrics (name, description, sql_query, category, status, dataset_id, refresh_interval_seconds)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                RETURNING id, version
+            """, metric.name, metric.description, metric.sql_query, metric.category, 'active',
+                metric.dataset_id, metric.refresh_interval_seconds)
+            await record_version(conn, metric_id, version, metric.sql_query, metric.dataset_id)
         
         # Get the created metric
         row = await conn.fetchrow("""
-            SELECT id, name, description, sql_query, category, version, status, created_at, last_run
+            SELECT id, name, description, sql_query, category, version, status, created_at, last_run, dataset_id,
+                   refresh_interval_seconds
             FROM metrics WHERE id = $1
         """, metric_id)
         
@@ -65,24 +123,73 @@ async def update_metric(metric_id: str, metric: MetricCreate):
     """Update a metric"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Increment version and update
-        await conn.execute("""
-            UPDATE metrics 
-            SET name = $1, description = $2, sql_query = $3, category = $4, 
-                version = version + 1, updated_at = $5
-            WHERE id = $6
-        """, metric.name, metric.description, metric.sql_query, metric.category, 
-            datetime.utcnow(), uuid.UUID(metric_id))
+        previous = await conn.fetchrow(
+            "SELECT sql_query, dataset_id FROM metrics WHERE id = $1", uuid.UUID(metric_id)
+        )
+        # Increment version and update; the new definition is appended to the version history
+        async with conn.transaction():
+            version = await conn.fetchval("""
+                UPDATE metrics 
+                SET name = $1, description = $2, sql_query = $3, category = $4, 
+                    version = version + 1, updated_at = $5, dataset_id = $6, refresh_interval_seconds = $7
+                WHERE id = $8
+                RETURNING version
+            """, metric.name, metric.description, metric.sql_query, metric.category, 
+                datetime.utcnow(), metric.dataset_id, metric.refresh_interval_seconds, uuid.UUID(metric_id))
+            if version is not None:
+                await record_version(conn, uuid.UUID(metric_id), version, metric.sql_query, metric.dataset_id)
         
         # Get the updated metric
         row = await conn.fetchrow("""
-            SELECT id, name, description, sql_query, category, version, status, created_at, last_run
+            SELECT id, name, description, sql_query, category, version, status, created_at, last_run, dataset_id,
+                   refresh_interval_seconds
             FROM metrics WHERE id = $1
         """, uuid.UUID(metric_id))
         
         if not row:
             raise HTTPException(status_code=404, detail="Metric not found")
-        
+
+        # Cached results of the old query no longer describe this metric; a revert
+        # still reuses its stored results
+        if previous['sql_query'] != metric.sql_query or previous['dataset_id'] != metric.dataset_id:
+            query_cache.invalidate(previous['sql_query'], previous['dataset_id'])
+
+        return dict(row)
+
+@router.get("/{metric_id}/versions")
+async def get_metric_versions(metric_id: str):
+    """A metric's definitions, newest first, with the SQL hash and run count of each"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        exists = await conn.fetchval("SELECT 1 FROM metrics WHERE id = $1", uuid.UUID(metric_id))
+        if not exists:
+            raise HTTPException(status_code=404, detail="Metric not found")
+        return await list_versions(conn, uuid.UUID(metric_id))
+
+@router.post("/{metric_id}/versions/{version}/revert", response_model=MetricResponse)
+async def revert_metric(metric_id: str, version: int):
+    """Make an earlier version's SQL and dataset current again, as a new version"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            target = await conn.fetchrow(
+                "SELECT sql_query, dataset_id FROM metric_versions WHERE metric_id = $1 AND version = $2",
+                uuid.UUID(metric_id), version
+            )
+            if not target:
+                raise HTTPException(status_code=404, detail="Metric version not found")
+            new_version = await conn.fetchval("""
+                UPDATE metrics
+                SET sql_query = $1, dataset_id = $2, version = version + 1, updated_at = $3
+                WHERE id = $4
+                RETURNING version
+            """, target['sql_query'], target['dataset_id'], datetime.utcnow(), uuid.UUID(metric_id))
+            await record_version(conn, uuid.UUID(metric_id), new_version, target['sql_query'], target['dataset_id'])
+        row = await conn.fetchrow("""
+            SELECT id, name, description, sql_query, category, version, status, created_at, last_run, dataset_id,
+                   refresh_interval_seconds
+            FROM metrics WHERE id = $1
+        """, uuid.UUID(metric_id))
         return dict(row)
 
 @router.delete("/{metric_id}")
@@ -95,144 +202,121 @@ async def delete_metric(metric_id: str):
             raise HTTPException(status_code=404, detail="Metric not found")
         return {"message": "Metric deleted successfully"}
 
-@router.post("/{metric_id}/run")
-async def run_metric(metric_id: str):
-    """Run a metric and store results"""
+@router.post("/{metric_id}/run", dependencies=[Depends(workload("runs"))])
+async def run_metric(metric_id: str, refresh: bool = False):
+    """Run a metric and store results.
+
+    Unless refresh is set, a recent result for the same SQL is reused: from
+    the query cache, or a stored result of any version with the same SQL
+    hash, so flipping between versions doesn't re-execute.
+    """
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # Get metric
-        metric = await conn.fetchrow("SELECT * FROM metrics WHERE id = $1", uuid.UUID(metric_id))
-        if not metric:
+        metric, dataset = await load_metric(conn, uuid.UUID(metric_id))
+    if not metric:
+        raise HTTPException(status_code=404, detail="Metric not found")
+
+    # Execute outside the API pool so long runs don't hold its connections
+    try:
+        result = await execute_and_store(pool, metric['sql_query'], dataset, [metric['id']],
+                                         cached=not refresh)
+    except MetricExecutionError as e:
+        raise HTTPException(status_code=400, detail=f"Metric execution failed: {e}")
+
+    return {"message": "Metric executed successfully", "result": result.model_dump()}
+
+@router.post("/run-batch", dependencies=[Depends(workload("batch"))])
+async def run_metric_batch(batch: MetricBatchRun):
+    """Run many metrics concurrently, streaming an NDJSON event as each one finishes"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        metrics, datasets = await load_metrics(conn, batch.metric_ids, batch.category)
+    if not metrics:
+        raise HTTPException(status_code=404, detail="No active metrics matched")
+
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.ensure_future(run_batch(pool, metrics, datasets, events.put_nowait))
+    _batch_runs.add(task)
+    task.add_done_callback(_batch_runs.discard)
+    task.add_done_callback(lambda _: events.put_nowait(None))
+
+    found = {m['id'] for m in metrics}
+    missing = [str(i) for i in batch.metric_ids or [] if i not in found]
+
+    async def stream():
+        yield json.dumps({"event": "started", "total": len(metrics), "not_found": missing}) + "\n"
+        while (event := await events.get()) is not None:
+            yield json.dumps(event) + "\n"
+        if task.exception():
+            yield json.dumps({"event": "failed", "error": str(task.exception())}) + "\n"
+        else:
+            yield json.dumps({"event": "completed", **task.result()}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/{metric_id}/history")
+async def get_metric_history(
+    metric_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: int = Query(DEFAULT_POINT_BUDGET, ge=1, le=10000)
+):
+    """Get downsampled numeric history for a metric"""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        exists = await conn.fetchval("SELECT 1 FROM metrics WHERE id = $1", uuid.UUID(metric_id))
+        if not exists:
             raise HTTPException(status_code=404, detail="Metric not found")
-        
-        # Simulate running the SQL query and getting results
-        # In production, you would execute the actual SQL query against the target database
-        sample_result = {
-            "value": random.randint(100, 10000),
-            "timestamp": datetime.utcnow().isoformat(),
-            "query_executed": metric['sql_query']
-        }
-        
-        # Store result
-        await conn.execute("""
-            INSERT INTO metric_results (metric_id, result_data, execution_time_ms)
-            VALUES ($1, $2, $3)
-        """, uuid.UUID(metric_id), json.dumps(sample_result), random.randint(50, 500))
-        
-        # Update last_run timestamp
-        await conn.execute(
-            "UPDATE metrics SET last_run = $1 WHERE id = $2",
-            datetime.utcnow(), uuid.UUID(metric_id)
-        )
-        
-        return {"message": "Metric executed successfully", "result": sample_result}
+        return await metric_history.query(conn, uuid.UUID(metric_id), start, end, points)
+
+@router.get("/{metric_id}/performance")
+async def get_metric_performance(metric_id: str, days: int = Query(30, ge=1, le=365)):
+    """Latency and captured plan shapes per metric version, with regressions flagged"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        exists = await conn.fetchval("SELECT 1 FROM metrics WHERE id = $1", uuid.UUID(metric_id))
+        if not exists:
+            raise HTTPException(status_code=404, detail="Metric not found")
+        return await compare_versions(conn, uuid.UUID(metric_id), days)
+
+@router.get("/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=500)):
+    """Recent slow metric runs with their EXPLAIN (ANALYZE, BUFFERS) plans"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        runs = await recent_slow_runs(conn, limit)
+    return {"threshold_ms": slow_query_log.threshold_ms, "stats": slow_query_log.stats, "runs": runs}
 
 @router.get("/dashboard")
 async def get_dashboard_metrics():
     """Get dashboard KPI metrics"""
     pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Get actual metrics from the sample data
-        total_revenue = await conn.fetchval("""
-            SELECT COALESCE(SUM(total_amount), 0) 
-            FROM orders 
-            WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'
-        """) or 0
-        
-        total_orders = await conn.fetchval("""
-            SELECT COUNT(*) 
-            FROM orders 
-            WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-        """) or 0
-        
-        active_users = await conn.fetchval("""
-            SELECT COUNT(DISTINCT user_id) 
-            FROM orders 
-            WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-        """) or 0
-        
-        avg_order_value = await conn.fetchval("""
-            SELECT COALESCE(AVG(total_amount), 0) 
-            FROM orders 
-            WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'
-        """) or 0
-        
-        return {
-            "total_revenue": f"${total_revenue:,.2f}",
-            "total_orders": f"{total_orders:,}",
-            "active_users": f"{active_users:,}",
-            "avg_order_value": f"${avg_order_value:.2f}"
-        }
+    return await compute_dashboard_kpis(pool)
 
 @router.get("/charts")
-async def get_chart_data():
-    """Get chart data for dashboard"""
+async def get_chart_data(
+    request: Request,
+    days: int = Query(30, ge=1, le=3660),
+    granularity: str = Query("day")
+):
+    """Get chart data for dashboard; Accept selects row JSON (default), column arrays or Arrow IPC"""
     pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        # Revenue trend (last 30 days)
-        revenue_trend = []
-        for i in range(30, 0, -1):
-            date = datetime.now() - timedelta(days=i)
-            revenue = await conn.fetchval("""
-                SELECT COALESCE(SUM(total_amount), 0)
-                FROM orders 
-                WHERE DATE(created_at) = $1 AND status = 'completed'
-            """, date.date()) or 0
-            
-            revenue_trend.append({
-                "date": date.strftime("%m/%d"),
-                "revenue": float(revenue)
-            })
-        
-        # Orders by status
-        orders_by_status = await conn.fetch("""
-            SELECT status, COUNT(*) as count
-            FROM orders 
-            WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-            GROUP BY status
-        """)
-        
-        orders_status_data = [
-            {"name": row['status'].title(), "value": row['count']}
-            for row in orders_by_status
-        ]
-        
-        # Top products
-        top_products = await conn.fetch("""
-            SELECT p.name, SUM(oi.quantity) as sales
-            FROM products p
-            JOIN order_items oi ON p.id = oi.product_id
-            JOIN orders o ON oi.order_id = o.id
-            WHERE o.created_at >= CURRENT_DATE - INTERVAL '30 days'
-            GROUP BY p.id, p.name
-            ORDER BY sales DESC
-            LIMIT 5
-        """)
-        
-        top_products_data = [
-            {"name": row['name'][:15] + "..." if len(row['name']) > 15 else row['name'], 
-             "sales": row['sales']}
-            for row in top_products
-        ]
-        
-        # User growth (simplified)
-        user_growth = []
-        for i in range(30, 0, -1):
-            date = datetime.now() - timedelta(days=i)
-            users = await conn.fetchval("""
-                SELECT COUNT(DISTINCT user_id)
-                FROM orders 
-                WHERE created_at <= $1
-            """, date) or 0
-            
-            user_growth.append({
-                "date": date.strftime("%m/%d"),
-                "users": users
-            })
-        
-        return {
-            "revenue_trend": revenue_trend,
-            "orders_by_status": orders_status_data,
-            "top_products": top_products_data,
-            "user_growth": user_growth
-        }
\ No newline at end of file
+    format = negotiate(request.headers.get("accept"))
+    try:
+        if format == "json":
+            return negotiated_response(format, await build_chart_data(pool, days, granularity))
+        frames = await build_chart_frames(pool, days, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "arrow":
+        return negotiated_response(format, arrow_ipc_frames(frames))
+    return negotiated_response(format, {name: columnar(frame) for name, frame in frames.items()})
+
+@router.get("/cache")
+async def get_cache_stats():
+    """Query result cache hit/miss counters and memory use"""
+    return query_cache.stats()
@@ -0,0 +1,224 @@
+import time
+import asyncio
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from .executor import metric_executor, MetricExecutionError, MetricRunResult
+from .history import metric_history, numeric_value
+from .sql_utils import normalize_sql
+from .cache import query_cache
+from .slow_queries import slow_query_log
+from .versions import sql_hash, find_stored_result
+from .workloads import WorkloadSaturated
+
+async def load_metric(conn, metric_id) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Fetch a metric and its target dataset, if any"""
+    metric = await conn.fetchrow(
+        "SELECT id, sql_query, dataset_id FROM metrics WHERE id = $1", metric_id
+    )
+    if not metric:
+        return None, None
+    dataset = None
+    if metric['dataset_id']:
+        dataset = await conn.fetchrow("SELECT * FROM datasets WHERE id = $1", metric['dataset_id'])
+    return dict(metric), dict(dataset) if dataset else None
+
+async def load_metrics(conn, metric_ids: Optional[List[Any]] = None, category: Optional[str] = None
+                       ) -> Tuple[List[Dict[str, Any]], Dict[Any, Dict[str, Any]]]:
+    """Fetch active metrics by id or category, plus the datasets they target"""
+    metrics = await conn.fetch("""
+        SELECT id, name, sql_query, dataset_id
+        FROM metrics
+        WHERE status = 'active'
+          AND ($1::uuid[] IS NULL OR id = ANY($1::uuid[]))
+          AND ($2::text IS NULL OR category = $2::text)
+        ORDER BY created_at
+    """, metric_ids, category)
+    dataset_ids = list({m['dataset_id'] for m in metrics if m['dataset_id']})
+    datasets = {}
+    if dataset_ids:
+        for row in await conn.fetch("SELECT * FROM datasets WHERE id = ANY($1::uuid[])", dataset_ids):
+            datasets[row['id']] = dict(row)
+    return [dict(m) for m in metrics], datasets
+
+class RunOutcome:
+    """The outcome of one SQL execution, shared by every metric that ran it.
+
+    `cached` marks a result served without executing, which is stored like
+    any other run but left out of latency comparisons.
+    """
+
+    def __init__(self, metric_ids: List[Any], sql: str, dataset_id: Any = None,
+                 result: Optional[MetricRunResult] = None, error: Optional[str] = None, cached: bool = False):
+        self.metric_ids = metric_ids
+        self.sql = sql
+        self.dataset_id = dataset_id
+        self.result = result
+        self.error = error
+        self.cached = cached
+
+async def store_batch(conn, outcomes: List[RunOutcome]) -> Tuple[datetime, Dict[Any, Any]]:
+    """Record many run outcomes in one transaction.
+
+    Results go in with a single multi-row insert, each keyed to the metric
+    version whose SQL hash and dataset it ran, and last_run is bumped for
+    every metric that executed successfully with a single update. Cached
+    outcomes are stored as results, but they don't move last_run or add
+    history points: their values were observed when the SQL last ran.
+    Returns the run time and the stored result id per metric.
+    """
+    ran_at = datetime.utcnow()
+    metric_ids, payloads, times, statuses, errors, cached, hashes, dataset_ids = [], [], [], [], [], [], [], []
+    points = []
+    succeeded = []
+    for outcome in outcomes:
+        result_data = outcome.result.model_dump() if outcome.result else None
+        value = numeric_value(result_data) if result_data else None
+        digest = sql_hash(outcome.sql)
+        for metric_id in outcome.metric_ids:
+            metric_ids.append(metric_id)
+            payloads.append(result_data)
+            times.append(outcome.result.execution_time_ms if outcome.result else None)
+            statuses.append('success' if outcome.result else 'error')
+            errors.append(outcome.error)
+            cached.append(outcome.cached)
+            hashes.append(digest)
+            dataset_ids.append(outcome.dataset_id)
+            if outcome.cached:
+                continue
+            if outcome.result:
+                succeeded.append(metric_id)
+            # Numeric results also feed the time-series history
+            if value is not None:
+                points.append((metric_id, ran_at, value))
+    if not metric_ids:
+        return ran_at, {}
+
+    async with conn.transaction():
+        # Matched on what actually ran, so an update made mid-run can't mislabel the result
+        stored = await conn.fetch("""
+            INSERT INTO metric_results
+                (metric_id, result_data, execution_time_ms, status, error, cached, metric_version)
+            SELECT r.metric_id, r.result_data, r.execution_time_ms, r.status, r.error, r.cached,
+                   (SELECT MAX(v.version) FROM metric_versions v
+                    WHERE v.metric_id = r.metric_id AND v.sql_hash = r.sql_hash
+                      AND v.dataset_id IS NOT DISTINCT FROM r.dataset_id)
+            FROM unnest($1::uuid[], $2::jsonb[], $3::int[], $4::text[], $5::text[], $6::bool[], $7::text[], $8::uuid[])
+                AS r(metric_id, result_data, execution_time_ms, status, error, cached, sql_hash, dataset_id)
+            RETURNING id, metric_id
+        """, metric_ids, payloads, times, statuses, errors, cached, hashes, dataset_ids)
+        await metric_history.record_many(conn, points)
+        if succeeded:
+            await conn.execute(
+                "UPDATE metrics SET last_run = $1 WHERE id = ANY($2::uuid[])",
+                ran_at, succeeded
+            )
+    return ran_at, {row['metric_id']: row['id'] for row in stored}
+
+async def execute_and_store(pool, sql: str, dataset: Optional[Dict[str, Any]],
+                            metric_ids: List[Any], cached: bool = False) -> MetricRunResult:
+    """Run SQL on the executor, then store the outcome for every listed metric.
+
+    The API pool is only used for the short writes before and after, never
+    while the query itself runs. With `cached`, a recent result for the same
+    SQL on the same dataset is reused instead of executing again: from the
+    query cache, or else a stored result of any metric version with the same
+    SQL hash. Slow runs that actually executed get their plan captured by
+    the slow query log.
+    """
+    dataset_id = dataset['id'] if dataset else None
+
+    async def execute() -> Tuple[MetricRunResult, bool]:
+        """The result, and whether the SQL was executed for it rather than reused from a stored run"""
+        if cached:
+            async with pool.acquire() as conn:
+                stored = await find_stored_result(conn, sql, dataset_id)
+            if stored:
+                return MetricRunResult(**stored['result_data']), False
+        return await metric_executor.execute(sql, dataset), True
+
+    try:
+        if cached:
+            computed = None
+
+            async def compute():
+                nonlocal computed
+                computed = await execute()
+                return computed[0]
+
+            result = await query_cache.get(dataset_id, sql, (), None, compute)
+            # Executed by this call only if the cache handed back what compute produced; after
+            # a stale hit, the background refresh produces a different object
+            executed = computed is not None and computed[0] is result and computed[1]
+        else:
+            result, executed = await execute()
+    except MetricExecutionError as e:
+        async with pool.acquire() as conn:
+            await store_batch(conn, [RunOutcome(metric_ids, sql, dataset_id, error=str(e))])
+        raise
+    async with pool.acquire() as conn:
+        _, result_ids = await store_batch(conn, [RunOutcome(metric_ids, sql, dataset_id, result,
+                                                            cached=not executed)])
+    if executed:
+        slow_query_log.capture(pool, sql, dataset, list(result_ids.values()), result)
+    return result
+
+async def run_batch(pool, metrics: List[Dict[str, Any]], datasets: Dict[Any, Dict[str, Any]],
+                    emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Run many metrics concurrently and store every outcome in one write.
+
+    Metrics with the same normalized SQL on the same dataset execute once.
+    Parallelism is bounded by the executor's share for batch work; groups
+    it sheds under load are reported as rejected and not stored. `emit` is
+    called with an event as each metric finishes.
+    """
+    started = time.perf_counter()
+    groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+    for metric in metrics:
+        groups.setdefault((metric['dataset_id'], normalize_sql(metric['sql_query'])), []).append(metric)
+
+    outcomes: List[RunOutcome] = []
+    rejected = 0
+
+    async def run_group(dataset_id, members):
+        nonlocal rejected
+        ids = [m['id'] for m in members]
+        sql = members[0]['sql_query']
+        try:
+            result = await metric_executor.execute(sql, datasets.get(dataset_id))
+        except WorkloadSaturated as e:
+            # Shed under load: nothing ran, so nothing is stored
+            rejected += len(members)
+            for m in members:
+                emit({"event": "metric", "metric_id": str(m['id']), "name": m['name'],
+                      "status": "rejected", "error": str(e), "retry_after": e.retry_after})
+            return
+        except MetricExecutionError as e:
+            outcomes.append(RunOutcome(ids, sql, dataset_id, error=str(e)))
+            for m in members:
+                emit({"event": "metric", "metric_id": str(m['id']), "name": m['name'],
+                      "status": "error", "error": str(e)})
+            return
+        outcomes.append(RunOutcome(ids, sql, dataset_id, result))
+        result_data = result.model_dump()
+        for m in members:
+            emit({"event": "metric", "metric_id": str(m['id']), "name": m['name'],
+                  "status": "success", "result": result_data})
+
+    await asyncio.gather(*(run_group(key[0], members) for key, members in groups.items()))
+
+    async with pool.acquire() as conn:
+        ran_at, result_ids = await store_batch(conn, outcomes)
+    for outcome in outcomes:
+        if outcome.result:
+            slow_query_log.capture(pool, outcome.sql, datasets.get(outcome.dataset_id),
+                                   [result_ids[i] for i in outcome.metric_ids if i in result_ids], outcome.result)
+
+    return {
+        "succeeded": sum(len(o.metric_ids) for o in outcomes if o.result),
+        "failed": sum(len(o.metric_ids) for o in outcomes if not o.result),
+        "rejected": rejected,
+        "queries": len(groups),
+        "ran_at": ran_at.isoformat(),
+        "elapsed_ms": int((time.perf_counter() - started) * 1000),
+    }
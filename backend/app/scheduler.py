@@ -0,0 +1,191 @@
+import os
+import math
+import time
+import asyncio
+import hashlib
+import asyncpg
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from .database import DATABASE_URL
+from .executor import MetricExecutionError
+from .runs import execute_and_store
+from .sql_utils import normalize_sql
+from .workloads import current_workload, WorkloadSaturated
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "15"))
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "4"))
+SCHEDULER_PER_DATASET_CONCURRENCY = int(os.getenv("SCHEDULER_PER_DATASET_CONCURRENCY", "2"))
+# Fraction of each metric's interval used to spread its runs, capped in seconds
+SCHEDULER_JITTER_FRACTION = float(os.getenv("SCHEDULER_JITTER_FRACTION", "0.1"))
+SCHEDULER_MAX_JITTER_SECONDS = float(os.getenv("SCHEDULER_MAX_JITTER_SECONDS", "300"))
+
+# Only one process per database schedules; the others stand by
+SCHEDULER_LOCK_KEY = 0x6D6574726963  # "metric"
+
+SCHEDULED_METRICS_SQL = """
+    SELECT m.id, m.sql_query, m.dataset_id, m.refresh_interval_seconds, m.last_run
+    FROM metrics m
+    WHERE m.status = 'active' AND m.refresh_interval_seconds > 0
+"""
+
+EPOCH = datetime(2000, 1, 1)
+
+def _fraction(metric_id: Any) -> float:
+    """Stable pseudo-random number in [0, 1) for a metric"""
+    digest = hashlib.md5(str(metric_id).encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32
+
+def due_at(metric: Dict[str, Any], started_at: datetime) -> datetime:
+    """When a metric should next run.
+
+    Each metric runs on its own grid of interval-spaced slots, offset by a
+    stable per-metric phase so metrics sharing an interval don't fire
+    together. Overdue metrics (including runs missed while the scheduler was
+    down) are caught up once, spread over a short jitter window after the
+    scheduler starts rather than all at once.
+    """
+    interval = metric['refresh_interval_seconds']
+    fraction = _fraction(metric['id'])
+    catch_up = started_at + timedelta(
+        seconds=fraction * min(interval * SCHEDULER_JITTER_FRACTION, SCHEDULER_MAX_JITTER_SECONDS)
+    )
+    if not metric['last_run']:
+        return catch_up
+    phase = fraction * interval
+    elapsed = (metric['last_run'] - EPOCH).total_seconds() - phase
+    next_slot = EPOCH + timedelta(seconds=phase + (math.floor(elapsed / interval) + 1) * interval)
+    # A run that finished exactly on a slot can round down to that slot; the next one is due
+    if next_slot <= metric['last_run']:
+        next_slot += timedelta(seconds=interval)
+    return next_slot if next_slot >= started_at else catch_up
+
+class MetricScheduler:
+    """In-process scheduler that refreshes active metrics on their intervals"""
+
+    def __init__(self, pool, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+                 per_dataset_concurrency: int = SCHEDULER_PER_DATASET_CONCURRENCY,
+                 tick_seconds: float = SCHEDULER_TICK_SECONDS):
+        self.pool = pool
+        self.tick_seconds = tick_seconds
+        self.per_dataset_concurrency = per_dataset_concurrency
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._per_dataset: Dict[Any, asyncio.Semaphore] = {}
+        # Group keys currently executing, so slow queries aren't stacked up tick after tick
+        self._in_flight: Dict[Tuple, asyncio.Task] = {}
+        self._started_at = datetime.utcnow()
+        self._task: Optional[asyncio.Task] = None
+        self._lock_conn: Optional[asyncpg.Connection] = None
+        # Failed metrics wait a full interval before retrying instead of failing every tick
+        self._retry_after: Dict[Any, datetime] = {}
+        self.stats = {"ticks": 0, "runs": 0, "coalesced": 0, "failures": 0, "deferred": 0}
+
+    async def tick(self) -> int:
+        """Start every due metric group; returns the number of groups started"""
+        self.stats["ticks"] += 1
+        now = datetime.utcnow()
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(SCHEDULED_METRICS_SQL)
+            datasets = {}
+            dataset_ids = {row['dataset_id'] for row in rows if row['dataset_id']}
+            if dataset_ids:
+                for row in await conn.fetch("SELECT * FROM datasets WHERE id = ANY($1::uuid[])", list(dataset_ids)):
+                    datasets[row['id']] = dict(row)
+
+        # Metrics with identical normalized SQL on the same dataset run once per tick
+        groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            metric = dict(row)
+            if due_at(metric, self._started_at) > now or self._retry_after.get(metric['id'], now) > now:
+                continue
+            key = (metric['dataset_id'], normalize_sql(metric['sql_query']))
+            groups.setdefault(key, []).append(metric)
+
+        started = 0
+        for key, metrics in groups.items():
+            if key in self._in_flight:
+                continue
+            dataset_id = key[0]
+            if dataset_id and dataset_id not in datasets:
+                continue
+            task = asyncio.ensure_future(self._run_group(key, metrics, datasets.get(dataset_id)))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _, key=key: self._in_flight.pop(key, None))
+            self.stats["coalesced"] += len(metrics) - 1
+            started += 1
+        return started
+
+    async def _run_group(self, key: Tuple, metrics: List[Dict[str, Any]], dataset: Optional[Dict[str, Any]]):
+        dataset_limit = self._per_dataset.setdefault(key[0], asyncio.Semaphore(self.per_dataset_concurrency))
+        async with self._global, dataset_limit:
+            try:
+                await execute_and_store(self.pool, metrics[0]['sql_query'], dataset,
+                                        [m['id'] for m in metrics])
+                self.stats["runs"] += 1
+                for m in metrics:
+                    self._retry_after.pop(m['id'], None)
+            except WorkloadSaturated:
+                # Not the metric's fault; try again next tick instead of waiting an interval
+                self.stats["deferred"] += 1
+            except Exception as e:
+                self.stats["failures"] += 1
+                for m in metrics:
+                    self._retry_after[m['id']] = datetime.utcnow() + timedelta(seconds=m['refresh_interval_seconds'])
+                if isinstance(e, MetricExecutionError):
+                    print(f"Scheduled metric run failed for {[str(m['id']) for m in metrics]}: {e}")
+                else:
+                    print(f"Scheduled metric run crashed: {e}")
+
+    async def _is_leader(self) -> bool:
+        """Hold a session advisory lock so only one process schedules"""
+        if self._lock_conn is None or self._lock_conn.is_closed():
+            self._lock_conn = await asyncpg.connect(DATABASE_URL)
+        return await self._lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", SCHEDULER_LOCK_KEY)
+
+    async def _run_forever(self):
+        # Runs started from here inherit the class
+        current_workload.set("batch")
+        while True:
+            started = time.monotonic()
+            try:
+                if await self._is_leader():
+                    await self.tick()
+            except Exception as e:
+                print(f"Metric scheduler tick failed: {e}")
+                if self._lock_conn is not None:
+                    await self._lock_conn.close()
+                    self._lock_conn = None
+            await asyncio.sleep(max(0.0, self.tick_seconds - (time.monotonic() - started)))
+
+    def start(self):
+        if self._task is None:
+            self._started_at = datetime.utcnow()
+            self._task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        """Stop scheduling and wait for runs in progress"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+        if self._lock_conn is not None:
+            await self._lock_conn.close()
+            self._lock_conn = None
+
+# Created on startup once the database pool exists
+metric_scheduler: Optional[MetricScheduler] = None
+
+def start_scheduler(pool) -> Optional[MetricScheduler]:
+    global metric_scheduler
+    if SCHEDULER_ENABLED and metric_scheduler is None:
+        metric_scheduler = MetricScheduler(pool)
+        metric_scheduler.start()
+    return metric_scheduler
+
+async def stop_scheduler():
+    global metric_scheduler
+    if metric_scheduler is not None:
+        await metric_scheduler.stop()
+        metric_scheduler = None
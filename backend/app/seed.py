@@ -0,0 +1,246 @@
+"""Deterministic synthetic data for the sample eCommerce schema.
+
+Usage (from the backend directory):
+
+    python -m app.seed --scale 1 --seed 42
+
+Scale factor 1 is 10k users, 1k products and 100k orders (about 250k order
+items); rows grow linearly with the scale factor.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import itertools
+import asyncpg
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from .rollups import order_rollups
+
+# Rows generated per unit of scale factor
+USERS_PER_SCALE = 10_000
+PRODUCTS_PER_SCALE = 1_000
+ORDERS_PER_SCALE = 100_000
+
+DEFAULT_SEED = 42
+DEFAULT_BATCH_SIZE = 50_000
+
+FIRST_NAMES = ['John', 'Jane', 'Bob', 'Alice', 'Charlie', 'Diana', 'Ethan', 'Fiona', 'George', 'Hannah',
+               'Ivan', 'Julia', 'Kevin', 'Laura', 'Mike', 'Nina', 'Oscar', 'Paula', 'Quinn', 'Rosa']
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Brown', 'Wilson', 'Taylor', 'Anderson', 'Thomas', 'Moore', 'Martin',
+              'Jackson', 'White', 'Harris', 'Clark', 'Lewis', 'Young', 'King', 'Wright', 'Lopez', 'Hill']
+
+BASE_PRODUCTS = [
+    ('Laptop Pro', 'High-performance laptop', 129999, 'Electronics'),
+    ('Wireless Headphones', 'Noise-cancelling headphones', 19999, 'Electronics'),
+    ('Coffee Maker', 'Automatic coffee maker', 8999, 'Appliances'),
+    ('Running Shoes', 'Comfortable running shoes', 12999, 'Sports'),
+    ('Backpack', 'Durable travel backpack', 7999, 'Travel'),
+    ('Smartphone', 'Latest smartphone model', 89999, 'Electronics'),
+    ('Desk Chair', 'Ergonomic office chair', 24999, 'Furniture'),
+    ('Water Bottle', 'Insulated water bottle', 2499, 'Sports'),
+]
+
+ORDER_STATUSES = ['completed', 'pending', 'shipped', 'cancelled']
+ORDER_STATUS_WEIGHTS = [60, 10, 20, 10]
+
+# Secondary structures dropped before a bulk load and rebuilt afterwards
+SAMPLE_FOREIGN_KEYS = [
+    ("orders", "orders_user_id_fkey", "FOREIGN KEY (user_id) REFERENCES users(id)"),
+    ("order_items", "order_items_order_id_fkey", "FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE"),
+    ("order_items", "order_items_product_id_fkey", "FOREIGN KEY (product_id) REFERENCES products(id)"),
+]
+SAMPLE_INDEXES = [
+    ("idx_orders_created_at", "orders (created_at)"),
+    ("idx_orders_updated_at", "orders (updated_at)"),
+    ("idx_order_items_order_id", "order_items (order_id)"),
+]
+
+def counts_for_scale(scale: float) -> Dict[str, int]:
+    """Row counts for a scale factor"""
+    return {
+        "users": max(1, int(USERS_PER_SCALE * scale)),
+        "products": max(1, int(PRODUCTS_PER_SCALE * scale)),
+        "orders": max(0, int(ORDERS_PER_SCALE * scale)),
+    }
+
+def _cents(value: int) -> Decimal:
+    return Decimal(value).scaleb(-2)
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+async def _copy_batches(conn, table: str, columns: List[str], rows, batch_size: int) -> int:
+    """COPY an iterator of records in fixed-size batches so memory stays bounded"""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await conn.copy_records_to_table(table, records=batch, columns=columns)
+            total += len(batch)
+            batch = []
+    if batch:
+        await conn.copy_records_to_table(table, records=batch, columns=columns)
+        total += len(batch)
+    return total
+
+async def _copy_orders(conn, order_batch, item_batch):
+    await conn.copy_records_to_table('orders', records=order_batch, columns=[
+        'id', 'user_id', 'total_amount', 'status', 'created_at', 'updated_at'])
+    await conn.copy_records_to_table('order_items', records=item_batch, columns=[
+        'id', 'order_id', 'product_id', 'quantity', 'unit_price', 'total_price'])
+
+async def generate_sample_data(conn, users: int, products: int, orders: int,
+                               seed: int = DEFAULT_SEED, days: int = 90,
+                               end: Optional[datetime] = None,
+                               batch_size: int = DEFAULT_BATCH_SIZE,
+                               log=None) -> Dict[str, int]:
+    """Replace the sample eCommerce tables with freshly generated rows.
+
+    Output is fully determined by the counts, seed, days and end timestamp.
+    Foreign keys and secondary indexes are dropped during the load and
+    rebuilt once at the end, which is much cheaper than maintaining them
+    row by row.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    window_seconds = days * 86400
+    loaded: Dict[str, int] = {}
+
+    def report(table, count, started):
+        loaded[table] = count
+        if log:
+            elapsed = time.perf_counter() - started
+            log(f"{table}: {count:,} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    async with conn.transaction():
+        # Lock in the order readers join (orders before order_items) so a concurrent
+        # rollup refresh waits for the reload instead of deadlocking with it
+        await conn.execute("TRUNCATE users, products, orders, order_items")
+        for table, name, _ in SAMPLE_FOREIGN_KEYS:
+            await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+        for name, _ in SAMPLE_INDEXES:
+            await conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+        # Users
+        started = time.perf_counter()
+        user_ids = [_uuid(rng) for _ in range(users)]
+
+        def user_rows():
+            for n, user_id in enumerate(user_ids):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                created_at = end - timedelta(seconds=rng.randrange(window_seconds))
+                last_login = created_at + timedelta(seconds=rng.randrange(max(1, int((end - created_at).total_seconds()))))
+                yield (user_id, f"{first.lower()}.{last.lower()}{n}@example.com", first, last,
+                       created_at, last_login, rng.random() > 0.05)
+
+        count = await _copy_batches(conn, 'users', ['id', 'email', 'first_name', 'last_name', 'created_at',
+                                                    'last_login', 'is_active'], user_rows(), batch_size)
+        report('users', count, started)
+
+        # Products; prices are kept in cents so order totals can be summed exactly
+        started = time.perf_counter()
+        product_ids = [_uuid(rng) for _ in range(products)]
+        product_prices: List[int] = []
+
+        def product_rows():
+            for n, product_id in enumerate(product_ids):
+                name, description, base_price, category = BASE_PRODUCTS[n % len(BASE_PRODUCTS)]
+                if n >= len(BASE_PRODUCTS):
+                    name = f"{name} {n // len(BASE_PRODUCTS) + 1}"
+                    base_price = int(base_price * rng.uniform(0.7, 1.3))
+                product_prices.append(base_price)
+                yield (product_id, name, description, _cents(base_price), category,
+                       rng.randint(10, 100), end - timedelta(days=days), True)
+
+        count = await _copy_batches(conn, 'products', ['id', 'name', 'description', 'price', 'category',
+                                                       'stock_quantity', 'created_at', 'is_active'],
+                                    product_rows(), batch_size)
+        report('products', count, started)
+
+        # Orders and their items are generated together, one batch of orders at a time
+        started = time.perf_counter()
+        line_totals = {}
+        status_weights = list(itertools.accumulate(ORDER_STATUS_WEIGHTS))
+        items_total = 0
+        orders_total = 0
+        for batch_start in range(0, orders, batch_size):
+            order_batch = []
+            item_batch = []
+            for _ in range(min(batch_size, orders - batch_start)):
+                order_id = _uuid(rng)
+                created_at = end - timedelta(seconds=rng.randrange(1, window_seconds))
+                total = 0
+                for _ in range(rng.randint(1, 4)):
+                    # Squaring skews sales towards the first products, like a real catalog
+                    product = int(rng.random() ** 2 * products)
+                    quantity = rng.randint(1, 3)
+                    key = (product, quantity)
+                    if key not in line_totals:
+                        line_totals[key] = (_cents(product_prices[product]),
+                                            _cents(product_prices[product] * quantity))
+                    unit_price, line_total = line_totals[key]
+                    total += product_prices[product] * quantity
+                    item_batch.append((_uuid(rng), order_id, product_ids[product], quantity,
+                                       unit_price, line_total))
+                status = rng.choices(ORDER_STATUSES, cum_weights=status_weights)[0]
+                order_batch.append((order_id, rng.choice(user_ids), _cents(total), status, created_at, created_at))
+            await _copy_orders(conn, order_batch, item_batch)
+            orders_total += len(order_batch)
+            items_total += len(item_batch)
+        report('orders', orders_total, started)
+        loaded['order_items'] = items_total
+
+        # Rebuild constraints and indexes in one pass each
+        started = time.perf_counter()
+        for name, definition in SAMPLE_INDEXES:
+            await conn.execute(f"CREATE INDEX {name} ON {definition}")
+        for table, name, definition in SAMPLE_FOREIGN_KEYS:
+            await conn.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+        if log:
+            log(f"order_items: {items_total:,} rows; indexes and foreign keys rebuilt in "
+                f"{time.perf_counter() - started:.1f}s")
+
+    for table in ('users', 'products', 'orders', 'order_items'):
+        await conn.execute(f"ANALYZE {table}")
+
+    # Loaded rows carry historical updated_at values, so incremental refresh would miss them
+    started = time.perf_counter()
+    await order_rollups.rebuild(conn)
+    if log:
+        log(f"rollups rebuilt in {time.perf_counter() - started:.1f}s")
+    return loaded
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sample eCommerce data")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="scale factor (1 = 10k users, 1k products, 100k orders)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--days", type=int, default=365, help="spread orders over this many days")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    from .database import DATABASE_URL
+    from .migrations import migrate
+
+    conn = await asyncpg.connect(args.dsn or DATABASE_URL)
+    try:
+        # Make sure the schema exists
+        await migrate(conn)
+        counts = counts_for_scale(args.scale)
+        print(f"Generating scale {args.scale} with seed {args.seed}: "
+              f"{counts['users']:,} users, {counts['products']:,} products, {counts['orders']:,} orders")
+        await generate_sample_data(conn, seed=args.seed, days=args.days,
+                                   batch_size=args.batch_size, log=print, **counts)
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,57 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Iterable
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def _default(value: Any) -> Any:
+    """Types orjson doesn't encode natively, converted as the executor's to_json_value does"""
+    if isinstance(value, Decimal):
+        return float(value)
+    # asyncpg returns its own uuid.UUID subclass, which orjson only handles here
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(value: Any) -> bytes:
+    """Encode to compact JSON bytes; datetimes, dates and UUIDs are handled natively"""
+    return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+def loads(data: Any) -> Any:
+    return orjson.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """Default response class; renders with orjson instead of the stdlib encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def records_response(rows: Iterable[Any], status_code: int = 200) -> Response:
+    """Encode asyncpg Records straight to a JSON array response.
+
+    Skips response_model validation and jsonable_encoder, so the query must
+    select exactly the fields the route's response model documents.
+    """
+    return Response(content=dumps([dict(row) for row in rows]), status_code=status_code,
+                    media_type="application/json")
+
+async def set_json_codecs(conn):
+    """Decode json/jsonb columns to Python values and encode parameters once, in the driver.
+
+    Callers pass dicts and lists for JSONB parameters rather than json.dumps strings.
+    """
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name, schema="pg_catalog",
+            encoder=lambda value: dumps(value).decode(), decoder=loads,
+        )
@@ -0,0 +1,89 @@
+"""Production entry point: several uvicorn worker processes sharing one database connection budget.
+
+Usage (from the backend directory):
+
+    python -m app.serve --workers 4 --port 8000
+
+Each worker gets an equal share of DB_CONNECTION_BUDGET. The share is split
+between the scheduler's lock connection, the API pool, the metric executor
+and the export executor, so the fleet never opens more than the budget
+against Postgres. On SIGTERM workers stop accepting connections, finish
+in-flight requests for up to DRAIN_TIMEOUT_SECONDS, then run the shutdown
+hooks, which wait for batch runs and close every pool.
+"""
+import os
+import sys
+import argparse
+from typing import Dict
+
+import uvicorn
+
+# Total connections all workers together may open to the application database
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "80"))
+DRAIN_TIMEOUT_SECONDS = int(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+
+# Per-worker connections outside the pools: the scheduler's leader lock
+RESERVED_CONNECTIONS = 1
+
+def available_cores() -> int:
+    """Cores this process may run on, which respects container CPU sets unlike os.cpu_count"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", "0")) or available_cores()
+
+def worker_pool_sizes(budget: int, workers: int) -> Dict[str, int]:
+    """Pool settings for each worker, as environment variables.
+
+    The pools keep the default 10:4:2 proportion of API, metric and export
+    connections, with at least two for the API and one for each executor.
+    """
+    available = budget // workers - RESERVED_CONNECTIONS
+    if available < 4:
+        raise ValueError(f"A budget of {budget} connections is too small for {workers} workers "
+                         f"(each needs at least {4 + RESERVED_CONNECTIONS})")
+    metrics = max(1, available * 4 // 16)
+    exports = max(1, available * 2 // 16)
+    api = available - metrics - exports
+    return {
+        "DB_POOL_MAX_SIZE": api,
+        "DB_POOL_MIN_SIZE": min(int(os.getenv("DB_POOL_MIN_SIZE", "4")), api),
+        "METRIC_MAX_CONCURRENCY": metrics,
+        "EXPORT_MAX_CONCURRENCY": exports,
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the AnalyticsOS API with multiple worker processes")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", os.getenv("API_PORT", "8000"))))
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="worker processes (default: WEB_CONCURRENCY, else the available cores)")
+    parser.add_argument("--connection-budget", type=int, default=DB_CONNECTION_BUDGET,
+                        help="database connections across all workers")
+    parser.add_argument("--drain-timeout", type=int, default=DRAIN_TIMEOUT_SECONDS,
+                        help="seconds to finish in-flight requests on shutdown")
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = worker_pool_sizes(args.connection_budget, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    # Workers are spawned with this environment, before they import the app
+    os.environ.update({name: str(value) for name, value in sizes.items()})
+    print(f"Starting {args.workers} workers, {args.connection_budget // args.workers} database connections each: "
+          + ", ".join(f"{name}={value}" for name, value in sizes.items()))
+
+    uvicorn.run(
+        f"{__package__}.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.drain_timeout,
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+from .executor import metric_executor, MetricExecutionError, MetricRunResult
+from .sql_utils import normalize_sql
+from .workloads import current_workload, WorkloadSaturated
+
+# Runs at or above this get an EXPLAIN (ANALYZE, BUFFERS) captured; 0 disables capture
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv("SLOW_QUERY_THRESHOLD_MS", "1000"))
+# EXPLAIN ANALYZE executes the query again, so each SQL is captured at most this often
+SLOW_QUERY_CAPTURE_INTERVAL_SECONDS = float(os.getenv("SLOW_QUERY_CAPTURE_INTERVAL_SECONDS", "3600"))
+# Median latency growth that counts as a regression
+SLOW_QUERY_REGRESSION_RATIO = float(os.getenv("SLOW_QUERY_REGRESSION_RATIO", "1.5"))
+
+# Smaller slowdowns are noise, whatever the ratio
+REGRESSION_MIN_DELTA_MS = 50
+
+VERSION_LATENCY_SQL = """
+    WITH runs AS (
+        SELECT metric_version, execution_time_ms, created_at,
+               ntile(2) OVER (PARTITION BY metric_version ORDER BY created_at) AS half
+        FROM metric_results
+        WHERE metric_id = $1 AND status = 'success' AND NOT cached AND metric_version IS NOT NULL
+          AND created_at >= $2
+    )
+    SELECT metric_version AS version, COUNT(*) AS runs,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY execution_time_ms) AS p50_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY execution_time_ms) AS p95_ms,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY execution_time_ms) FILTER (WHERE half = 1) AS early_p50_ms,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY execution_time_ms) FILTER (WHERE half = 2) AS recent_p50_ms,
+           COUNT(*) FILTER (WHERE execution_time_ms >= $3) AS slow_runs,
+           MIN(created_at) AS first_run, MAX(created_at) AS last_run
+    FROM runs
+    GROUP BY metric_version
+    ORDER BY metric_version
+"""
+
+VERSION_PLANS_SQL = """
+    SELECT DISTINCT ON (metric_version, plan_shape)
+           metric_version AS version, plan_shape, id AS result_id, created_at, execution_time_ms,
+           COUNT(*) OVER (PARTITION BY metric_version, plan_shape) AS captures
+    FROM metric_results
+    WHERE metric_id = $1 AND plan_shape IS NOT NULL AND created_at >= $2
+    ORDER BY metric_version, plan_shape, created_at DESC
+"""
+
+def plan_shape(node: Dict[str, Any]) -> str:
+    """Node types and the relations or indexes they read, nested; costs, rows and timings are left out
+    so two plans compare equal when the planner chose the same strategy"""
+    label = node["Node Type"]
+    target = node.get("Index Name") or node.get("Relation Name")
+    if target:
+        label += f"[{target}]"
+    children = node.get("Plans") or []
+    if children:
+        label += "(" + ",".join(plan_shape(child) for child in children) + ")"
+    return label
+
+class SlowQueryLog:
+    """Captures EXPLAIN (ANALYZE, BUFFERS) plans for slow metric runs and stores them on the run rows"""
+
+    def __init__(self, threshold_ms: int = SLOW_QUERY_THRESHOLD_MS,
+                 interval_seconds: float = SLOW_QUERY_CAPTURE_INTERVAL_SECONDS):
+        self.threshold_ms = threshold_ms
+        self.interval_seconds = interval_seconds
+        # (dataset id, normalized SQL) -> monotonic time of the last capture
+        self._captured: Dict[Tuple, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # One EXPLAIN at a time, so a burst of slow runs doesn't double the load
+        self._explaining = asyncio.Semaphore(1)
+        self.stats = {"captured": 0, "skipped": 0, "failed": 0}
+
+    def is_slow(self, result: MetricRunResult) -> bool:
+        return self.threshold_ms > 0 and result.execution_time_ms >= self.threshold_ms
+
+    def capture(self, pool, sql: str, dataset: Optional[Dict[str, Any]], result_ids: List[Any],
+                result: MetricRunResult):
+        """Capture a plan in the background if the run was slow and its SQL wasn't captured recently"""
+        if not result_ids or not self.is_slow(result):
+            return
+        now = time.monotonic()
+        key = (dataset['id'] if dataset else None, normalize_sql(sql))
+        last = self._captured.get(key)
+        if last is not None and now - last < self.interval_seconds:
+            self.stats["skipped"] += 1
+            return
+        if len(self._captured) >= 1000:
+            self._captured = {k: t for k, t in self._captured.items() if now - t < self.interval_seconds}
+        self._captured[key] = now
+        task = asyncio.ensure_future(self._capture(pool, key, sql, dataset, result_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _capture(self, pool, key: Tuple, sql: str, dataset: Optional[Dict[str, Any]], result_ids: List[Any]):
+        # Plan capture is background work and yields to interactive queries
+        current_workload.set("batch")
+        try:
+            async with self._explaining:
+                try:
+                    explained = await metric_executor.explain(sql, dataset)
+                except MetricExecutionError as e:
+                    self.stats["failed"] += 1
+                    print(f"Slow query EXPLAIN failed: {e}")
+                    return
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE metric_results SET query_plan = $1, plan_shape = $2 WHERE id = ANY($3::uuid[])",
+                    explained, plan_shape(explained["Plan"]), result_ids
+                )
+        except WorkloadSaturated:
+            # Too busy right now; let the next slow run of this SQL try again
+            self._captured.pop(key, None)
+            self.stats["skipped"] += 1
+            return
+        self.stats["captured"] += 1
+
+    async def stop(self):
+        """Cancel captures in progress"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Global slow query log
+slow_query_log = SlowQueryLog()
+
+def _regressed(before: Optional[float], after: Optional[float]) -> bool:
+    if before is None or after is None:
+        return False
+    return after - before >= REGRESSION_MIN_DELTA_MS and after >= before * SLOW_QUERY_REGRESSION_RATIO
+
+async def compare_versions(conn, metric_id, days: int = 30) -> Dict[str, Any]:
+    """Latency and plan shapes per metric version, with regressions flagged.
+
+    A regression between consecutive versions points at the SQL change.
+    Within a version, the later half of runs being slower than the earlier
+    half points at data growth when the plan stayed the same, or at the
+    planner switching strategy when more than one plan shape was captured.
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    latency = await conn.fetch(VERSION_LATENCY_SQL, metric_id, since, slow_query_log.threshold_ms or None)
+    plans: Dict[int, List[Dict[str, Any]]] = {}
+    for row in await conn.fetch(VERSION_PLANS_SQL, metric_id, since):
+        plans.setdefault(row['version'], []).append({
+            "shape": row['plan_shape'],
+            "captures": row['captures'],
+            "latest_result_id": row['result_id'],
+            "latest_run_at": row['created_at'],
+            "latest_execution_time_ms": row['execution_time_ms'],
+        })
+
+    versions = []
+    for row in latency:
+        versions.append({
+            "version": row['version'],
+            "runs": row['runs'],
+            "slow_runs": row['slow_runs'],
+            "p50_ms": row['p50_ms'],
+            "p95_ms": row['p95_ms'],
+            "early_p50_ms": row['early_p50_ms'],
+            "recent_p50_ms": row['recent_p50_ms'],
+            "first_run": row['first_run'],
+            "last_run": row['last_run'],
+            "plans": plans.get(row['version'], []),
+        })
+
+    regressions = []
+    for before, after in zip(versions, versions[1:]):
+        if _regressed(before['p50_ms'], after['p50_ms']):
+            before_shapes = {p['shape'] for p in before['plans']}
+            after_shapes = {p['shape'] for p in after['plans']}
+            regressions.append({
+                "cause": "sql_change",
+                "from_version": before['version'],
+                "to_version": after['version'],
+                "p50_ratio": round(after['p50_ms'] / max(before['p50_ms'], 1), 2),
+                # Unknown unless both versions had a slow run captured
+                "plan_changed": before_shapes != after_shapes if before_shapes and after_shapes else None,
+            })
+    for version in versions:
+        if version['runs'] >= 4 and _regressed(version['early_p50_ms'], version['recent_p50_ms']):
+            regressions.append({
+                "cause": "plan_change" if len(version['plans']) > 1 else "data_growth",
+                "version": version['version'],
+                "p50_ratio": round(version['recent_p50_ms'] / max(version['early_p50_ms'], 1), 2),
+            })
+
+    return {
+        "metric_id": str(metric_id),
+        "threshold_ms": slow_query_log.threshold_ms,
+        "since": since,
+        "versions": versions,
+        "regressions": regressions,
+    }
+
+async def recent_slow_runs(conn, limit: int = 50) -> List[Dict[str, Any]]:
+    """The latest runs that had a plan captured, across all metrics"""
+    rows = await conn.fetch("""
+        SELECT r.id AS result_id, r.metric_id, m.name, r.metric_version AS version, r.execution_time_ms,
+               r.created_at, r.plan_shape, r.query_plan
+        FROM metric_results r
+        JOIN metrics m ON m.id = r.metric_id
+        WHERE r.query_plan IS NOT NULL
+        ORDER BY r.created_at DESC
+        LIMIT $1
+    """, limit)
+    return [dict(row) for row in rows]
@@ -0,0 +1,45 @@
+import re
+
+# Quoted literals and identifiers are kept verbatim; everything else is normalized
+_TOKEN = re.compile(r"""
+    (?P<literal>'(?:[^']|'')*') |
+    (?P<ident>"(?:[^"]|"")*") |
+    (?P<line_comment>--[^\n]*) |
+    (?P<block_comment>/\*.*?\*/) |
+    (?P<space>\s+) |
+    (?P<other>[^'"\s/-]+|[/-])
+""", re.VERBOSE | re.DOTALL)
+
+def normalize_sql(sql: str) -> str:
+    """Canonical form of a query for comparing and keying: no comments, single spaces,
+    lower-cased outside of quotes and no trailing semicolons"""
+    parts = []
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("line_comment", "block_comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "other":
+            parts.append(match.group().lower())
+        else:
+            parts.append(match.group())
+    return "".join(parts).strip().rstrip(";").strip()
+
+_NUMBER = re.compile(r"(?<![\w$.])\d+(?:\.\d+)?(?![\w.])")
+
+def fingerprint_sql(sql: str) -> str:
+    """normalize_sql with string and numeric literals replaced by ?, so queries
+    differing only in inlined values group together"""
+    parts = []
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("line_comment", "block_comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "literal":
+            parts.append("?")
+        elif kind == "other":
+            parts.append(_NUMBER.sub("?", match.group().lower()))
+        else:
+            parts.append(match.group())
+    return "".join(parts).strip().rstrip(";").strip()
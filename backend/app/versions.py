@@ -0,0 +1,62 @@
+import os
+import hashlib
+from typing import Optional, Dict, Any, List
+
+from .sql_utils import normalize_sql
+
+# A stored result of an already-seen SQL hash is served instead of executing, up to this old; 0 disables
+METRIC_RESULT_REUSE_SECONDS = int(os.getenv("METRIC_RESULT_REUSE_SECONDS", "3600"))
+
+STORED_RESULT_SQL = """
+    SELECT r.id, r.result_data, r.created_at, v.metric_id, v.version
+    FROM metric_versions v
+    JOIN metric_results r ON r.metric_id = v.metric_id AND r.metric_version = v.version
+    WHERE v.sql_hash = $1 AND v.dataset_id IS NOT DISTINCT FROM $2
+      AND r.status = 'success' AND NOT r.cached AND r.created_at >= CURRENT_TIMESTAMP - $3 * interval '1 second'
+    ORDER BY r.created_at DESC
+    LIMIT 1
+"""
+
+VERSIONS_SQL = """
+    SELECT v.version, v.sql_query, v.sql_hash, v.dataset_id, v.created_at,
+           COUNT(r.id) AS runs, MAX(r.created_at) AS last_run
+    FROM metric_versions v
+    LEFT JOIN metric_results r ON r.metric_id = v.metric_id AND r.metric_version = v.version
+    WHERE v.metric_id = $1
+    GROUP BY v.metric_id, v.version
+    ORDER BY v.version DESC
+"""
+
+def sql_hash(sql: str) -> str:
+    """Identity of a metric definition's SQL; formatting, comments and keyword case don't change it"""
+    return hashlib.sha256(normalize_sql(sql).encode()).hexdigest()
+
+async def record_version(conn, metric_id, version: int, sql: str, dataset_id: Any = None):
+    """Append a version to a metric's history; versions are never rewritten"""
+    await conn.execute("""
+        INSERT INTO metric_versions (metric_id, version, sql_query, sql_hash, dataset_id)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (metric_id, version) DO NOTHING
+    """, metric_id, version, sql, sql_hash(sql), dataset_id)
+
+async def backfill_versions(conn):
+    """Record the current definition of metrics created before version history existed"""
+    rows = await conn.fetch("""
+        SELECT m.id, m.version, m.sql_query, m.dataset_id
+        FROM metrics m
+        WHERE NOT EXISTS (SELECT 1 FROM metric_versions v WHERE v.metric_id = m.id AND v.version = m.version)
+    """)
+    for row in rows:
+        await record_version(conn, row['id'], row['version'], row['sql_query'], row['dataset_id'])
+
+async def find_stored_result(conn, sql: str, dataset_id: Any = None,
+                             max_age_seconds: int = METRIC_RESULT_REUSE_SECONDS) -> Optional[Dict[str, Any]]:
+    """The newest successful result of any metric version with the same SQL hash and dataset"""
+    if max_age_seconds <= 0:
+        return None
+    row = await conn.fetchrow(STORED_RESULT_SQL, sql_hash(sql), dataset_id, max_age_seconds)
+    return dict(row) if row else None
+
+async def list_versions(conn, metric_id) -> List[Dict[str, Any]]:
+    """A metric's versions, newest first, with how often and how recently each ran"""
+    return [dict(row) for row in await conn.fetch(VERSIONS_SQL, metric_id)]
@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Share of each pool a class may hold at once; what lower classes can't take stays free for interactive work
+WORKLOAD_RUNS_SHARE = float(os.getenv("WORKLOAD_RUNS_SHARE", "0.75"))
+WORKLOAD_BATCH_SHARE = float(os.getenv("WORKLOAD_BATCH_SHARE", "0.5"))
+# Requests allowed to wait for a slot, per class and pool; beyond that new ones are rejected at once
+WORKLOAD_INTERACTIVE_MAX_QUEUE = int(os.getenv("WORKLOAD_INTERACTIVE_MAX_QUEUE", "200"))
+WORKLOAD_RUNS_MAX_QUEUE = int(os.getenv("WORKLOAD_RUNS_MAX_QUEUE", "50"))
+WORKLOAD_BATCH_MAX_QUEUE = int(os.getenv("WORKLOAD_BATCH_MAX_QUEUE", "500"))
+# Longest a request waits for a slot before it is rejected
+WORKLOAD_INTERACTIVE_QUEUE_TIMEOUT_MS = int(os.getenv("WORKLOAD_INTERACTIVE_QUEUE_TIMEOUT_MS", "2000"))
+WORKLOAD_RUNS_QUEUE_TIMEOUT_MS = int(os.getenv("WORKLOAD_RUNS_QUEUE_TIMEOUT_MS", "10000"))
+WORKLOAD_BATCH_QUEUE_TIMEOUT_MS = int(os.getenv("WORKLOAD_BATCH_QUEUE_TIMEOUT_MS", "120000"))
+
+# Bounds of the Retry-After estimate, in seconds
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+class WorkloadClass:
+    """A kind of work with its own priority, capacity share, queue limit and queue timeout"""
+
+    def __init__(self, name: str, priority: int, share: float, max_queue: int, queue_timeout_ms: int):
+        self.name = name
+        # Lower is served first when a slot frees up
+        self.priority = priority
+        self.share = share
+        self.max_queue = max_queue
+        self.queue_timeout_ms = queue_timeout_ms
+
+WORKLOAD_CLASSES: Dict[str, WorkloadClass] = {
+    # API reads and writes, dashboard, charts and chat: someone is waiting on the page
+    "interactive": WorkloadClass("interactive", 0, 1.0, WORKLOAD_INTERACTIVE_MAX_QUEUE,
+                                 WORKLOAD_INTERACTIVE_QUEUE_TIMEOUT_MS),
+    # On-demand metric runs: user-initiated, but arbitrary SQL that may run for a while
+    "runs": WorkloadClass("runs", 1, WORKLOAD_RUNS_SHARE, WORKLOAD_RUNS_MAX_QUEUE, WORKLOAD_RUNS_QUEUE_TIMEOUT_MS),
+    # Batch runs, the scheduler, plan capture and background maintenance
+    "batch": WorkloadClass("batch", 2, WORKLOAD_BATCH_SHARE, WORKLOAD_BATCH_MAX_QUEUE,
+                           WORKLOAD_BATCH_QUEUE_TIMEOUT_MS),
+}
+
+# Class of the work running in the current task; copied into tasks it starts
+current_workload: contextvars.ContextVar[str] = contextvars.ContextVar("workload", default="interactive")
+
+class WorkloadSaturated(Exception):
+    """Raised when a workload class has no free slot and can't queue for one; served as 503"""
+
+    def __init__(self, pool: str, workload: str, reason: str, retry_after: int):
+        super().__init__(f"The {pool} pool is saturated for {workload} work ({reason}); retry in {retry_after}s")
+        self.pool = pool
+        self.workload = workload
+        self.reason = reason
+        self.retry_after = retry_after
+
+def workload(name: str):
+    """Route dependency that runs the request, and the tasks it starts, as the given class"""
+    if name not in WORKLOAD_CLASSES:
+        raise ValueError(f"Unknown workload class: {name}")
+
+    # Must be async: sync dependencies run in a thread whose context is discarded
+    async def set_workload():
+        current_workload.set(name)
+    return set_workload
+
+class AdmissionController:
+    """Admits work into a fixed number of slots by workload class.
+
+    Each class, together with the classes below it, may hold at most its
+    share of the slots, so the rest stays reserved for the classes above:
+    with the defaults, runs and batch work never take the last quarter of
+    a pool, and batch work alone never more than half. When a slot
+    frees up, waiters are served by class priority, then first come first
+    served. A class whose queue is full, or whose waiter times out, gets
+    WorkloadSaturated with a Retry-After estimate from recent hold times.
+    """
+
+    def __init__(self, capacity: int, name: str, classes: Dict[str, WorkloadClass] = WORKLOAD_CLASSES):
+        self.capacity = capacity
+        self.name = name
+        self.classes = classes
+        self.limits = {c.name: max(1, min(capacity, int(capacity * c.share))) for c in classes.values()}
+        self.in_use = {c.name: 0 for c in classes.values()}
+        self.rejected = {(c.name, reason): 0 for c in classes.values() for reason in ("queue_full", "timeout")}
+        self._waiters: Dict[str, List[asyncio.Future]] = {c.name: [] for c in classes.values()}
+        self._by_priority = sorted(classes.values(), key=lambda c: c.priority)
+        # Moving average of how long each class holds a slot, for Retry-After
+        self._hold_seconds = {c.name: 0.1 for c in classes.values()}
+
+    def queued(self, workload: str) -> int:
+        return len(self._waiters[workload])
+
+    def _held_from(self, priority: int) -> int:
+        return sum(self.in_use[c.name] for c in self._by_priority if c.priority >= priority)
+
+    def _can_take(self, workload: str) -> bool:
+        # A class's limit covers it and every class below it, so the rest stays reserved for the ones above
+        priority = self.classes[workload].priority
+        return all(self._held_from(c.priority) < self.limits[c.name]
+                   for c in self._by_priority if c.priority <= priority)
+
+    def _retry_after(self, workload: str) -> int:
+        # Time for the slots this class may use to turn over once for everyone ahead of the caller
+        turns = (self.queued(workload) + 1) / self.limits[workload]
+        estimate = math.ceil(self._hold_seconds[workload] * turns)
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, estimate))
+
+    def _reject(self, workload: str, reason: str):
+        self.rejected[(workload, reason)] += 1
+        return WorkloadSaturated(self.name, workload, reason, self._retry_after(workload))
+
+    def _wake(self):
+        for c in self._by_priority:
+            waiters = self._waiters[c.name]
+            while waiters and self._can_take(c.name):
+                waiter = waiters.pop(0)
+                if not waiter.done():
+                    self.in_use[c.name] += 1
+                    waiter.set_result(None)
+
+    async def acquire(self, workload: Optional[str] = None) -> Tuple[str, float]:
+        """Take a slot for the class (the current task's by default); returns what release() needs"""
+        workload = workload or current_workload.get()
+        cls = self.classes[workload]
+        # Waiters of higher or equal priority go first, so don't jump ahead of them
+        ahead = any(self._waiters[c.name] for c in self._by_priority if c.priority <= cls.priority)
+        if not ahead and self._can_take(workload):
+            self.in_use[workload] += 1
+            return workload, time.monotonic()
+        if self.queued(workload) >= cls.max_queue:
+            raise self._reject(workload, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[workload].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), cls.queue_timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters[workload]:
+                self._waiters[workload].remove(waiter)
+                raise self._reject(workload, "timeout")
+            # Granted just as the wait timed out; keep the slot
+        except BaseException:
+            if waiter in self._waiters[workload]:
+                self._waiters[workload].remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Granted, but the caller went away before using it
+                self.in_use[workload] -= 1
+                self._wake()
+            raise
+        return workload, time.monotonic()
+
+    def release(self, token: Tuple[str, float]):
+        workload, started = token
+        self.in_use[workload] -= 1
+        self._hold_seconds[workload] = 0.8 * self._hold_seconds[workload] + 0.2 * (time.monotonic() - started)
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(self, workload: Optional[str] = None):
+        token = await self.acquire(workload)
+        try:
+            yield
+        finally:
+            self.release(token)
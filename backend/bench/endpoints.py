@@ -0,0 +1,273 @@
+"""Endpoint benchmark suite for the AnalyticsOS API.
+
+Seeds a local Postgres at each requested scale factor, drives the API
+in-process with a closed-loop load generator and writes a JSON baseline.
+
+Usage (from the backend directory, with DATABASE_URL pointing at a
+disposable database):
+
+    python -m bench.endpoints --sizes 0.1,1 --concurrency 1,16 --duration 10 --output baseline.json
+    python -m bench.endpoints --sizes 0.1,1 --concurrency 1,16 --compare baseline.json
+
+Each endpoint is measured warm (caches kept across requests, as in steady
+state) and cold (query and chat answer caches cleared before every request
+and metric runs forced to re-execute); --cache limits it to one mode.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import asyncpg
+import httpx
+
+from app.main import app
+from app.cache import query_cache
+from app.routers.chat import answer_cache
+from app.database import DATABASE_URL, db_manager
+from app.seed import generate_sample_data, counts_for_scale
+
+BENCH_METRIC_SQL = """
+    SELECT COUNT(*) FROM orders
+    WHERE status = 'completed' AND created_at >= CURRENT_DATE - INTERVAL '30 days'
+"""
+
+CACHE_MODES = ("warm", "cold")
+
+def endpoint_requests(metric_id: str, cold: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Requests issued per endpoint, keyed by a stable name used in reports"""
+    return {
+        "dashboard": {"method": "GET", "url": "/api/metrics/dashboard"},
+        "charts": {"method": "GET", "url": "/api/metrics/charts"},
+        # refresh skips both the query cache and stored results with the same SQL
+        "metric_run": {"method": "POST", "url": f"/api/metrics/{metric_id}/run",
+                       "params": {"refresh": "true"} if cold else None},
+        "chat": {"method": "POST", "url": "/api/chat/", "json": {"message": "Show me revenue trends"}},
+        "datasets": {"method": "GET", "url": "/api/datasets/"},
+    }
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(values_ms: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values_ms)
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+class TimedPool:
+    """Wraps the API's asyncpg pool to record how long each acquire waits"""
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+        # (started, wait in ms) for every acquire
+        self.waits: List[Tuple[float, float]] = []
+
+    def acquire(self, *, timeout: Optional[float] = None):
+        return _TimedAcquire(self, timeout)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+class _TimedAcquire:
+    def __init__(self, timed_pool: TimedPool, timeout: Optional[float]):
+        self.timed_pool = timed_pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self.conn = await self.timed_pool._pool.acquire(timeout=self.timeout)
+        self.timed_pool.waits.append((started, (time.perf_counter() - started) * 1000))
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        await self.timed_pool._pool.release(self.conn)
+
+def clear_caches():
+    query_cache.clear()
+    answer_cache.clear()
+
+async def run_load(client: httpx.AsyncClient, request: Dict[str, Any], concurrency: int,
+                   duration: float, warmup: float, cold: bool = False) -> Dict[str, Any]:
+    """Closed-loop load: `concurrency` workers issue requests back to back.
+
+    When cold, the caches are cleared before every request, so each one
+    measures the uncached path.
+    """
+    latencies: List[float] = []
+    errors = 0
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    pool = db_manager.pool
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            if cold:
+                clear_caches()
+            started = time.perf_counter()
+            response = await client.request(request["method"], request["url"],
+                                            params=request.get("params"), json=request.get("json"))
+            if started >= measure_from:
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    errors += 1
+            # Requests that never wait on I/O would otherwise starve the other workers
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - measure_from
+    waits = [wait for at, wait in pool.waits if at >= measure_from]
+    pool.waits.clear()
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize(latencies),
+        "pool_wait_ms": summarize(waits),
+        "pool_acquires": len(waits),
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], max_regression: float) -> List[str]:
+    """Return descriptions of p95 regressions beyond the allowed ratio"""
+    def key(r):
+        # Baselines from before cold runs only measured warm caches
+        return (r["scale"], r["concurrency"], r["endpoint"], r.get("cache", "warm"))
+
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(key(result))
+        if not before:
+            continue
+        old_p95, new_p95 = before["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        if not old_p95 or new_p95 is None:
+            continue
+        change = (new_p95 - old_p95) / old_p95
+        line = (f"scale={result['scale']} c={result['concurrency']} {result['endpoint']} "
+                f"({result.get('cache', 'warm')}): "
+                f"p95 {old_p95:.1f} -> {new_p95:.1f} ms ({change:+.0%})")
+        print(line)
+        if change > max_regression:
+            regressions.append(line)
+    return regressions
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark AnalyticsOS API endpoints")
+    parser.add_argument("--sizes", default="0.1,1", help="comma-separated seed scale factors")
+    parser.add_argument("--concurrency", default="1,16", help="comma-separated concurrency levels")
+    parser.add_argument("--endpoints", default=None, help="comma-separated subset of endpoints")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds per run")
+    parser.add_argument("--cache", choices=CACHE_MODES + ("both",), default="both",
+                        help="measure with warm caches, cold caches or both")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON to compare p95 latency against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95 increase before --compare fails (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [float(s) for s in args.sizes.split(",")]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    modes = CACHE_MODES if args.cache == "both" else (args.cache,)
+
+    for handler in app.router.on_startup:
+        await handler()
+    db_manager.pool = TimedPool(db_manager.pool)
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        server_version = await conn.fetchval("SHOW server_version")
+        metric_id = await conn.fetchval("""
+            INSERT INTO metrics (name, description, sql_query, category, status)
+            VALUES ('Benchmark: completed orders (30d)', 'Created by bench.endpoints', $1, 'benchmark', 'active')
+            RETURNING id
+        """, BENCH_METRIC_SQL)
+        names = args.endpoints.split(",") if args.endpoints else list(endpoint_requests(str(metric_id)))
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "postgres": server_version,
+                "pool_max_size": db_manager.pool.get_max_size(),
+                "duration_s": args.duration,
+            },
+            "results": [],
+        }
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scale in sizes:
+                counts = counts_for_scale(scale)
+                print(f"Seeding scale {scale}: {counts}", file=sys.stderr)
+                await generate_sample_data(conn, seed=args.seed, days=365, **counts)
+                # Results cached at the previous scale describe different data
+                clear_caches()
+                for concurrency in levels:
+                    for mode in modes:
+                        cold = mode == "cold"
+                        requests = endpoint_requests(str(metric_id), cold=cold)
+                        for name in names:
+                            result = await run_load(client, requests[name], concurrency,
+                                                    args.duration, args.warmup, cold=cold)
+                            result.update({"endpoint": name, "cache": mode, "scale": scale,
+                                           "concurrency": concurrency, **counts})
+                            report["results"].append(result)
+                            latency = result["latency_ms"]
+                            print(f"scale={scale} c={concurrency} {name} ({mode}): {result['throughput_rps']} req/s "
+                                  f"p50={latency['p50'] or 0:.1f} p95={latency['p95'] or 0:.1f} "
+                                  f"p99={latency['p99'] or 0:.1f} ms "
+                                  f"pool_wait_p95={result['pool_wait_ms']['p95'] or 0:.1f} ms "
+                                  f"errors={result['errors']}", file=sys.stderr)
+
+        await conn.execute("DELETE FROM metrics WHERE id = $1", metric_id)
+    finally:
+        await conn.close()
+        for handler in app.router.on_shutdown:
+            await handler()
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} endpoint(s) regressed beyond {args.max_regression:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,164 @@
+"""Serialization CPU benchmark for the AnalyticsOS API.
+
+Compares per-request CPU time of the previous response path (Records to
+dicts, response_model validation, stdlib json) with the fast path
+(Records encoded straight to bytes with orjson), for the metrics and
+datasets list endpoints and for metric result payloads written to JSONB.
+
+Rows are fetched once from Postgres with the same column types the real
+endpoints return, so only serialization is measured. Each case runs
+in-process through a FastAPI app with one route per path.
+
+Usage (from the backend directory):
+
+    python -m bench.serialization --rows 100,1000 --requests 200 --output serialization.json
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime
+from typing import Dict, Any, List, Callable
+
+import asyncpg
+import httpx
+from fastapi import FastAPI
+
+from app.database import DATABASE_URL
+from app.executor import MetricRunResult
+from app.routers.datasets import DatasetResponse
+from app.routers.metrics import MetricResponse
+from app.serialization import FastJSONResponse, records_response, dumps
+from bench.endpoints import git_commit
+
+METRIC_ROWS_SQL = """
+    SELECT gen_random_uuid() AS id, 'Metric ' || g AS name, 'Benchmark metric number ' || g AS description,
+           'SELECT COUNT(*) FROM orders WHERE status = ''completed''' AS sql_query,
+           (ARRAY['revenue', 'orders', 'customers'])[1 + g % 3] AS category, 1 + g % 5 AS version,
+           'active' AS status, now()::timestamp - g * interval '1 hour' AS created_at,
+           now()::timestamp AS last_run, NULL::uuid AS dataset_id, 3600 AS refresh_interval_seconds
+    FROM generate_series(1, $1) g
+"""
+
+DATASET_ROWS_SQL = """
+    SELECT gen_random_uuid() AS id, 'Warehouse ' || g AS name, 'postgresql' AS type,
+           'db' || g || '.internal' AS host, 5432 AS port, 'analytics' AS database,
+           'connected' AS status, g % 40 AS tables_count, now()::timestamp - g * interval '1 day' AS created_at
+    FROM generate_series(1, $1) g
+"""
+
+RESULT_ROWS_SQL = """
+    SELECT g AS id, now() - g * interval '1 minute' AS ts, (g * 1.5)::numeric AS amount, md5(g::text) AS label
+    FROM generate_series(1, $1) g
+"""
+
+def build_app(metric_rows: List[asyncpg.Record], dataset_rows: List[asyncpg.Record]) -> FastAPI:
+    """One route per (endpoint, path); "before" routes reproduce the previous handlers exactly"""
+    before = FastAPI()
+    after = FastAPI(default_response_class=FastJSONResponse)
+
+    @before.get("/metrics", response_model=List[MetricResponse])
+    async def metrics_before():
+        return [dict(row) for row in metric_rows]
+
+    @after.get("/metrics", response_model=List[MetricResponse])
+    async def metrics_after():
+        return records_response(metric_rows)
+
+    @before.get("/datasets", response_model=List[DatasetResponse])
+    async def datasets_before():
+        return [dict(row) for row in dataset_rows]
+
+    @after.get("/datasets", response_model=List[DatasetResponse])
+    async def datasets_after():
+        return records_response(dataset_rows)
+
+    app = FastAPI()
+    app.mount("/before", before)
+    app.mount("/after", after)
+    return app
+
+async def cpu_per_request(client: httpx.AsyncClient, url: str, requests: int) -> Dict[str, Any]:
+    """Process CPU time per request, in microseconds, after a short warmup"""
+    for _ in range(min(20, requests)):
+        await client.get(url)
+    size = len((await client.get(url)).content)
+    started = time.process_time()
+    for _ in range(requests):
+        await client.get(url)
+    cpu_us = (time.process_time() - started) / requests * 1e6
+    return {"cpu_us": round(cpu_us, 1), "bytes": size}
+
+def cpu_per_call(fn: Callable[[], Any], calls: int) -> float:
+    for _ in range(min(20, calls)):
+        fn()
+    started = time.process_time()
+    for _ in range(calls):
+        fn()
+    return round((time.process_time() - started) / calls * 1e6, 1)
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark response serialization CPU cost")
+    parser.add_argument("--rows", default="100,1000", help="comma-separated row counts per response")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per case")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "requests": args.requests,
+        },
+        "results": [],
+    }
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        for rows in [int(r) for r in args.rows.split(",")]:
+            metric_rows = await conn.fetch(METRIC_ROWS_SQL, rows)
+            dataset_rows = await conn.fetch(DATASET_ROWS_SQL, rows)
+            app = build_app(metric_rows, dataset_rows)
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for endpoint in ("metrics", "datasets"):
+                    old = await cpu_per_request(client, f"/before/{endpoint}", args.requests)
+                    new = await cpu_per_request(client, f"/after/{endpoint}", args.requests)
+                    report["results"].append({"case": f"{endpoint}_list", "rows": rows, "before": old, "after": new,
+                                              "speedup": round(old["cpu_us"] / new["cpu_us"], 2)})
+
+            # Metric result payloads: json.dumps into a text parameter before, the orjson JSONB codec after
+            result_rows = await conn.fetch(RESULT_ROWS_SQL, rows)
+            result = MetricRunResult(
+                type="table",
+                columns=[{"name": a, "type": "text"} for a in ("id", "ts", "amount", "label")],
+                rows=[[r['id'], r['ts'].isoformat(), float(r['amount']), r['label']] for r in result_rows],
+                row_count=rows, execution_time_ms=0,
+            )
+            payload = result.model_dump()
+            old_us = cpu_per_call(lambda: json.dumps(payload), args.requests)
+            new_us = cpu_per_call(lambda: dumps(payload).decode(), args.requests)
+            report["results"].append({"case": "result_payload", "rows": rows,
+                                      "before": {"cpu_us": old_us}, "after": {"cpu_us": new_us},
+                                      "speedup": round(old_us / new_us, 2)})
+    finally:
+        await conn.close()
+
+    for result in report["results"]:
+        print(f"{result['case']} rows={result['rows']}: {result['before']['cpu_us']:.0f} -> "
+              f"{result['after']['cpu_us']:.0f} us CPU per request ({result['speedup']}x)", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
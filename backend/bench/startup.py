@@ -0,0 +1,100 @@
+"""Cold-start benchmark for the AnalyticsOS API.
+
+Starts a fresh uvicorn process per run and measures the time from spawn
+until /health answers, which is when a replica can take traffic. The
+in-process share (connect, migrations and pool warmup, ready) is read from
+the startup timings /health reports. Fails if the median exceeds the target.
+
+Usage (from the backend directory):
+
+    python -m bench.startup --runs 10 --target-ms 1000 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from typing import Dict, Any
+
+import httpx
+
+from bench.endpoints import git_commit, summarize
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def cold_start(timeout: float) -> Dict[str, Any]:
+    """Spawn one server process and poll /health until it answers"""
+    port = free_port()
+    env = dict(os.environ, SCHEDULER_ENABLED=os.getenv("SCHEDULER_ENABLED", "false"))
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while time.perf_counter() - started < timeout:
+                try:
+                    response = client.get("/health", timeout=1.0)
+                    if response.status_code == 200:
+                        return {
+                            "ready_ms": round((time.perf_counter() - started) * 1000, 1),
+                            "startup": response.json().get("startup", {}),
+                        }
+                except httpx.TransportError:
+                    pass
+                if process.poll() is not None:
+                    raise RuntimeError(f"server exited with code {process.returncode} before becoming ready")
+                time.sleep(0.005)
+        raise RuntimeError(f"server not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark API cold-start time")
+    parser.add_argument("--runs", type=int, default=10, help="server processes to start")
+    parser.add_argument("--target-ms", type=float, default=1000.0,
+                        help="fail if the median time to ready exceeds this")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each start")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    runs = [cold_start(args.timeout) for _ in range(args.runs)]
+    ready = summarize([run["ready_ms"] for run in runs])
+    in_process = summarize([run["startup"].get("ready_ms", 0) for run in runs])
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "runs": args.runs,
+            "target_ms": args.target_ms,
+        },
+        "time_to_ready_ms": ready,
+        "in_process_startup_ms": in_process,
+        "runs": runs,
+    }
+    passed = ready["p50"] <= args.target_ms
+    print(f"time to ready: p50 {ready['p50']:.0f} ms, max {ready['max']:.0f} ms "
+          f"(in-process p50 {in_process['p50']:.0f} ms); target {args.target_ms:.0f} ms: "
+          f"{'ok' if passed else 'FAILED'}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
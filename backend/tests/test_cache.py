@@ -0,0 +1,112 @@
+import asyncio
+
+from app.cache import QueryCache
+
+class Counter:
+    """A compute function that counts its calls and returns the call number"""
+
+    def __init__(self, value=None):
+        self.calls = 0
+        self.value = value
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.value if self.value is not None else self.calls
+
+def test_hit_within_ttl():
+    async def run():
+        cache, compute = QueryCache(), Counter()
+        assert await cache.get(None, "SELECT 1", (), 1, compute) == 1
+        assert await cache.get(None, "select  1;", (), 1, compute) == 1
+        return cache, compute
+    cache, compute = asyncio.run(run())
+    assert compute.calls == 1
+    assert cache.counters["hits"] == 1 and cache.counters["misses"] == 1
+
+def test_key_includes_dataset_and_params():
+    async def run():
+        cache, compute = QueryCache(), Counter()
+        await cache.get(None, "SELECT $1", (1,), None, compute)
+        await cache.get(None, "SELECT $1", (2,), None, compute)
+        await cache.get("dataset", "SELECT $1", (1,), None, compute)
+        return compute
+    assert asyncio.run(run()).calls == 3
+
+def test_changed_watermark_is_a_miss():
+    async def run():
+        cache, compute = QueryCache(), Counter()
+        await cache.get(None, "SELECT 1", (), 1, compute)
+        return await cache.get(None, "SELECT 1", (), 2, compute)
+    assert asyncio.run(run()) == 2
+
+def test_concurrent_misses_compute_once():
+    async def run():
+        cache, compute = QueryCache(), Counter()
+        results = await asyncio.gather(*(cache.get(None, "SELECT 1", (), None, compute) for _ in range(5)))
+        return results, compute
+    results, compute = asyncio.run(run())
+    assert results == [1] * 5
+    assert compute.calls == 1
+
+def test_stale_entry_is_served_while_revalidating():
+    async def run():
+        cache, compute = QueryCache(ttl_seconds=0, stale_seconds=60), Counter()
+        await cache.get(None, "SELECT 1", (), None, compute)
+        stale = await cache.get(None, "SELECT 1", (), None, compute)
+        await asyncio.gather(*cache._revalidating)
+        return cache, stale, cache._entries[next(iter(cache._entries))].value
+    cache, stale, refreshed = asyncio.run(run())
+    assert stale == 1
+    assert refreshed == 2
+    assert cache.counters["stale_hits"] == 1
+
+def test_stale_entry_with_changed_watermark_is_a_miss():
+    async def run():
+        cache, compute = QueryCache(ttl_seconds=0, stale_seconds=60), Counter()
+        await cache.get(None, "SELECT 1", (), 1, compute)
+        return cache, await cache.get(None, "SELECT 1", (), 2, compute)
+    cache, value = asyncio.run(run())
+    assert value == 2
+    assert cache.counters["stale_hits"] == 0
+
+def test_expired_entry_is_a_miss():
+    async def run():
+        cache, compute = QueryCache(ttl_seconds=0, stale_seconds=0), Counter()
+        await cache.get(None, "SELECT 1", (), None, compute)
+        return await cache.get(None, "SELECT 1", (), None, compute)
+    assert asyncio.run(run()) == 2
+
+def test_evicts_least_recently_used_over_byte_budget():
+    # Each value serializes to 10 bytes, so three fit
+    value = "x" * 8
+    async def run():
+        cache = QueryCache(max_bytes=30)
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3"):
+            await cache.get(None, sql, (), None, Counter(value))
+        await cache.get(None, "SELECT 1", (), None, Counter(value))
+        await cache.get(None, "SELECT 4", (), None, Counter(value))
+        return cache
+    cache = asyncio.run(run())
+    assert [key[1] for key in cache._entries] == ["select 3", "select 1", "select 4"]
+    assert cache.stats()["bytes"] == 30
+    assert cache.counters["evictions"] == 1
+
+def test_oversized_result_is_returned_but_not_kept():
+    async def run():
+        cache = QueryCache(max_bytes=5)
+        return cache, await cache.get(None, "SELECT 1", (), None, Counter("too large"))
+    cache, value = asyncio.run(run())
+    assert value == "too large"
+    assert cache.stats()["entries"] == 0
+
+def test_invalidate_drops_every_parameter_set():
+    async def run():
+        cache, compute = QueryCache(), Counter()
+        await cache.get(None, "SELECT $1", (1,), None, compute)
+        await cache.get(None, "SELECT $1", (2,), None, compute)
+        await cache.get("dataset", "SELECT $1", (1,), None, compute)
+        return cache
+    cache = asyncio.run(run())
+    assert cache.invalidate("select $1") == 2
+    assert cache.stats()["entries"] == 1
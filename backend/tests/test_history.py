@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta
+
+from app.history import choose_resolution
+
+NOW = datetime(2026, 6, 1)
+
+def test_short_recent_range_reads_raw_points():
+    assert choose_resolution(NOW - timedelta(hours=1), NOW, 60, now=NOW) == ("raw", timedelta(seconds=60))
+
+def test_bucket_width_is_at_least_one_second():
+    assert choose_resolution(NOW - timedelta(seconds=10), NOW, 500, now=NOW) == ("raw", timedelta(seconds=1))
+
+def test_wide_buckets_read_hourly_rollups():
+    assert choose_resolution(NOW - timedelta(days=7), NOW, 50, now=NOW) == ("hour", timedelta(hours=4))
+
+def test_ranges_past_raw_retention_read_hourly_rollups():
+    start = NOW - timedelta(days=60)
+    assert choose_resolution(start, start + timedelta(hours=1), 60, now=NOW) == ("hour", timedelta(hours=1))
+
+def test_long_ranges_read_daily_rollups():
+    assert choose_resolution(NOW - timedelta(days=365), NOW, 100, now=NOW) == ("day", timedelta(days=4))
+    start = NOW - timedelta(days=500)
+    assert choose_resolution(start, start + timedelta(days=1), 24, now=NOW) == ("day", timedelta(days=1))
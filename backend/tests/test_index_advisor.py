@@ -0,0 +1,25 @@
+from app.index_advisor import AdvisedQuery, Candidate
+
+def candidate(*queries):
+    result = Candidate("orders", "user_id")
+    for label, observed_ms, cost, indexed_cost in queries:
+        query = AdvisedQuery(label, "SELECT 1", observed_ms=observed_ms)
+        query.cost = cost
+        result.queries.append(query)
+        result.estimated_costs[label] = indexed_cost
+    return result
+
+def test_speedup_is_weighted_by_observed_runtime():
+    # 100ms -> 10ms and 10ms -> 5ms
+    assert candidate(("a", 100, 1000, 100), ("b", 10, 200, 100)).estimated_speedup == 110 / 15
+
+def test_speedup_falls_back_to_planner_costs_without_runtimes():
+    assert candidate(("a", 0, 1000, 100), ("b", None, 200, 100)).estimated_speedup == 1200 / 200
+
+def test_speedup_is_unknown_without_estimates():
+    assert candidate().estimated_speedup is None
+
+def test_saving_skips_queries_without_estimates():
+    result = candidate(("a", 100, 1000, 100))
+    result.queries.append(AdvisedQuery("b", "SELECT 1", observed_ms=50))
+    assert result.estimated_saving_ms == 90
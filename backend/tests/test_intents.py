@@ -0,0 +1,43 @@
+import pytest
+
+from app.intents import CHAT_INTENTS, IntentIndex, Intent, intent_index, normalize_question
+
+@pytest.mark.parametrize("question, intent", [
+    ("Show me revenue trends", "revenue"),
+    ("How were sales last month?", "revenue"),
+    ("Show me order status breakdown", "orders"),
+    ("How many orders did we get?", "orders"),
+    ("List recent transactions", "orders"),
+    ("How many active customers do I have?", "customers"),
+    ("What are my top products?", "products"),
+    ("Calculate average order value", "aov"),
+    ("What is the order value?", "aov"),
+    ("AOV please", "aov"),
+    ("Average order value of completed orders", "aov"),
+    ("What can you do?", "help"),
+    ("Tell me a joke", None),
+])
+def test_question_maps_to_intent(question, intent):
+    matched = intent_index.match(question)
+    assert (matched.name if matched else None) == intent
+
+def test_longest_phrase_beats_declaration_order():
+    index = IntentIndex([
+        Intent("short", ["orders"], ""),
+        Intent("long", ["orders by status"], ""),
+    ])
+    assert index.match("show orders by status").name == "long"
+
+def test_more_distinct_phrases_break_ties():
+    index = IntentIndex([
+        Intent("first", ["revenue"], ""),
+        Intent("second", ["orders", "purchases"], ""),
+    ])
+    assert index.match("revenue from orders and purchases").name == "second"
+
+def test_ties_go_to_the_intent_declared_first():
+    assert intent_index.match("revenue and orders").name == CHAT_INTENTS[0].name
+
+def test_normalize_question_keeps_plurals_distinct():
+    assert normalize_question("What's the  Order value?") == "what s the order value"
+    assert normalize_question("orders") != normalize_question("order")
@@ -0,0 +1,20 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.pagination import decode_cursor, encode_cursor, search_pattern
+
+def test_cursor_round_trips():
+    created_at, id = datetime(2026, 3, 4, 5, 6, 7, 890000), uuid.uuid4()
+    cursor = encode_cursor(created_at, id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, id)
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "bnVsbA", encode_cursor(datetime(2026, 1, 1), "x")])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_search_pattern_escapes_wildcards():
+    assert search_pattern("50%_off\\") == "%50\\%\\_off\\\\%"
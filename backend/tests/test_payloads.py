@@ -0,0 +1,22 @@
+import pytest
+
+from app.payloads import ARROW_STREAM, COLUMNAR_JSON, negotiate
+
+@pytest.mark.parametrize("accept, format", [
+    (None, "json"),
+    ("", "json"),
+    ("application/json", "json"),
+    ("*/*", "json"),
+    ("text/html", "json"),
+    (COLUMNAR_JSON, "columnar"),
+    (ARROW_STREAM, "arrow"),
+    (f"{ARROW_STREAM}, {COLUMNAR_JSON}", "arrow"),
+    (f"{COLUMNAR_JSON};q=0.5, {ARROW_STREAM}", "arrow"),
+    (f"application/json;q=0.9, {COLUMNAR_JSON}", "columnar"),
+    (f"{ARROW_STREAM};q=0, application/json", "json"),
+    (f"{ARROW_STREAM};q=bad, {COLUMNAR_JSON}", "columnar"),
+    (f"text/html, {COLUMNAR_JSON};q=0.8", "columnar"),
+    ("APPLICATION/VND.APACHE.ARROW.STREAM", "arrow"),
+])
+def test_negotiate(accept, format):
+    assert negotiate(accept) == format
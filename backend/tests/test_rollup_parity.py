@@ -0,0 +1,45 @@
+"""Raw and rollup dashboard KPIs agree.
+
+Needs a disposable Postgres in TEST_DATABASE_URL: the sample tables are regenerated.
+"""
+import os
+import asyncio
+
+import asyncpg
+import pytest
+
+from app.kpis import DASHBOARD_KPIS_SQL, ROLLUP_DASHBOARD_KPIS_SQL
+from app.migrations import migrate
+from app.seed import generate_sample_data
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+def fetch_kpis(users: int):
+    async def run():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await migrate(conn, log=None)
+            await generate_sample_data(conn, users=users, products=20, orders=5000, days=60)
+            return await conn.fetchrow(DASHBOARD_KPIS_SQL), await conn.fetchrow(ROLLUP_DASHBOARD_KPIS_SQL)
+        finally:
+            await conn.close()
+    return asyncio.run(run())
+
+def assert_exact_columns_match(raw, rollup):
+    assert rollup["total_revenue"] == raw["total_revenue"]
+    assert rollup["total_orders"] == raw["total_orders"]
+    assert round(rollup["avg_order_value"], 2) == round(raw["avg_order_value"], 2)
+
+def test_rollup_kpis_match_raw():
+    raw, rollup = fetch_kpis(users=500)
+    assert_exact_columns_match(raw, rollup)
+    # Below the sketch size the distinct count is exact too
+    assert rollup["active_users"] == raw["active_users"]
+
+def test_rollup_active_users_is_an_estimate_beyond_sketch_size():
+    raw, rollup = fetch_kpis(users=3000)
+    assert raw["active_users"] > 1024
+    assert_exact_columns_match(raw, rollup)
+    assert abs(rollup["active_users"] - raw["active_users"]) <= 0.1 * raw["active_users"]
@@ -0,0 +1,43 @@
+import uuid
+from datetime import datetime, timedelta
+
+from app.scheduler import EPOCH, due_at
+
+STARTED_AT = datetime(2026, 1, 1, 12, 0)
+
+def metric(interval, last_run=None, id=None):
+    return {"id": id or uuid.uuid4(), "refresh_interval_seconds": interval, "last_run": last_run}
+
+def test_never_run_is_due_within_jitter_window():
+    for _ in range(20):
+        due = due_at(metric(600), STARTED_AT)
+        assert STARTED_AT <= due <= STARTED_AT + timedelta(seconds=60)
+
+def test_jitter_window_is_capped():
+    due = due_at(metric(86400), STARTED_AT)
+    assert due <= STARTED_AT + timedelta(seconds=300)
+
+def test_next_run_is_on_the_metric_grid():
+    # Last run after the scheduler started, so nothing is overdue
+    m = metric(600, last_run=STARTED_AT + timedelta(hours=1))
+    due = due_at(m, STARTED_AT)
+    assert m["last_run"] < due <= m["last_run"] + timedelta(seconds=600)
+    # Later runs land on the same phase-shifted slots
+    assert due_at({**m, "last_run": due + timedelta(seconds=5)}, STARTED_AT) == due + timedelta(seconds=600)
+    # Including a run that finished exactly on its slot
+    assert due_at({**m, "last_run": due}, STARTED_AT) == due + timedelta(seconds=600)
+
+def test_phase_is_stable_per_metric():
+    id = uuid.uuid4()
+    last_run = STARTED_AT - timedelta(seconds=30)
+    assert due_at(metric(600, last_run, id), STARTED_AT) == due_at(metric(600, last_run, id), STARTED_AT)
+
+def test_phases_spread_metrics_with_the_same_interval():
+    last_run = STARTED_AT - timedelta(seconds=30)
+    slots = {(due_at(metric(3600, last_run), STARTED_AT) - EPOCH).total_seconds() % 3600 for _ in range(20)}
+    assert len(slots) > 1
+
+def test_overdue_metric_catches_up_once_after_start():
+    m = metric(600, last_run=STARTED_AT - timedelta(days=2))
+    due = due_at(m, STARTED_AT)
+    assert STARTED_AT <= due <= STARTED_AT + timedelta(seconds=60)
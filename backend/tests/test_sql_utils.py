@@ -0,0 +1,19 @@
+from app.sql_utils import normalize_sql, fingerprint_sql
+
+def test_normalize_collapses_whitespace_case_and_comments():
+    sql = """
+        SELECT COUNT(*)  -- all of them
+        FROM /* the */ Orders;
+    """
+    assert normalize_sql(sql) == "select count(*) from orders"
+
+def test_normalize_keeps_quoted_text():
+    assert normalize_sql("SELECT 'A  B', \"Mixed Case\" FROM t") == "select 'A  B', \"Mixed Case\" from t"
+    assert normalize_sql("SELECT '-- not a comment'") == "select '-- not a comment'"
+
+def test_normalize_keeps_operators():
+    assert normalize_sql("SELECT a-b, a/b FROM t") == "select a-b, a/b from t"
+
+def test_fingerprint_replaces_literals():
+    assert fingerprint_sql("SELECT * FROM t WHERE a = 'x' AND b > 10.5") == "select * from t where a = ? and b > ?"
+    assert fingerprint_sql("SELECT col1 FROM t2 WHERE c = $1") == "select col1 from t2 where c = $1"
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.workloads import AdmissionController, WorkloadClass, WorkloadSaturated
+
+def classes(max_queue=10, queue_timeout_ms=1000):
+    return {
+        "interactive": WorkloadClass("interactive", 0, 1.0, max_queue, queue_timeout_ms),
+        "runs": WorkloadClass("runs", 1, 0.75, max_queue, queue_timeout_ms),
+        "batch": WorkloadClass("batch", 2, 0.5, max_queue, queue_timeout_ms),
+    }
+
+def test_limits_are_shares_of_capacity():
+    controller = AdmissionController(4, "test", classes())
+    assert controller.limits == {"interactive": 4, "runs": 3, "batch": 2}
+    # Every class gets at least one slot
+    assert AdmissionController(1, "test", classes()).limits == {"interactive": 1, "runs": 1, "batch": 1}
+
+def test_lower_classes_leave_slots_for_higher_ones():
+    async def run():
+        controller = AdmissionController(4, "test", classes())
+        await controller.acquire("batch")
+        await controller.acquire("batch")
+        # Batch is at its share, but runs may still take the third slot
+        await controller.acquire("runs")
+        assert not controller._can_take("batch")
+        assert not controller._can_take("runs")
+        await controller.acquire("interactive")
+        return controller
+    assert asyncio.run(run()).in_use == {"interactive": 1, "runs": 1, "batch": 2}
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    async def run():
+        controller = AdmissionController(1, "test", classes())
+        token = await controller.acquire("interactive")
+        batch = asyncio.ensure_future(controller.acquire("batch"))
+        interactive = asyncio.ensure_future(controller.acquire("interactive"))
+        await asyncio.sleep(0)
+        controller.release(token)
+        await interactive
+        # The batch waiter queued first but is still waiting
+        assert not batch.done()
+        batch.cancel()
+        return controller
+    assert asyncio.run(run()).in_use == {"interactive": 1, "runs": 0, "batch": 0}
+
+def test_rejects_when_queue_is_full():
+    async def run():
+        controller = AdmissionController(1, "test", classes(max_queue=1))
+        await controller.acquire("interactive")
+        waiter = asyncio.ensure_future(controller.acquire("interactive"))
+        await asyncio.sleep(0)
+        with pytest.raises(WorkloadSaturated) as saturated:
+            await controller.acquire("interactive")
+        waiter.cancel()
+        return controller, saturated.value
+    controller, error = asyncio.run(run())
+    assert error.reason == "queue_full"
+    assert error.retry_after >= 1
+    assert controller.rejected[("interactive", "queue_full")] == 1
+
+def test_rejects_when_wait_times_out():
+    async def run():
+        controller = AdmissionController(1, "test", classes(queue_timeout_ms=10))
+        await controller.acquire("interactive")
+        with pytest.raises(WorkloadSaturated) as saturated:
+            await controller.acquire("interactive")
+        return controller, saturated.value
+    controller, error = asyncio.run(run())
+    assert error.reason == "timeout"
+    assert controller.queued("interactive") == 0
+    assert controller.rejected[("interactive", "timeout")] == 1
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        controller = AdmissionController(1, "test", classes())
+        token = await controller.acquire("interactive")
+        waiter = asyncio.ensure_future(controller.acquire("interactive"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        controller.release(token)
+        return controller
+    controller = asyncio.run(run())
+    assert controller.queued("interactive") == 0
+    assert controller.in_use["interactive"] == 0
+
+def test_admit_releases_on_error():
+    async def run():
+        controller = AdmissionController(1, "test", classes())
+        with pytest.raises(RuntimeError):
+            async with controller.admit("interactive"):
+                raise RuntimeError
+        return controller
+    assert asyncio.run(run()).in_use["interactive"] == 0
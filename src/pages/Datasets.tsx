@@ -1,7 +1,8 @@
-import React, { useState } from 'react'
-import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
-import { Database, Plus, Settings, Trash2, CheckCircle, XCircle } from 'lucide-react'
+import React, { useEffect, useState } from 'react'
+import { useInfiniteQuery, useMutation, useQueryClient } from '@tanstack/react-query'
+import { Database, Plus, Settings, Trash2, CheckCircle, XCircle, Search } from 'lucide-react'
 import axios from 'axios'
+import { fetchPage } from '../utils/pagination'
 
 interface Dataset {
   id: string
@@ -27,15 +28,24 @@ const Datasets: React.FC = () => {
     password: ''
   })
 
+  const [search, setSearch] = useState('')
+  const [filters, setFilters] = useState({ q: '', type: '', status: '' })
+
   const queryClient = useQueryClient()
 
-  const { data: datasets, isLoading } = useQuery({
-    queryKey: ['datasets'],
-    queryFn: async () => {
-      const response = await axios.get('/api/datasets')
-      return response.data
-    }
+  // Search once typing pauses rather than on every keystroke
+  useEffect(() => {
+    const timer = setTimeout(() => setFilters((f) => ({ ...f, q: search.trim() })), 300)
+    return () => clearTimeout(timer)
+  }, [search])
+
+  const { data, isLoading, fetchNextPage, hasNextPage, isFetchingNextPage } = useInfiniteQuery({
+    queryKey: ['datasets', filters],
+    queryFn: ({ pageParam }) => fetchPage<Dataset>('/api/datasets', filters, pageParam),
+    initialPageParam: undefined as string | undefined,
+    getNextPageParam: (lastPage) => lastPage.nextCursor
   })
+  const datasets = data?.pages.flatMap((page) => page.items)
 
   const addDatasetMutation = useMutation({
     mutationFn: async (data: typeof formData) => {
@@ -228,6 +238,39 @@ const Datasets: React.FC = () => {
         </div>
       )}
 
+      {/* Filters */}
+      <div className="flex flex-col md:flex-row gap-4">
+        <div className="relative flex-1">
+          <Search className="h-4 w-4 text-gray-400 absolute left-3 top-1/2 -translate-y-1/2" />
+          <input
+            type="text"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+            className="input pl-9"
+            placeholder="Search datasets by name or database..."
+          />
+        </div>
+        <select
+          value={filters.type}
+          onChange={(e) => setFilters({ ...filters, type: e.target.value })}
+          className="input md:w-48"
+        >
+          <option value="">All types</option>
+          <option value="postgresql">PostgreSQL</option>
+          <option value="mysql">MySQL</option>
+        </select>
+        <select
+          value={filters.status}
+          onChange={(e) => setFilters({ ...filters, status: e.target.value })}
+          className="input md:w-48"
+        >
+          <option value="">All statuses</option>
+          <option value="connected">Connected</option>
+          <option value="disconnected">Disconnected</option>
+          <option value="error">Connection Error</option>
+        </select>
+      </div>
+
       {/* Datasets List */}
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
         {isLoading ? (
@@ -283,6 +326,21 @@ const Datasets: React.FC = () => {
           ))
         )}
       </div>
+      {!isLoading && datasets?.length === 0 && (
+        <p className="text-sm text-gray-500">No datasets match these filters.</p>
+      )}
+
+      {hasNextPage && (
+        <div className="flex justify-center">
+          <button
+            onClick={() => fetchNextPage()}
+            disabled={isFetchingNextPage}
+            className="btn-secondary disabled:opacity-50"
+          >
+            {isFetchingNextPage ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   )
 }
@@ -1,7 +1,8 @@
-import React, { useState } from 'react'
-import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
-import { Target, Plus, Edit, Trash2, Play, History } from 'lucide-react'
+import React, { useEffect, useState } from 'react'
+import { useInfiniteQuery, useMutation, useQueryClient } from '@tanstack/react-query'
+import { Target, Plus, Edit, Trash2, Play, History, Search } from 'lucide-react'
 import axios from 'axios'
+import { fetchPage } from '../utils/pagination'
 
 interface Metric {
   id: string
@@ -25,15 +26,24 @@ const Metrics: React.FC = () => {
     category: 'revenue'
   })
 
+  const [search, setSearch] = useState('')
+  const [filters, setFilters] = useState({ q: '', category: '', status: '' })
+
   const queryClient = useQueryClient()
 
-  const { data: metrics, isLoading } = useQuery({
-    queryKey: ['metrics'],
-    queryFn: async () => {
-      const response = await axios.get('/api/metrics')
-      return response.data
-    }
+  // Search once typing pauses rather than on every keystroke
+  useEffect(() => {
+    const timer = setTimeout(() => setFilters((f) => ({ ...f, q: search.trim() })), 300)
+    return () => clearTimeout(timer)
+  }, [search])
+
+  const { data, isLoading, fetchNextPage, hasNextPage, isFetchingNextPage } = useInfiniteQuery({
+    queryKey: ['metrics', filters],
+    queryFn: ({ pageParam }) => fetchPage<Metric>('/api/metrics', filters, pageParam),
+    initialPageParam: undefined as string | undefined,
+    getNextPageParam: (lastPage) => lastPage.nextCursor
   })
+  const metrics = data?.pages.flatMap((page) => page.items)
 
   const addMetricMutation = useMutation({
     mutationFn: async (data: typeof formData) => {
@@ -230,6 +240,42 @@ const Metrics: React.FC = () => {
         </div>
       )}
 
+      {/* Filters */}
+      <div className="flex flex-col md:flex-row gap-4">
+        <div className="relative flex-1">
+          <Search className="h-4 w-4 text-gray-400 absolute left-3 top-1/2 -translate-y-1/2" />
+          <input
+            type="text"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+            className="input pl-9"
+            placeholder="Search metrics by name or description..."
+          />
+        </div>
+        <select
+          value={filters.category}
+          onChange={(e) => setFilters({ ...filters, category: e.target.value })}
+          className="input md:w-48"
+        >
+          <option value="">All categories</option>
+          {categories.map((cat) => (
+            <option key={cat.value} value={cat.value}>
+              {cat.label}
+            </option>
+          ))}
+        </select>
+        <select
+          value={filters.status}
+          onChange={(e) => setFilters({ ...filters, status: e.target.value })}
+          className="input md:w-48"
+        >
+          <option value="">All statuses</option>
+          <option value="active">Active</option>
+          <option value="draft">Draft</option>
+          <option value="archived">Archived</option>
+        </select>
+      </div>
+
       {/* Metrics List */}
       <div className="space-y-4">
         {isLoading ? (
@@ -306,7 +352,22 @@ const Metrics: React.FC = () => {
             </div>
           ))
         )}
+        {!isLoading && metrics?.length === 0 && (
+          <p className="text-sm text-gray-500">No metrics match these filters.</p>
+        )}
       </div>
+
+      {hasNextPage && (
+        <div className="flex justify-center">
+          <button
+            onClick={() => fetchNextPage()}
+            disabled={isFetchingNextPage}
+            className="btn-secondary disabled:opacity-50"
+          >
+            {isFetchingNextPage ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   )
 }
@@ -2,6 +2,7 @@ import React, { useState } from 'react'
 import { useQuery } from '@tanstack/react-query'
 import { Database, Table, Key, Link } from 'lucide-react'
 import axios from 'axios'
+import { fetchAllPages } from '../utils/pagination'
 
 interface Table {
   name: string
@@ -30,11 +31,8 @@ const SchemaExplorer: React.FC = () => {
   const [selectedTable, setSelectedTable] = useState<string>('')
 
   const { data: datasets } = useQuery({
-    queryKey: ['datasets'],
-    queryFn: async () => {
-      const response = await axios.get('/api/datasets')
-      return response.data
-    }
+    queryKey: ['datasets', 'all'],
+    queryFn: () => fetchAllPages<{ id: string; name: string }>('/api/datasets')
   })
 
   const { data: schema, isLoading } = useQuery({
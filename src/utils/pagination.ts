@@ -0,0 +1,31 @@
+import axios from 'axios'
+
+export interface Page<T> {
+  items: T[]
+  nextCursor?: string
+}
+
+type Filters = Record<string, string | undefined>
+
+// Empty filters are left out; the API rejects an empty search string
+const cleanParams = (filters: Filters) =>
+  Object.fromEntries(Object.entries(filters).filter(([, value]) => value))
+
+// One page of a catalog listing; the API returns the next page's cursor in X-Next-Cursor
+export async function fetchPage<T>(url: string, filters: Filters = {}, cursor?: string): Promise<Page<T>> {
+  const response = await axios.get<T[]>(url, { params: { ...cleanParams(filters), cursor } })
+  const next = response.headers['x-next-cursor']
+  return { items: response.data, nextCursor: typeof next === 'string' && next ? next : undefined }
+}
+
+// Every page of a catalog listing, for pickers that need the whole list
+export async function fetchAllPages<T>(url: string, filters: Filters = {}): Promise<T[]> {
+  const items: T[] = []
+  let cursor: string | undefined
+  do {
+    const page = await fetchPage<T>(url, filters, cursor)
+    items.push(...page.items)
+    cursor = page.nextCursor
+  } while (cursor)
+  return items
+}